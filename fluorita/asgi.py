@@ -12,5 +12,20 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fluorita.settings')
+# No ASGI as páginas de leitura mais acessadas usam as views assíncronas
+# (loja/views_assincronas.py). LOJA_VIEWS_ASSINCRONAS=False volta para as síncronas.
+os.environ.setdefault('LOJA_VIEWS_ASSINCRONAS', 'True')
+# Cada requisição ASGI usa o banco numa thread própria: conexões persistentes
+# não seriam reaproveitadas e ficariam abertas (veja a documentação do Django
+# sobre CONN_MAX_AGE com ASGI)
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
+
+# Templates da loja compilados na subida (veja fluorita/wsgi.py)
+from django.conf import settings  # noqa: E402
+
+if settings.LOJA_AQUECER_TEMPLATES:
+    from loja.aquecimento import aquecer_templates
+
+    aquecer_templates()
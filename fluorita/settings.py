@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 import os
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -43,23 +43,43 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Primeiro da lista para medir o tempo de toda a requisição (veja LOJA_INSTRUMENTACAO_AMOSTRAGEM)
+    'loja.middleware.InstrumentacaoMiddleware',
+    # Antes da sessão: escritas de sessão e login também fixam o navegador na primária
+    'loja.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    # Disponibiliza request.carrinho e grava o carrinho na resposta
+    'loja.middleware.CarrinhoMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
-ROOT_URLCONF = 'fluorita.urls'
+# Views assíncronas para as páginas de leitura mais acessadas (loja/views_assincronas.py).
+# O fluorita/asgi.py liga por padrão; no WSGI ficam as views síncronas.
+LOJA_VIEWS_ASSINCRONAS = config('LOJA_VIEWS_ASSINCRONAS', default=False, cast=bool)
+ROOT_URLCONF = 'fluorita.urls_asgi' if LOJA_VIEWS_ASSINCRONAS else 'fluorita.urls'
+
+# Templates: com LOJA_TEMPLATES_CACHE (padrão) o loader com cache guarda cada
+# template já compilado na memória do processo, com DEBUG ligado ou não (no
+# runserver ele é limpo quando um template muda). Os templates do projeto são
+# compilados na subida de cada processo com LOJA_AQUECER_TEMPLATES
+# (fluorita/wsgi.py e fluorita/asgi.py; veja loja/aquecimento.py).
+LOJA_TEMPLATES_CACHE = config('LOJA_TEMPLATES_CACHE', default=True, cast=bool)
+LOJA_AQUECER_TEMPLATES = config('LOJA_AQUECER_TEMPLATES', default=not DEBUG, cast=bool)
+_LOADERS_TEMPLATES = [
+    # adicionado os diretório de templates globais (DIRS) e os templates dos apps (admin, jazzmin...)
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
 
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
-        # adicionado os diretório de templates globais
         'DIRS': [BASE_DIR / "templates"],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -67,6 +87,10 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            'loaders': (
+                [('django.template.loaders.cached.Loader', _LOADERS_TEMPLATES)] if LOJA_TEMPLATES_CACHE
+                else _LOADERS_TEMPLATES
+            ),
         },
     },
 ]
@@ -77,17 +101,114 @@ WSGI_APPLICATION = 'fluorita.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
+# Por padrão usa MySQL com as credenciais do .env. Com DB_ENGINE=django.db.backends.sqlite3
+# o projeto roda sem servidor de banco (útil para os testes e benchmarks em loja/tests.py).
+DB_ENGINE = config('DB_ENGINE', default='django.db.backends.mysql')
+
+if DB_ENGINE == 'django.db.backends.sqlite3':
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': config('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': DB_ENGINE,
+            'NAME': config('DB_NAME'),
+            'USER': config('DB_USER'),
+            'PASSWORD': config('DB_PASSWORD'),
+            'HOST': config('DB_HOST'),
+            'PORT': config('DB_PORT', default='3306'),
+        }
+    }
+
+# Conexões persistentes: cada thread do servidor mantém a conexão com o banco
+# por até DB_CONN_MAX_AGE segundos (0 fecha ao fim de cada requisição, como
+# antes) e, com DB_CONN_HEALTH_CHECKS, o Django testa se ela ainda responde
+# antes de reutilizá-la numa nova requisição. Mantenha abaixo do wait_timeout
+# do MySQL. Vale também para as réplicas abaixo (veja loja/conexoes.py).
+DATABASES['default']['CONN_MAX_AGE'] = config('DB_CONN_MAX_AGE', default=60, cast=int)
+DATABASES['default']['CONN_HEALTH_CHECKS'] = config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool)
+# Abre as conexões na subida de cada processo do servidor WSGI (fluorita/wsgi.py)
+LOJA_AQUECER_CONEXOES = config('LOJA_AQUECER_CONEXOES', default=False, cast=bool)
+
+# Réplicas de leitura (opcional): lista separada por vírgulas com o HOST de
+# cada réplica no MySQL (mesmo banco, usuário e senha da primária) ou o
+# arquivo no SQLite. Cada uma vira um alias replica_1, replica_2... As views de
+# catálogo e histórico e as listas do admin leem delas; escritas e o checkout
+# ficam na primária (veja loja/replicas.py).
+DB_REPLICAS = config('DB_REPLICAS', default='', cast=Csv())
+for numero, replica in enumerate(DB_REPLICAS, start=1):
+    DATABASES[f'replica_{numero}'] = {
+        **DATABASES['default'],
+        ('NAME' if DB_ENGINE == 'django.db.backends.sqlite3' else 'HOST'): replica,
+        # Nos testes a réplica aponta para o banco de teste da primária
+        'TEST': {'MIRROR': 'default'},
+    }
+LOJA_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['loja.replicas.RoteadorReplicas']
+# Por quantos segundos, depois de uma escrita, o navegador lê só da primária
+LOJA_REPLICA_FIXAR_SEGUNDOS = config('LOJA_REPLICA_FIXAR_SEGUNDOS', default=10, cast=int)
+
+
+# Cache
+# Em desenvolvimento usa a memória local do processo (LocMemCache). Em produção
+# aponte CACHE_BACKEND/CACHE_LOCATION no .env para um cache compartilhado
+# (ex: django.core.cache.backends.redis.RedisCache ou memcached).
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
-        'NAME': config('DB_NAME'),
-        'USER': config('DB_USER'),
-        'PASSWORD': config('DB_PASSWORD'),
-        'HOST': config('DB_HOST'),
-        'PORT': config('DB_PORT', default='3306'),
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='fluorita'),
     }
 }
 
+# Onde o carrinho de compras é guardado (veja loja/carrinho.py):
+# loja.carrinho.ArmazenamentoCookie, loja.carrinho.ArmazenamentoCache ou loja.carrinho.ArmazenamentoSessao
+LOJA_CARRINHO_ARMAZENAMENTO = config('LOJA_CARRINHO_ARMAZENAMENTO', default='loja.carrinho.ArmazenamentoCookie')
+
+# Sessões (veja loja/sessoes.py): django.contrib.sessions.backends.cached_db (lê do
+# cache, grava no banco só quando a sessão muda), .cache (só o cache, que precisa
+# ser compartilhado e persistente) ou .db (sempre no banco). O padrão é o
+# cached_db quando CACHE_BACKEND aponta para um cache compartilhado; com o cache
+# local de cada processo (LocMemCache) ou o DummyCache o padrão é o .db, senão
+# cada worker serviria a sua cópia da sessão (logout, login e carrinho não
+# apareceriam nos outros). As mensagens continuam no cookie (padrão do Django) e
+# só vão para a sessão se não couberem.
+# Nos modos com banco, agende "python manage.py limpar_sessoes" no lugar do clearsessions.
+LOJA_CACHE_LOCAL = CACHES['default']['BACKEND'] in (
+    'django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache',
+)
+SESSION_ENGINE = config(
+    'SESSION_ENGINE',
+    default='django.contrib.sessions.backends.db' if LOJA_CACHE_LOCAL else 'django.contrib.sessions.backends.cached_db',
+)
+
+# Fração das requisições (0 a 1) medidas pelo InstrumentacaoMiddleware: consultas,
+# tempo de SQL, de templates, cache e tempo total, no cabeçalho Server-Timing e
+# no logger 'loja.instrumentacao'. Com 0 o middleware fica desligado.
+LOJA_INSTRUMENTACAO_AMOSTRAGEM = config('LOJA_INSTRUMENTACAO_AMOSTRAGEM', default=0.0, cast=float)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'loja.instrumentacao': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'loja.imagens': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+        'loja.conexoes': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+        'loja.estaticos': {'handlers': ['console'], 'level': 'WARNING', 'propagate': False},
+    },
+}
+
+# Tempo máximo (em segundos) que o snapshot da página de produto fica em cache.
+# A invalidação é feita pelos sinais; este valor só limita a memória usada.
+LOJA_CACHE_PRODUTO_TIMEOUT = config('LOJA_CACHE_PRODUTO_TIMEOUT', default=60 * 60 * 24, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -125,6 +246,26 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / "static"]
+# Destino do "python manage.py collectstatic"
+STATIC_ROOT = config('STATIC_ROOT', default=str(BASE_DIR / 'staticfiles'))
+
+# Em produção o collectstatic gera nomes com hash, versões .gz/.br (a .br exige o
+# pacote brotli do requirements.txt) e remove as webfonts do Font Awesome que não
+# são usadas (loja/estaticos.py). Exige rodar o collectstatic antes de subir o
+# servidor, por isso fica desligado com DEBUG.
+LOJA_ESTATICOS_MANIFESTO = config('LOJA_ESTATICOS_MANIFESTO', default=not DEBUG, cast=bool)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {
+        'BACKEND': (
+            'loja.estaticos.ArmazenamentoEstatico' if LOJA_ESTATICOS_MANIFESTO
+            else 'django.contrib.staticfiles.storage.StaticFilesStorage'
+        ),
+    },
+}
+# Serve STATIC_ROOT pelo Django (com as versões pré-comprimidas e cabeçalhos
+# de cache imutável) quando não há um nginx na frente
+LOJA_SERVIR_ESTATICOS = config('LOJA_SERVIR_ESTATICOS', default=False, cast=bool)
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -191,10 +332,17 @@ MEDIA_ROOT = BASE_DIR / 'media/'
 # Direciona a saída de e-mails para o console
 #EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 # Configuração de E-mail para Produção (usando Gmail)
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Pode ser trocado no .env (ex: locmem ou filebased em desenvolvimento e testes)
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
+EMAIL_FILE_PATH = config('EMAIL_FILE_PATH', default=str(BASE_DIR / 'emails'))
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 # Lê as credenciais do arquivo .env
-EMAIL_HOST_USER = config('EMAIL_HOST_USER')
-EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
\ No newline at end of file
+EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
+# Timeout (em segundos) das operações SMTP, para um servidor lento não prender o envio
+EMAIL_TIMEOUT = config('EMAIL_TIMEOUT', default=10, cast=int)
+# A conexão SMTP fica aberta entre os envios (loja/conexoes.py); parada por mais
+# que estes segundos, recebe um NOOP antes de ser reutilizada
+LOJA_SMTP_VERIFICAR_APOS = config('LOJA_SMTP_VERIFICAR_APOS', default=30, cast=int)
\ No newline at end of file
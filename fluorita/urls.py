@@ -14,8 +14,10 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
 from django.conf import settings
 from django.conf.urls.static import static
 
@@ -28,3 +30,9 @@ urlpatterns = [
 if settings.DEBUG:
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
 
+if settings.LOJA_SERVIR_ESTATICOS:
+    # Arquivos do collectstatic servidos pelo Django (veja loja/estaticos.py)
+    from loja.estaticos import servir_estatico
+    prefixo = re.escape(settings.STATIC_URL.lstrip('/'))
+    urlpatterns += [re_path(rf'^{prefixo}(?P<caminho>.*)$', servir_estatico)]
+
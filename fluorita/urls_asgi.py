@@ -0,0 +1,27 @@
+"""
+URLs do projeto no ASGI (ROOT_URLCONF com LOJA_VIEWS_ASSINCRONAS ligado).
+
+Iguais a fluorita/urls.py, mas as views da loja que têm versão assíncrona em
+loja/views_assincronas.py (mesmo nome da URL) são trocadas por ela.
+"""
+from django.urls import URLPattern, include, path
+
+from loja import urls as urls_loja
+from loja import views_assincronas
+
+from .urls import urlpatterns as urls_projeto
+
+
+def trocar_por_assincronas(padroes):
+    return [
+        URLPattern(p.pattern, getattr(views_assincronas, p.name, p.callback), p.default_args, p.name)
+        if isinstance(p, URLPattern) else p
+        for p in padroes
+    ]
+
+
+urlpatterns = [
+    path('', include((trocar_por_assincronas(urls_loja.urlpatterns), urls_loja.app_name), namespace='loja'))
+    if getattr(p, 'namespace', None) == 'loja' else p
+    for p in urls_projeto
+]
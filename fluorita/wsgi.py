@@ -14,3 +14,22 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fluorita.settings')
 
 application = get_wsgi_application()
+
+# Com LOJA_AQUECER_CONEXOES, a conexão com o banco já está aberta quando chega a
+# primeira requisição. Só ajuda quando a thread que carrega este módulo também
+# atende as requisições (ex: gunicorn com workers "sync", sem --preload: com
+# --preload a conexão seria aberta antes do fork e dividida entre os workers).
+from django.conf import settings  # noqa: E402
+
+if settings.LOJA_AQUECER_CONEXOES:
+    from loja.conexoes import aquecer_conexoes
+
+    aquecer_conexoes()
+
+# Com LOJA_AQUECER_TEMPLATES, os templates da loja já estão compilados no cache
+# do processo quando chega a primeira requisição (com o gunicorn --preload, uma
+# vez só, antes do fork: os workers herdam o cache).
+if settings.LOJA_AQUECER_TEMPLATES:
+    from loja.aquecimento import aquecer_templates
+
+    aquecer_templates()
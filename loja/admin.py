@@ -1,24 +1,58 @@
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ERROR_FLAG
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponseRedirect
+from django.urls import path, reverse
 from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin
 from django.utils.translation import gettext_lazy as _ # Importante para os fieldsets
-from .models import Categoria, Produto, ItemPedido, Pedido, Avaliacao
+from django.utils import timezone
+from .models import Categoria, Produto, ItemPedido, Pedido, Avaliacao, EmailPendente
+from .busca import ids_encontrados, termos_consulta
+from .exportacao import FORMATOS, resposta_exportacao
+from .paginacao import PaginadorContagemEstimada
+from .pedidos import alterar_status
+from .replicas import ler_da_replica
+
+
+class LeituraReplicaAdminMixin:
+    # A lista (GET) lê de uma réplica, se houver (loja/replicas.py). POSTs da
+    # lista (ações em massa, edição na lista) continuam na primária.
+
+    def changelist_view(self, request, extra_context=None):
+        if request.method != 'GET':
+            return super().changelist_view(request, extra_context)
+        with ler_da_replica():
+            resposta = super().changelist_view(request, extra_context)
+            # TemplateResponse: as consultas do template também precisam rodar aqui dentro
+            if hasattr(resposta, 'render'):
+                resposta.render()
+        return resposta
 
 
 # --- Customização para Produtos e Categorias ---
 @admin.register(Categoria)
-class CategoriaAdmin(admin.ModelAdmin):
+class CategoriaAdmin(LeituraReplicaAdminMixin, admin.ModelAdmin):
     list_display = ('nome', 'slug')
     prepopulated_fields = {'slug': ('nome',)} # Preenche o slug automaticamente
 
 @admin.register(Produto)
-class ProdutoAdmin(admin.ModelAdmin):
+class ProdutoAdmin(LeituraReplicaAdminMixin, admin.ModelAdmin):
     list_display = ('nome', 'categoria', 'preco', 'estoque', 'disponivel')
     list_filter = ('categoria',)
+    # Só para o admin mostrar a caixa de busca: a busca em si usa o índice
+    # de termos (get_search_results abaixo), e não LIKE '%termo%' na descrição
     search_fields = ('nome', 'descricao')
     # Para preencher o slug automaticamente
     prepopulated_fields = {'slug': ('nome',)}
 
+    def get_search_results(self, request, queryset, search_term):
+        termos = termos_consulta(search_term)
+        if not termos:
+            return queryset, False
+        return queryset.filter(id__in=ids_encontrados(termos)), False
+
 # --- Customização para Pedidos ---
 
 # Esta classe permite que os Itens do Pedido sejam exibidos e editados
@@ -30,14 +64,26 @@ class ItemPedidoInline(admin.TabularInline):
     # Define campos que não podem ser editados (readonly).
     readonly_fields = ('produto', 'preco', 'quantidade')
 
+    def get_queryset(self, request):
+        # Carrega o produto de todos os itens junto, em vez de uma consulta por linha
+        return super().get_queryset(request).select_related('produto')
+
 
 # Esta é a customização principal para o modelo Pedido.
 @admin.register(Pedido)
-class PedidoAdmin(admin.ModelAdmin):
+class PedidoAdmin(LeituraReplicaAdminMixin, admin.ModelAdmin):
     # Campos a serem exibidos na lista de pedidos.
     list_display = ('id', 'usuario', 'criado_em', 'status', 'total')
+    # Traz o usuário no mesmo SELECT da lista (sem uma consulta por linha)
+    list_select_related = ('usuario',)
     # Filtros que aparecerão na barra lateral direita.
     list_filter = ('status', 'criado_em')
+    # Navegação por data, coberta pelos índices de Pedido em (status, criado_em) e (criado_em)
+    date_hierarchy = 'criado_em'
+    # Com milhões de pedidos, o COUNT(*) sem filtro vem das estatísticas da tabela
+    paginator = PaginadorContagemEstimada
+    # Evita o segundo COUNT(*) (do total sem filtros) quando há filtros aplicados
+    show_full_result_count = False
     # Campos pelos quais você poderá buscar.
     search_fields = ('usuario__username', 'id')
 
@@ -49,6 +95,57 @@ class PedidoAdmin(admin.ModelAdmin):
     # Evita que o admin altere acidentalmente dados que são calculados automaticamente.
     readonly_fields = ('usuario', 'criado_em', 'total')
 
+    # Ações em massa de status. Passam por alterar_status() para manter a
+    # tabela de compras entregues (quem pode avaliar) em dia.
+    actions = ['marcar_como_enviado', 'marcar_como_entregue', 'marcar_como_cancelado', 'exportar_csv', 'exportar_jsonl']
+    # Botões "Exportar" que levam os filtros atuais da lista
+    change_list_template = 'admin/loja/pedido/change_list.html'
+
+    def _alterar_status(self, request, queryset, status):
+        alterados = alterar_status(queryset, status)
+        self.message_user(request, f'{alterados} pedido(s) alterado(s) para "{dict(Pedido.STATUS_CHOICES)[status]}".')
+
+    @admin.action(description='Marcar como enviado')
+    def marcar_como_enviado(self, request, queryset):
+        self._alterar_status(request, queryset, 'enviado')
+
+    @admin.action(description='Marcar como entregue')
+    def marcar_como_entregue(self, request, queryset):
+        self._alterar_status(request, queryset, 'entregue')
+
+    @admin.action(description='Marcar como cancelado')
+    def marcar_como_cancelado(self, request, queryset):
+        self._alterar_status(request, queryset, 'cancelado')
+
+    # Exportação em streaming (loja/exportacao.py): das linhas selecionadas,
+    # pelas ações, ou de tudo o que a lista filtrada mostra, pelos botões
+    @admin.action(description='Exportar selecionados (CSV)')
+    def exportar_csv(self, request, queryset):
+        return resposta_exportacao(queryset, 'csv')
+
+    @admin.action(description='Exportar selecionados (JSONL)')
+    def exportar_jsonl(self, request, queryset):
+        return resposta_exportacao(queryset, 'jsonl')
+
+    def get_urls(self):
+        return [
+            path('exportar/<str:formato>/', self.admin_site.admin_view(self.exportar_view), name='loja_pedido_exportar'),
+        ] + super().get_urls()
+
+    def exportar_view(self, request, formato):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        if formato not in FORMATOS:
+            raise Http404('Formato de exportação desconhecido')
+        # Mesmos filtros, busca e data da lista (a querystring é a dela)
+        try:
+            lista = self.get_changelist_instance(request)
+        except IncorrectLookupParameters:
+            # Filtro inválido: como na changelist_view, volta para a lista com o aviso de erro
+            return HttpResponseRedirect(f'{reverse("admin:loja_pedido_changelist")}?{ERROR_FLAG}=1')
+        pedidos = lista.get_queryset(request)
+        return resposta_exportacao(pedidos, formato)
+
 
 class CustomUserAdmin(UserAdmin):
     """
@@ -67,12 +164,25 @@ class CustomUserAdmin(UserAdmin):
     )
 
 @admin.register(Avaliacao)
-class AvaliacaoAdmin(admin.ModelAdmin):
+class AvaliacaoAdmin(LeituraReplicaAdminMixin, admin.ModelAdmin):
     list_display = ('produto', 'usuario', 'nota', 'criado_em')
     list_filter = ('nota', 'criado_em')
     search_fields = ('produto__nome', 'usuario__username', 'comentario')
 
 
+@admin.register(EmailPendente)
+class EmailPendenteAdmin(LeituraReplicaAdminMixin, admin.ModelAdmin):
+    list_display = ('pedido', 'tipo', 'status', 'tentativas', 'proxima_tentativa', 'enviado_em')
+    list_filter = ('status', 'tipo')
+    list_select_related = ('pedido',)
+    readonly_fields = ('pedido', 'tipo', 'criado_em', 'enviado_em', 'ultimo_erro')
+    actions = ['reenfileirar']
+
+    @admin.action(description='Colocar novamente na fila')
+    def reenfileirar(self, request, queryset):
+        atualizados = queryset.update(status='pendente', tentativas=0, proxima_tentativa=timezone.now())
+        self.message_user(request, f'{atualizados} e-mail(s) colocados novamente na fila.')
+
 
 # Desregistra o UserAdmin padrão do Django
 admin.site.unregister(User)
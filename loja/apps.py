@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class LojaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'loja'
+
+    def ready(self):
+        # Registra os receptores de sinais (agregados de avaliações etc.)
+        from . import signals  # noqa: F401
+        # Métricas de abertura e reutilização de conexões
+        from . import conexoes  # noqa: F401
@@ -0,0 +1,115 @@
+import logging
+import statistics
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.template import RequestContext, TemplateDoesNotExist, TemplateSyntaxError, engines
+from django.test import RequestFactory
+
+
+# Compilação antecipada ("aquecimento") dos templates da loja.
+#
+# Com o loader com cache (LOJA_TEMPLATES_CACHE), cada processo compila um
+# template na primeira vez que ele é usado e o guarda na memória. Sem
+# aquecimento, as primeiras requisições depois de um deploy pagam a leitura
+# e a compilação de base.html e de cada template de loja/. aquecer_templates()
+# faz isso na subida do processo (fluorita/wsgi.py e fluorita/asgi.py, com
+# LOJA_AQUECER_TEMPLATES). Com o gunicorn --preload ela roda uma vez, antes
+# do fork, e os workers já nascem com os templates compilados.
+#
+# O comando "python manage.py aquecer_templates" compila todos (e falha se
+# algum tiver erro, útil no deploy) e, com --medir, compara a renderização a
+# frio (cache vazio) e a quente de cada template.
+
+logger = logging.getLogger('loja.aquecimento')
+
+# Pastas (dentro de DIRS) aquecidas, com as subpastas (loja/email, loja/parciais)
+PASTAS = ('loja',)
+# Fora dessas pastas, mas usado por todas as páginas via {% extends %}
+AVULSOS = ('base.html',)
+
+
+def templates_da_loja():
+    """Nomes (ex: 'loja/email/confirmacao_pedido.txt') dos templates aquecidos."""
+    nomes = set(AVULSOS)
+    for engine in settings.TEMPLATES:
+        for pasta in engine.get('DIRS', []):
+            for subpasta in PASTAS:
+                for arquivo in Path(pasta, subpasta).rglob('*'):
+                    if arquivo.is_file():
+                        nomes.add(arquivo.relative_to(pasta).as_posix())
+    return sorted(nomes)
+
+
+def _engine():
+    return engines['django'].engine
+
+
+def _limpar_cache():
+    for loader in _engine().template_loaders:
+        if hasattr(loader, 'reset'):
+            loader.reset()
+
+
+def aquecer_templates(nomes=None):
+    """
+    Compila os templates (e os que eles estendem ou incluem com nome fixo),
+    deixando-os no cache do loader. Retorna {nome: erro} dos que falharam.
+    """
+    erros = {}
+    for nome in nomes or templates_da_loja():
+        try:
+            _engine().get_template(nome)
+        except (TemplateDoesNotExist, TemplateSyntaxError) as erro:
+            erros[nome] = str(erro)
+            logger.error('Template %s não compilou: %s', nome, erro)
+    return erros
+
+
+def _renderizar(nome, request):
+    # Contexto vazio: mede o custo do template em si. Templates que exigem
+    # dados (ex: o e-mail do pedido) só têm a compilação medida.
+    template = _engine().get_template(nome)
+    try:
+        template.render(RequestContext(request, {}))
+    except Exception:
+        return False
+    return True
+
+
+def _cronometrar(funcao):
+    inicio = time.perf_counter()
+    resultado = funcao()
+    return time.perf_counter() - inicio, resultado
+
+
+def medir_templates(nomes=None, repeticoes=5):
+    """
+    Para cada template, a mediana (em ms) de compilar + renderizar com o cache
+    vazio ("frio", como logo depois de um deploy) e com o cache já aquecido
+    ("quente"). `renderiza` é False quando o template não renderiza sem
+    contexto; nesse caso os tempos são só da compilação.
+    """
+    request = RequestFactory().get('/')
+    request.user = AnonymousUser()
+    resultado = {}
+    for nome in nomes or templates_da_loja():
+        frio, quente = [], []
+        renderiza = True
+        for _ in range(repeticoes):
+            _limpar_cache()
+            duracao, ok = _cronometrar(lambda: _renderizar(nome, request))
+            frio.append(duracao)
+            renderiza = renderiza and ok
+        for _ in range(repeticoes):
+            quente.append(_cronometrar(lambda: _renderizar(nome, request))[0])
+        resultado[nome] = {
+            'frio_ms': round(statistics.median(frio) * 1000, 3),
+            'quente_ms': round(statistics.median(quente) * 1000, 3),
+            'renderiza': renderiza,
+        }
+    # O processo fica com todos os templates compilados
+    aquecer_templates(nomes)
+    return resultado
@@ -0,0 +1,205 @@
+import bisect
+import re
+import threading
+import time
+
+from django.core.cache import cache
+
+from .busca import normalizar
+from .models import Produto
+
+
+# Índice de prefixos para o autocompletar, guardado na memória de cada processo.
+#
+# Para cada produto disponível guardamos uma chave por palavra do nome, a
+# partir daquela palavra ("agua-marinha azul", "marinha azul", "azul"), em
+# ordem. Buscar um prefixo é um bisect seguido de uma varredura curta, sem
+# nenhuma consulta ao banco.
+#
+# As chaves ficam em blocos ordenados de até 2 * TAMANHO_BLOCO chaves, com a
+# primeira (chave, id) de cada bloco numa lista à parte (inicios). Alterar um
+# produto copia só os blocos das chaves dele e a lista de blocos (uma
+# referência por bloco), e não o índice inteiro.
+#
+# O índice é montado na primeira busca do processo. Alterações feitas neste
+# processo são aplicadas na hora (sinais de Produto, depois do COMMIT) e trocam
+# a versão guardada no cache (loja:autocompletar:versao); os outros processos
+# veem a versão nova e remontam o índice na busca seguinte.
+
+CHAVE_VERSAO = 'loja:autocompletar:versao'
+LIMITE_PADRAO = 10
+LIMITE_MAXIMO = 20
+TAMANHO_BLOCO = 512
+
+_INICIO_PALAVRA = re.compile(r'\w+')
+
+
+def _chaves(nome):
+    normalizado = normalizar(nome)
+    return {normalizado[m.start():] for m in _INICIO_PALAVRA.finditer(normalizado)}
+
+
+def _posicao(chaves, ids, chave, produto_id):
+    # Posição de (chave, produto_id) num bloco, ordenado por (chave, id)
+    inicio = bisect.bisect_left(chaves, chave)
+    fim = bisect.bisect_right(chaves, chave, inicio)
+    return bisect.bisect_left(ids, produto_id, inicio, fim)
+
+
+def _bloco(inicios, chave, produto_id):
+    # Índice do bloco onde (chave, produto_id) está ou deve entrar
+    return max(bisect.bisect_right(inicios, (chave, produto_id)) - 1, 0)
+
+
+class IndicePrefixos:
+    # Imutável: alterações criam um índice novo, então quem está lendo nunca
+    # vê os blocos pela metade (e não precisamos de trava na leitura)
+    __slots__ = ('versao', 'produtos', 'blocos', 'inicios')
+
+    def __init__(self, versao, produtos, blocos=None, inicios=None):
+        # produtos: {id: (nome, slug)}. blocos: [(chaves, ids)], cada um ordenado
+        # por (chave, id); vêm de com_produto(), sem eles o índice é montado do zero.
+        self.versao = versao
+        self.produtos = produtos
+        if blocos is None:
+            pares = sorted((chave, pid) for pid, (nome, _) in produtos.items() for chave in _chaves(nome))
+            blocos = [
+                ([chave for chave, _ in pares[i:i + TAMANHO_BLOCO]], [pid for _, pid in pares[i:i + TAMANHO_BLOCO]])
+                for i in range(0, len(pares), TAMANHO_BLOCO)
+            ]
+            inicios = [(chaves[0], ids[0]) for chaves, ids in blocos]
+        self.blocos = blocos
+        self.inicios = inicios
+
+    def com_produto(self, versao, produto_id, nome=None, slug=None):
+        """
+        Novo índice sem o produto e, se nome for informado, com os dados novos
+        dele. Só os blocos com chaves desse produto são copiados e alterados
+        (bisect); os outros são compartilhados com este índice.
+        """
+        produtos = dict(self.produtos)
+        anterior = produtos.pop(produto_id, None)
+        if nome is not None:
+            produtos[produto_id] = (nome, slug)
+
+        removidas = _chaves(anterior[0]) if anterior else set()
+        novas = _chaves(nome) if nome is not None else set()
+        if removidas == novas:
+            # Só o slug (ou nada) mudou: os blocos podem ser compartilhados
+            return IndicePrefixos(versao, produtos, self.blocos, self.inicios)
+
+        blocos, inicios = list(self.blocos), list(self.inicios)
+        for chave in removidas - novas:
+            n = _bloco(inicios, chave, produto_id)
+            chaves, ids = list(blocos[n][0]), list(blocos[n][1])
+            posicao = _posicao(chaves, ids, chave, produto_id)
+            del chaves[posicao], ids[posicao]
+            if chaves:
+                blocos[n], inicios[n] = (chaves, ids), (chaves[0], ids[0])
+            else:
+                del blocos[n], inicios[n]
+        for chave in novas - removidas:
+            if not blocos:
+                blocos.append(([chave], [produto_id]))
+                inicios.append((chave, produto_id))
+                continue
+            n = _bloco(inicios, chave, produto_id)
+            chaves, ids = list(blocos[n][0]), list(blocos[n][1])
+            posicao = _posicao(chaves, ids, chave, produto_id)
+            chaves.insert(posicao, chave)
+            ids.insert(posicao, produto_id)
+            if len(chaves) > 2 * TAMANHO_BLOCO:
+                # Bloco cheio: vira dois
+                metade = len(chaves) // 2
+                blocos[n:n + 1] = [(chaves[:metade], ids[:metade]), (chaves[metade:], ids[metade:])]
+                inicios[n:n + 1] = [(chaves[0], ids[0]), (chaves[metade], ids[metade])]
+            else:
+                blocos[n], inicios[n] = (chaves, ids), (chaves[0], ids[0])
+        return IndicePrefixos(versao, produtos, blocos, inicios)
+
+    def buscar(self, prefixo, limite=LIMITE_PADRAO):
+        prefixo = normalizar(prefixo).strip()
+        if not prefixo:
+            return []
+        encontrados = []
+        vistos = set()
+        # (prefixo,) vem antes de qualquer (chave, id) com chave >= prefixo
+        n = max(bisect.bisect_left(self.inicios, (prefixo,)) - 1, 0)
+        posicao = bisect.bisect_left(self.blocos[n][0], prefixo) if self.blocos else 0
+        for chaves, ids in self.blocos[n:]:
+            while posicao < len(chaves):
+                if not chaves[posicao].startswith(prefixo):
+                    return encontrados
+                pid = ids[posicao]
+                if pid not in vistos:
+                    vistos.add(pid)
+                    encontrados.append((pid, *self.produtos[pid]))
+                    if len(encontrados) >= limite:
+                        return encontrados
+                posicao += 1
+            posicao = 0
+        return encontrados
+
+
+_indice = None
+_trava = threading.Lock()
+
+
+def _nova_versao():
+    return str(time.time_ns())
+
+
+def _versao_atual():
+    versao = cache.get(CHAVE_VERSAO)
+    if versao is None:
+        versao = _nova_versao()
+        cache.add(CHAVE_VERSAO, versao, None)
+        versao = cache.get(CHAVE_VERSAO, versao)
+    return versao
+
+
+def indice():
+    """
+    Retorna o índice deste processo, remontando-o se a versão do cache mudou.
+    No caminho comum custa uma leitura de cache.
+    """
+    global _indice
+    versao = _versao_atual()
+    atual = _indice
+    if atual is not None and atual.versao == versao:
+        return atual
+    with _trava:
+        if _indice is None or _indice.versao != versao:
+            produtos = Produto.objects.filter(disponivel=True).values_list('id', 'nome', 'slug')
+            _indice = IndicePrefixos(versao, {pid: (nome, slug) for pid, nome, slug in produtos.iterator()})
+        return _indice
+
+
+def sugerir(prefixo, limite=LIMITE_PADRAO):
+    # Lista de (id, nome, slug) dos produtos cujo nome tem uma palavra começando com `prefixo`
+    return indice().buscar(prefixo, limite)
+
+
+def atualizar_produto(produto_id, nome=None, slug=None):
+    """
+    Aplica a alteração de um produto no índice deste processo (nome=None remove)
+    e troca a versão no cache para que os outros processos remontem o seu.
+    Se o índice deste processo já estava desatualizado (outro processo trocou
+    a versão), ele é descartado e remontado na busca seguinte.
+    """
+    global _indice
+    versao = _nova_versao()
+    with _trava:
+        anterior = cache.get(CHAVE_VERSAO)
+        cache.set(CHAVE_VERSAO, versao, None)
+        if _indice is None:
+            return
+        if _indice.versao == anterior:
+            _indice = _indice.com_produto(versao, produto_id, nome, slug)
+        else:
+            _indice = None
+
+
+def invalidar():
+    # Para alterações em massa (update/bulk_create não disparam sinais)
+    cache.set(CHAVE_VERSAO, _nova_versao(), None)
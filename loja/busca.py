@@ -0,0 +1,146 @@
+import re
+import unicodedata
+
+from django.db import connections, router
+from django.db.models import Count, Sum
+
+from .models import Categoria, Produto, TermoBusca
+from .paginacao import PaginaKeyset, limitar_tamanho, paginar_keyset
+
+
+# Busca de produtos por índice invertido (modelo TermoBusca).
+#
+# Nome e descrição são quebrados em termos normalizados (minúsculos, sem
+# acentos, sem palavras muito comuns) e gravados uma vez, quando o produto é
+# salvo. Na busca, os termos digitados passam pela mesma normalização e a
+# consulta é um "termo IN (...)" coberto pelo índice (termo, produto), que
+# funciona igual no SQLite e no MySQL.
+#
+# Todos os termos precisam aparecer no produto (busca do tipo "E"). A
+# relevância é a soma dos pesos dos termos encontrados.
+
+PESO_NOME = 3
+PESO_DESCRICAO = 1
+TAMANHO_MAXIMO_TERMO = 40  # Mesmo max_length de TermoBusca.termo
+MAX_TERMOS_CONSULTA = 8
+# Termos por executemany ao gravar o índice
+LOTE_TERMOS = 5000
+
+PALAVRAS_IGNORADAS = frozenset(
+    'a o as os um uma uns umas de da do das dos e em na no nas nos com sem para por pelo pela que ou'.split()
+)
+
+ORDENACAO_BUSCA = ('-relevancia', 'id')
+
+_PALAVRA = re.compile(r'\w+')
+
+
+def normalizar(texto):
+    # "Ametista Água-Marinha" -> "ametista agua-marinha"
+    decomposto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).lower()
+
+
+def tokenizar(texto):
+    termos = []
+    for palavra in _PALAVRA.findall(normalizar(texto)):
+        if len(palavra) < 2 or palavra in PALAVRAS_IGNORADAS:
+            continue
+        termos.append(palavra[:TAMANHO_MAXIMO_TERMO])
+    return termos
+
+
+def termos_produto(nome, descricao):
+    # {termo: peso}; um termo que aparece no nome e na descrição soma os dois pesos
+    pesos = dict.fromkeys(tokenizar(nome), PESO_NOME)
+    for termo in set(tokenizar(descricao)):
+        pesos[termo] = pesos.get(termo, 0) + PESO_DESCRICAO
+    return pesos
+
+
+def indexar_produtos(produtos):
+    """
+    Regrava os termos de busca dos produtos informados (objetos Produto com
+    nome e descrição carregados). Usado pelos sinais de Produto e pelo comando
+    reindexar_busca; chamadas a bulk_create/update de Produto precisam chamá-la.
+    """
+    produtos = list(produtos)
+    TermoBusca.objects.filter(produto__in=[p.pk for p in produtos]).delete()
+    _inserir_termos([
+        (termo, produto.pk, peso)
+        for produto in produtos
+        for termo, peso in termos_produto(produto.nome, produto.descricao).items()
+    ])
+
+
+def _inserir_termos(linhas):
+    # INSERT com executemany em vez de bulk_create: são dezenas de termos por
+    # produto, e montar um objeto TermoBusca para cada um dominava o tempo de
+    # uma importação de catálogo (loja/importacao.py)
+    conexao = connections[router.db_for_write(TermoBusca)]
+    campos = [TermoBusca._meta.get_field(nome).column for nome in ('termo', 'produto', 'peso')]
+    sql = 'INSERT INTO {} ({}) VALUES (%s, %s, %s)'.format(
+        conexao.ops.quote_name(TermoBusca._meta.db_table), ', '.join(conexao.ops.quote_name(c) for c in campos)
+    )
+    with conexao.cursor() as cursor:
+        for inicio in range(0, len(linhas), LOTE_TERMOS):
+            cursor.executemany(sql, linhas[inicio:inicio + LOTE_TERMOS])
+
+
+def termos_consulta(texto):
+    # Termos distintos da consulta, na ordem digitada
+    return list(dict.fromkeys(tokenizar(texto)))[:MAX_TERMOS_CONSULTA]
+
+
+def ids_encontrados(termos):
+    # Subconsulta com os ids dos produtos que têm TODOS os termos
+    return (
+        TermoBusca.objects.filter(termo__in=termos)
+        .order_by()
+        .values('produto_id')
+        .annotate(casados=Count('id'))
+        .filter(casados=len(termos))
+        .values('produto_id')
+    )
+
+
+def buscar_produtos(termos):
+    # Produtos que têm todos os termos, anotados com a relevância
+    return (
+        Produto.objects.select_related('categoria')
+        .filter(termos_busca__termo__in=termos)
+        .annotate(casados=Count('termos_busca'), relevancia=Sum('termos_busca__peso'))
+        .filter(casados=len(termos))
+    )
+
+
+def pagina_busca(filtros):
+    """
+    Retorna uma PaginaKeyset com os produtos encontrados, do mais relevante
+    para o menos relevante. Uma única consulta, não importa o tamanho do catálogo.
+    """
+    termos = termos_consulta(filtros.get('q'))
+    if not termos:
+        return PaginaKeyset([], ORDENACAO_BUSCA, tem_proximo=False, tem_anterior=False)
+
+    produtos = buscar_produtos(termos)
+    if filtros.get('categoria'):
+        produtos = produtos.filter(categoria__slug=filtros['categoria'])
+    return paginar_keyset(
+        produtos,
+        ORDENACAO_BUSCA,
+        cursor=filtros.get('cursor'),
+        tamanho=limitar_tamanho(filtros.get('tamanho')),
+    )
+
+
+def facetas_busca(filtros):
+    # Quantos produtos encontrados há em cada categoria (ignora o filtro de categoria)
+    termos = termos_consulta(filtros.get('q'))
+    if not termos:
+        return []
+    return list(
+        Categoria.objects.filter(produtos__in=ids_encontrados(termos))
+        .annotate(total=Count('produtos'))
+        .order_by('-total', 'nome')
+    )
@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from .catalogo import aprimeira_pagina_avaliacoes, pagina_avaliacoes
+from .instrumentacao import registrar_cache
+from .models import Produto
+from .replicas import ler_da_primaria
+
+
+# Cache da parte anônima (igual para todos os usuários) da página de produto.
+#
+# Cada produto tem uma "versão" guardada no cache (loja:produto:<slug>:versao).
+# O snapshot fica em loja:produto:<slug>:<versao>; para invalidar basta trocar
+# a versão, e o snapshot antigo simplesmente expira. As versões são trocadas
+# pelos sinais de Produto, Avaliacao e Categoria (loja/signals.py) e pela baixa
+# de estoque do checkout (loja/pedidos.py). Funciona com qualquer backend de
+# cache do Django, inclusive o LocMemCache.
+
+TIMEOUT_PRODUTO = getattr(settings, 'LOJA_CACHE_PRODUTO_TIMEOUT', 60 * 60 * 24)
+
+
+def _chave_versao(slug):
+    return f'loja:produto:{slug}:versao'
+
+
+def _nova_versao():
+    return str(time.time_ns())
+
+
+def invalidar_slugs(slugs):
+    # Uma única ida ao cache, não importa quantos produtos
+    versao = _nova_versao()
+    cache.set_many({_chave_versao(slug): versao for slug in slugs}, TIMEOUT_PRODUTO)
+
+
+def invalidar_produtos(ids):
+    invalidar_slugs(Produto.objects.filter(id__in=ids).values_list('slug', flat=True))
+
+
+def invalidar_categoria(categoria_id):
+    invalidar_slugs(Produto.objects.filter(categoria_id=categoria_id).values_list('slug', flat=True))
+
+
+def _criar_versao(slug):
+    # add() e não set(): se uma invalidação gravou a versão depois da nossa
+    # leitura, ela vence e o snapshot é montado para ela. Com set() a versão
+    # nova seria sobrescrita e um snapshot montado antes do COMMIT da
+    # alteração ficaria valendo até expirar.
+    versao = _nova_versao()
+    if cache.add(_chave_versao(slug), versao, TIMEOUT_PRODUTO):
+        return versao
+    return cache.get(_chave_versao(slug)) or versao
+
+
+async def _acriar_versao(slug):
+    versao = _nova_versao()
+    if await cache.aadd(_chave_versao(slug), versao, TIMEOUT_PRODUTO):
+        return versao
+    return await cache.aget(_chave_versao(slug)) or versao
+
+
+def _montar_snapshot(slug):
+    produto = Produto.objects.select_related('categoria').filter(slug=slug).first()
+    if produto is None:
+        return None
+    # Só a primeira página de avaliações entra no snapshot; as demais são
+    # buscadas sob demanda pelo endpoint JSON (views.avaliacoes_produto)
+    return _snapshot(produto, pagina_avaliacoes(produto.id))
+
+
+async def _amontar_snapshot(slug):
+    # Produto e avaliações ao mesmo tempo: as duas consultas só dependem do slug
+    produto, avaliacoes = await asyncio.gather(
+        Produto.objects.select_related('categoria').filter(slug=slug).afirst(),
+        aprimeira_pagina_avaliacoes(slug),
+    )
+    if produto is None:
+        return None
+    return _snapshot(produto, avaliacoes)
+
+
+def _snapshot(produto, avaliacoes):
+    return {
+        'produto': produto,
+        # Fragmentos renderizados sem request: não podem usar user, csrf etc.
+        'html_info': render_to_string('loja/parciais/produto_info.html', {'produto': produto}),
+        'html_avaliacoes': render_to_string('loja/parciais/produto_avaliacoes.html', {'avaliacoes': avaliacoes}),
+        'cursor_avaliacoes': avaliacoes.cursor_proximo,
+    }
+
+
+def snapshot_produto(slug):
+    """
+    Retorna o snapshot da página de produto ({'produto', 'html_info',
+    'html_avaliacoes', 'cursor_avaliacoes'}) ou None se o produto não existir.
+
+    Num acerto custa duas leituras de cache e nenhuma consulta ao banco.
+    """
+    versao = cache.get(_chave_versao(slug))
+    if versao is None:
+        versao = _criar_versao(slug)
+    else:
+        snapshot = cache.get(f'loja:produto:{slug}:{versao}')
+        if snapshot is not None:
+            registrar_cache(acerto=True)
+            return snapshot
+
+    registrar_cache(acerto=False)
+    # O snapshot fica no cache até a próxima alteração: nunca de uma réplica atrasada
+    with ler_da_primaria():
+        snapshot = _montar_snapshot(slug)
+    if snapshot is not None:
+        cache.set(f'loja:produto:{slug}:{versao}', snapshot, TIMEOUT_PRODUTO)
+    return snapshot
+
+
+async def asnapshot_produto(slug):
+    # Versão assíncrona de snapshot_produto, com as mesmas chaves de cache
+    versao = await cache.aget(_chave_versao(slug))
+    if versao is None:
+        versao = await _acriar_versao(slug)
+    else:
+        snapshot = await cache.aget(f'loja:produto:{slug}:{versao}')
+        if snapshot is not None:
+            registrar_cache(acerto=True)
+            return snapshot
+
+    registrar_cache(acerto=False)
+    with ler_da_primaria():
+        snapshot = await _amontar_snapshot(slug)
+    if snapshot is not None:
+        await cache.aset(f'loja:produto:{slug}:{versao}', snapshot, TIMEOUT_PRODUTO)
+    return snapshot
+
+
+def fragmentos(snapshot):
+    # O HTML já foi escapado quando o fragmento foi renderizado
+    return mark_safe(snapshot['html_info']), mark_safe(snapshot['html_avaliacoes'])
@@ -0,0 +1,223 @@
+import secrets
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+from .models import Produto
+
+
+# O carrinho guarda apenas {produto_id: quantidade}. Nome e preço são buscados
+# no banco na hora de exibir (uma consulta com in_bulk), então nada de strings
+# repetidas por linha e nenhum preço desatualizado guardado no cliente.
+#
+# Onde o carrinho fica é decidido pela configuração LOJA_CARRINHO_ARMAZENAMENTO:
+#   - ArmazenamentoCookie (padrão): cookie assinado e compacto, sem tocar no banco;
+#   - ArmazenamentoCache: só um identificador no cookie, itens no cache do Django;
+#   - ArmazenamentoSessao: dentro de request.session, no mesmo formato compacto
+#     do cookie ("12-2.15-1"), o que deixa a sessão gravada bem menor.
+#
+# O carrinho só é gravado quando os itens mudaram de fato: adicionar e remover
+# o mesmo produto na mesma requisição, ou remover um produto que não estava
+# no carrinho, não grava nada (na sessão, não marca a sessão como alterada).
+
+IDADE_MAXIMA = 60 * 60 * 24 * 14  # 2 semanas
+MAX_ITENS = 100  # Limita o tamanho do cookie (cada linha ocupa poucos bytes)
+
+
+def codificar(itens):
+    # Formato compacto: "12-2.15-1" (produto-quantidade separados por ponto)
+    return '.'.join(f'{pid}-{q}' for pid, q in sorted(itens.items()))
+
+
+def decodificar(valor):
+    itens = {}
+    for parte in filter(None, valor.split('.')):
+        produto_id, _, quantidade = parte.partition('-')
+        itens[produto_id] = quantidade
+    return itens
+
+
+class ArmazenamentoSessao:
+    chave = 'carrinho'
+
+    def __init__(self, request):
+        self.request = request
+
+    def carregar(self):
+        valor = self.request.session.get(self.chave, '')
+        if isinstance(valor, str):
+            return decodificar(valor)
+        itens = {}
+        for produto_id, item in valor.items():
+            # Carrinhos antigos guardavam um dicionário {produto_id: quantidade}
+            # ou, mais antigos ainda, {produto_id: {nome, preço, quantidade}}
+            itens[produto_id] = item['quantidade'] if isinstance(item, dict) else item
+        return itens
+
+    def salvar(self, response, itens):
+        if itens:
+            self.request.session[self.chave] = codificar(itens)
+        else:
+            self.request.session.pop(self.chave, None)
+
+
+class ArmazenamentoCookie:
+    nome_cookie = 'carrinho'
+    salt = 'loja.carrinho'
+
+    def __init__(self, request):
+        self.request = request
+
+    def carregar(self):
+        valor = self.request.get_signed_cookie(self.nome_cookie, default='', salt=self.salt, max_age=IDADE_MAXIMA)
+        return decodificar(valor)
+
+    def salvar(self, response, itens):
+        if not itens:
+            response.delete_cookie(self.nome_cookie, samesite='Lax')
+            return
+        response.set_signed_cookie(
+            self.nome_cookie, codificar(itens), salt=self.salt, max_age=IDADE_MAXIMA,
+            httponly=True, samesite='Lax', secure=settings.SESSION_COOKIE_SECURE,
+        )
+
+
+class ArmazenamentoCache:
+    nome_cookie = 'carrinho_id'
+    salt = 'loja.carrinho.id'
+
+    def __init__(self, request):
+        self.request = request
+        self.identificador = request.get_signed_cookie(self.nome_cookie, default=None, salt=self.salt)
+
+    def _chave(self):
+        return f'loja:carrinho:{self.identificador}'
+
+    def carregar(self):
+        if not self.identificador:
+            return {}
+        return cache.get(self._chave(), {})
+
+    def salvar(self, response, itens):
+        if not itens:
+            if self.identificador:
+                cache.delete(self._chave())
+            return
+        if not self.identificador:
+            self.identificador = secrets.token_urlsafe(16)
+            response.set_signed_cookie(
+                self.nome_cookie, self.identificador, salt=self.salt, max_age=IDADE_MAXIMA,
+                httponly=True, samesite='Lax', secure=settings.SESSION_COOKIE_SECURE,
+            )
+        cache.set(self._chave(), itens, IDADE_MAXIMA)
+
+
+def classe_armazenamento():
+    caminho = getattr(settings, 'LOJA_CARRINHO_ARMAZENAMENTO', 'loja.carrinho.ArmazenamentoCookie')
+    return import_string(caminho)
+
+
+class Carrinho:
+    """
+    Carrinho de compras da requisição atual (disponível como request.carrinho,
+    criado sob demanda pelo CarrinhoMiddleware).
+
+    As alterações ficam em memória e só são gravadas no armazenamento uma vez,
+    na resposta, e apenas se os itens ficaram diferentes dos carregados.
+    """
+
+    def __init__(self, request, armazenamento=None):
+        self.armazenamento = armazenamento or classe_armazenamento()(request)
+        self._itens = {}
+        try:
+            carregados = self.armazenamento.carregar()
+        except (signing.BadSignature, ValueError):
+            carregados = {}
+        for produto_id, quantidade in carregados.items():
+            try:
+                produto_id, quantidade = int(produto_id), int(quantidade)
+            except (TypeError, ValueError):
+                continue
+            if quantidade > 0:
+                self._itens[produto_id] = quantidade
+        self._salvos = dict(self._itens)
+
+    @property
+    def modificado(self):
+        return self._itens != self._salvos
+
+    def __len__(self):
+        return len(self._itens)
+
+    def __bool__(self):
+        return bool(self._itens)
+
+    def quantidades(self):
+        # Cópia de {produto_id: quantidade}, usada pelo checkout (loja/pedidos.py)
+        return dict(self._itens)
+
+    def adicionar(self, produto_id, quantidade=1):
+        produto_id = int(produto_id)
+        if produto_id not in self._itens and len(self._itens) >= MAX_ITENS:
+            return False
+        self._itens[produto_id] = self._itens.get(produto_id, 0) + quantidade
+        return True
+
+    def remover(self, produto_id):
+        try:
+            produto_id = int(produto_id)
+        except (TypeError, ValueError):
+            # Id inválido vindo da URL (ex: /carrinho/remover/abc/): não está no carrinho
+            return
+        self._itens.pop(produto_id, None)
+
+    def limpar(self):
+        self._itens = {}
+
+    def itens_detalhados(self):
+        """
+        Retorna (itens, total) com nome e preço atuais de cada produto, buscados
+        numa única consulta. Produtos que deixaram de existir são descartados.
+        """
+        return self._detalhar(self._produtos().in_bulk(list(self._itens)))
+
+    async def aitens_detalhados(self):
+        # Versão assíncrona de itens_detalhados (ORM assíncrono)
+        return self._detalhar(await self._produtos().ain_bulk(list(self._itens)))
+
+    def _produtos(self):
+        return Produto.objects.only('id', 'nome', 'preco', 'estoque')
+
+    def _detalhar(self, produtos):
+        itens = []
+        total = Decimal('0.00')
+        for produto_id, quantidade in self._itens.items():
+            produto = produtos.get(produto_id)
+            if produto is None:
+                continue
+            subtotal = produto.preco * quantidade
+            total += subtotal
+            itens.append({
+                'produto_id': produto_id,
+                'nome': produto.nome,
+                'preco': produto.preco,
+                'quantidade': quantidade,
+                'subtotal': subtotal,
+            })
+        return itens, total
+
+    def persistir(self, response):
+        if self.modificado:
+            self.armazenamento.salvar(response, self._itens)
+            self._salvos = dict(self._itens)
+
+
+async def acarregar_carrinho(request):
+    # Views assíncronas: o armazenamento pode ler a sessão no banco, então o
+    # carrinho é carregado fora do event loop
+    await sync_to_async(len)(request.carrinho)
+    return request.carrinho
@@ -0,0 +1,81 @@
+from .models import Avaliacao, Produto
+from .paginacao import apaginar_keyset, limitar_tamanho, paginar_keyset
+
+
+# Ordenação estável do catálogo. O 'id' no final desempata produtos com o
+# mesmo nome e é coberto pelo índice 'produto_nome_id_idx'.
+ORDENACAO_CATALOGO = ('nome', 'id')
+
+
+def filtrar_produtos(filtros):
+    # Aplica os filtros já validados pelo FiltroCatalogoForm
+    produtos = Produto.objects.select_related('categoria')
+
+    if filtros.get('categoria'):
+        produtos = produtos.filter(categoria__slug=filtros['categoria'])
+    if filtros.get('disponivel') is not None:
+        produtos = produtos.filter(disponivel=filtros['disponivel'])
+    if filtros.get('preco_min') is not None:
+        produtos = produtos.filter(preco__gte=filtros['preco_min'])
+    if filtros.get('preco_max') is not None:
+        produtos = produtos.filter(preco__lte=filtros['preco_max'])
+
+    return produtos
+
+
+def pagina_catalogo(filtros):
+    """
+    Retorna uma página do catálogo com os filtros aplicados.
+
+    O custo é constante: uma única consulta para os produtos, com a categoria
+    via JOIN. As notas vêm dos agregados guardados no próprio Produto.
+    """
+    return paginar_keyset(
+        filtrar_produtos(filtros),
+        ORDENACAO_CATALOGO,
+        cursor=filtros.get('cursor'),
+        tamanho=limitar_tamanho(filtros.get('tamanho')),
+    )
+
+
+async def apagina_catalogo(filtros):
+    return await apaginar_keyset(
+        filtrar_produtos(filtros),
+        ORDENACAO_CATALOGO,
+        cursor=filtros.get('cursor'),
+        tamanho=limitar_tamanho(filtros.get('tamanho')),
+    )
+
+
+# Avaliações de um produto, da mais recente para a mais antiga. O 'id'
+# desempata avaliações gravadas no mesmo instante. Coberto pelo índice
+# 'avaliacao_produto_criado_idx' (produto, criado_em).
+ORDENACAO_AVALIACOES = ('-criado_em', '-id')
+AVALIACOES_POR_PAGINA = 10
+AVALIACOES_POR_PAGINA_MAXIMO = 50
+
+
+def _avaliacoes(**filtro):
+    # Só as colunas exibidas
+    return (
+        Avaliacao.objects.filter(**filtro)
+        .select_related('usuario')
+        .only('id', 'nota', 'comentario', 'criado_em', 'usuario__username')
+    )
+
+
+def pagina_avaliacoes(produto_id, cursor=None, tamanho=None):
+    # Uma única consulta por página
+    return paginar_keyset(
+        _avaliacoes(produto_id=produto_id),
+        ORDENACAO_AVALIACOES,
+        cursor=cursor,
+        tamanho=limitar_tamanho(tamanho, padrao=AVALIACOES_POR_PAGINA, maximo=AVALIACOES_POR_PAGINA_MAXIMO),
+    )
+
+
+async def aprimeira_pagina_avaliacoes(produto_slug):
+    # Pelo slug (JOIN com o produto): pode rodar junto com a consulta do próprio produto
+    return await apaginar_keyset(
+        _avaliacoes(produto__slug=produto_slug), ORDENACAO_AVALIACOES, tamanho=AVALIACOES_POR_PAGINA,
+    )
@@ -0,0 +1,193 @@
+import asyncio
+import hashlib
+from functools import lru_cache, wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.db.models import Count, Max
+from django.views.decorators.http import condition
+
+from .cache import asnapshot_produto, snapshot_produto
+from .elegibilidade import aprodutos_avaliaveis, produtos_avaliaveis
+from .estaticos import templates_do_projeto
+from .models import Categoria, Produto
+
+
+# Validadores de GET condicional (ETag e Last-Modified) para o catálogo e a
+# página de produto, usados com o decorador condition() do Django em
+# loja/views.py. Quando o navegador já tem a versão atual, a resposta é um 304
+# sem renderizar template nenhum.
+#
+# O que entra nos validadores:
+#   - os campos atualizado_em de Produto e Categoria (os UPDATEs em massa que
+#     mudam a página também os atualizam: agregados de avaliações e estoque);
+#   - a versão dos templates (mtime), para que um deploy invalide as páginas;
+#   - a parte pessoal da página: usuário logado e o cookie do CSRF, já que os
+#     formulários levam um token atrelado a ele.
+#
+# Por causa do token do CSRF as páginas são "private": o 304 serve ao cache do
+# navegador, não a um cache compartilhado. Para usuários logados só há ETag
+# (o Last-Modified não enxerga mudanças pessoais, como um pedido entregue).
+# Com mensagens pendentes (django.contrib.messages) não há validadores, senão
+# a mensagem nunca apareceria.
+
+
+@lru_cache(maxsize=None)
+def versao_templates():
+    # Calculada uma vez por processo; todos os processos do mesmo deploy chegam ao mesmo valor
+    return max((int(arquivo.stat().st_mtime) for arquivo in templates_do_projeto()), default=0)
+
+
+def _memo(request):
+    return request.__dict__.setdefault('_loja_condicional', {})
+
+
+def _memorizado(request, chave, calcular):
+    # O decorador condition() e a view precisam dos mesmos dados; calculamos uma vez só
+    memo = _memo(request)
+    if chave not in memo:
+        memo[chave] = calcular()
+    return memo[chave]
+
+
+def _visitante(request):
+    cookie_csrf = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    if request.user.is_authenticated:
+        usuario = f'{request.user.pk}:{request.user.username}:{request.user.is_staff}'
+    else:
+        usuario = 'anonimo'
+    return f'{usuario}:{hashlib.sha256(cookie_csrf.encode()).hexdigest()[:16]}'
+
+
+def _gerar_etag(*partes):
+    return hashlib.sha256('|'.join(str(p) for p in partes).encode()).hexdigest()[:32]
+
+
+def _sem_validadores(request):
+    return request.method not in ('GET', 'HEAD') or len(messages.get_messages(request)) > 0
+
+
+# --- Página de produto ---
+
+def snapshot_da_requisicao(request, slug):
+    return _memorizado(request, ('snapshot', slug), lambda: snapshot_produto(slug))
+
+
+def pode_avaliar(request, produto):
+    # Comprou o produto num pedido entregue e ainda não avaliou. Vem do
+    # conjunto em cache do usuário (loja/elegibilidade.py)
+    def calcular():
+        return request.user.is_authenticated and produto.pk in produtos_avaliaveis(request.user)
+    return _memorizado(request, ('pode_avaliar', produto.pk), calcular)
+
+
+def _ultima_modificacao_produto(produto):
+    return max(produto.atualizado_em, produto.categoria.atualizado_em)
+
+
+def etag_produto(request, produto_slug):
+    # Num acerto do cache de snapshots, nenhuma consulta para anônimos
+    snapshot = snapshot_da_requisicao(request, produto_slug)
+    if snapshot is None or _sem_validadores(request):
+        return None
+    produto = snapshot['produto']
+    return _gerar_etag(
+        'produto', produto.pk, _ultima_modificacao_produto(produto).isoformat(), versao_templates(),
+        _visitante(request), pode_avaliar(request, produto),
+    )
+
+
+def ultima_modificacao_produto(request, produto_slug):
+    snapshot = snapshot_da_requisicao(request, produto_slug)
+    if snapshot is None or _sem_validadores(request) or request.user.is_authenticated:
+        return None
+    return _ultima_modificacao_produto(snapshot['produto'])
+
+
+# --- Catálogo ---
+
+def _estado_catalogo(request):
+    def calcular():
+        # Duas consultas pequenas: o MAX dos produtos usa o índice produto_atualizado_idx
+        # e a tabela de categorias é minúscula
+        return _combinar_estado(
+            Produto.objects.aggregate(**_MAX_PRODUTOS), Categoria.objects.aggregate(**_ESTADO_CATEGORIAS),
+        )
+    return _memorizado(request, 'catalogo', calcular)
+
+
+_MAX_PRODUTOS = {'ultimo': Max('atualizado_em')}
+_ESTADO_CATEGORIAS = {'ultima': Max('atualizado_em'), 'total': Count('id')}
+
+
+def _combinar_estado(produtos, categorias):
+    datas = [d for d in (produtos['ultimo'], categorias['ultima']) if d is not None]
+    return (max(datas) if datas else None), categorias['total']
+
+
+def etag_catalogo(request):
+    if _sem_validadores(request):
+        return None
+    ultima, total_categorias = _estado_catalogo(request)
+    return _gerar_etag(
+        'catalogo', ultima.isoformat() if ultima else '', total_categorias, versao_templates(), _visitante(request),
+    )
+
+
+def ultima_modificacao_catalogo(request):
+    if _sem_validadores(request) or request.user.is_authenticated:
+        return None
+    return _estado_catalogo(request)[0]
+
+
+# --- Views assíncronas (loja/views_assincronas.py) ---
+#
+# O condition() do Django chama os validadores direto no event loop, onde o
+# ORM síncrono não pode ser usado. condicao_assincrona() roda antes uma função
+# `preparar`, que busca de forma assíncrona (e ao mesmo tempo) tudo o que os
+# validadores e a view usam e guarda no mesmo memo. Os validadores acima então
+# só leem do memo.
+
+def condicao_assincrona(preparar, etag_func=None, last_modified_func=None):
+    def decorator(view):
+        condicional = condition(etag_func=etag_func, last_modified_func=last_modified_func)(view)
+
+        @wraps(view)
+        async def _view(request, *args, **kwargs):
+            await preparar(request, *args, **kwargs)
+            return await condicional(request, *args, **kwargs)
+        return _view
+    return decorator
+
+
+def _carregar_visitante(request):
+    # Usuário e mensagens podem vir da sessão no banco, por isso numa thread.
+    # Depois disso _visitante() e _sem_validadores() não consultam nada.
+    request.user.is_authenticated
+    _sem_validadores(request)
+
+
+async def preparar_produto(request, produto_slug):
+    # O snapshot (produto e avaliações) e o que o usuário pode avaliar, ao mesmo tempo
+    async def avaliaveis():
+        await sync_to_async(_carregar_visitante)(request)
+        if not request.user.is_authenticated:
+            return frozenset()
+        return await aprodutos_avaliaveis(request.user)
+
+    snapshot, ids_avaliaveis = await asyncio.gather(asnapshot_produto(produto_slug), avaliaveis())
+    memo = _memo(request)
+    memo[('snapshot', produto_slug)] = snapshot
+    if snapshot is not None:
+        produto_id = snapshot['produto'].pk
+        memo[('pode_avaliar', produto_id)] = produto_id in ids_avaliaveis
+
+
+async def preparar_catalogo(request):
+    _, produtos, categorias = await asyncio.gather(
+        sync_to_async(_carregar_visitante)(request),
+        Produto.objects.aaggregate(**_MAX_PRODUTOS),
+        Categoria.objects.aaggregate(**_ESTADO_CATEGORIAS),
+    )
+    _memo(request)['catalogo'] = _combinar_estado(produtos, categorias)
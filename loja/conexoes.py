@@ -0,0 +1,160 @@
+import logging
+import smtplib
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+# Conexões persistentes com o banco e com o servidor de e-mail.
+#
+# Banco: DATABASES usa CONN_MAX_AGE e CONN_HEALTH_CHECKS (DB_CONN_MAX_AGE e
+# DB_CONN_HEALTH_CHECKS no .env), então cada thread do servidor mantém a sua
+# conexão entre requisições e o Django testa se ela ainda responde antes de
+# reutilizá-la. aquecer_conexoes() abre as conexões na subida do processo
+# (fluorita/wsgi.py), para a primeira requisição não pagar o handshake.
+#
+# E-mail: conexao_email() devolve uma conexão SMTP por thread, aberta uma vez
+# e reutilizada pelos envios seguintes. Depois de um tempo parada ela recebe
+# um NOOP antes de ser usada; se o servidor já a derrubou, é reaberta.
+#
+# metricas() mostra, por processo, quantas conexões foram abertas e quantas
+# vezes uma conexão já aberta foi reaproveitada (painel /painel/conexoes/).
+
+logger = logging.getLogger('loja.conexoes')
+
+_trava = threading.Lock()
+_contadores = {'banco': {}, 'smtp': {'abertas': 0, 'reutilizadas': 0, 'reconexoes': 0, 'enviados': 0}}
+
+
+def _somar(grupo, chave, alias=None):
+    with _trava:
+        contadores = _contadores[grupo]
+        if alias is not None:
+            contadores = contadores.setdefault(alias, {'abertas': 0, 'reutilizadas': 0})
+        contadores[chave] += 1
+
+
+def _taxa(contadores):
+    usos = contadores['abertas'] + contadores['reutilizadas']
+    return round(contadores['reutilizadas'] / usos, 4) if usos else None
+
+
+def metricas():
+    """
+    Contadores do processo atual: conexões abertas e reutilizadas por banco
+    (uma reutilização por requisição que começou com a conexão aberta) e do
+    SMTP (por envio), com a taxa de reutilização de cada um.
+    """
+    with _trava:
+        banco = {alias: {**valores, 'taxa_reutilizacao': _taxa(valores)} for alias, valores in _contadores['banco'].items()}
+        smtp = {**_contadores['smtp'], 'taxa_reutilizacao': _taxa(_contadores['smtp'])}
+    return {'banco': banco, 'smtp': smtp}
+
+
+def zerar_metricas():
+    with _trava:
+        _contadores['banco'].clear()
+        _contadores['smtp'].update(abertas=0, reutilizadas=0, reconexoes=0, enviados=0)
+
+
+@receiver(connection_created)
+def contar_conexao_aberta(sender, connection, **kwargs):
+    _somar('banco', 'abertas', connection.alias)
+
+
+@receiver(request_started)
+def contar_conexoes_reutilizadas(sender, **kwargs):
+    # Roda depois do close_old_connections do Django (ligado antes, no import
+    # de django.db): o que ainda está aberto aqui é reaproveitado nesta requisição
+    for conexao in connections.all(initialized_only=True):
+        if conexao.connection is not None:
+            _somar('banco', 'reutilizadas', conexao.alias)
+
+
+def aquecer_conexoes():
+    # Abre a conexão de cada banco na thread atual. Uma falha não impede o
+    # servidor de subir: a conexão é aberta de novo na primeira requisição.
+    for alias in connections:
+        try:
+            connections[alias].ensure_connection()
+        except Exception:
+            logger.warning('Não foi possível abrir a conexão "%s" na subida.', alias, exc_info=True)
+
+
+# --- E-mail ---
+
+_local = threading.local()
+
+
+def _verificar_apos():
+    # Segundos parada depois dos quais a conexão SMTP recebe um NOOP antes de ser usada
+    return getattr(settings, 'LOJA_SMTP_VERIFICAR_APOS', 30)
+
+
+def _smtp_responde(conexao):
+    try:
+        return conexao.connection.noop()[0] == 250
+    except (smtplib.SMTPException, OSError):
+        return False
+
+
+def conexao_email():
+    """
+    Conexão de e-mail já aberta da thread atual, para usar com
+    send_messages() (que não a fecha quando ela já estava aberta).
+    """
+    conexao = getattr(_local, 'conexao', None)
+    if conexao is not None and getattr(settings, 'EMAIL_BACKEND', None) != _local.backend:
+        # EMAIL_BACKEND mudou (ex: override_settings nos testes)
+        fechar_conexao_email()
+        conexao = None
+    if conexao is not None:
+        # Backends sem conexão de rede (console, locmem, arquivo) são sempre reutilizados
+        smtp = getattr(conexao, 'connection', False)
+        parada = time.monotonic() - _local.ultimo_uso
+        if smtp is False or (smtp is not None and (parada < _verificar_apos() or _smtp_responde(conexao))):
+            _somar('smtp', 'reutilizadas')
+            _local.ultimo_uso = time.monotonic()
+            return conexao
+        fechar_conexao_email()
+
+    conexao = get_connection()
+    conexao.open()
+    _local.conexao = conexao
+    _local.backend = settings.EMAIL_BACKEND
+    _local.ultimo_uso = time.monotonic()
+    _somar('smtp', 'abertas')
+    return conexao
+
+
+def fechar_conexao_email():
+    conexao = getattr(_local, 'conexao', None)
+    _local.conexao = None
+    if conexao is not None:
+        try:
+            conexao.close()
+        except Exception:
+            pass
+
+
+def enviar_emails(mensagens):
+    """
+    Envia pela conexão reutilizável. Se o servidor derrubou a conexão (ex:
+    tempo limite do lado dele), reabre e tenta mais uma vez.
+    """
+    try:
+        enviados = conexao_email().send_messages(mensagens)
+    except smtplib.SMTPServerDisconnected:
+        fechar_conexao_email()
+        _somar('smtp', 'reconexoes')
+        enviados = conexao_email().send_messages(mensagens)
+    _local.ultimo_uso = time.monotonic()
+    with _trava:
+        _contadores['smtp']['enviados'] += enviados or 0
+    return enviados
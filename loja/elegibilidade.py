@@ -0,0 +1,143 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+
+from .models import Avaliacao, CompraEntregue, ItemPedido
+from .replicas import ler_da_primaria
+
+
+# Quem pode avaliar o quê: o usuário precisa ter o produto num pedido
+# entregue (tabela CompraEntregue) e ainda não ter avaliado o produto.
+#
+# A tabela é atualizada sempre que um pedido entra ou sai do status
+# "entregue" ou um pedido entregue é excluído: pelos sinais de Pedido (save e
+# delete, pelo admin ou pelo código) e por
+# alterar_status() em loja/pedidos.py, usado pela ação em massa do admin.
+# QuerySet.update() direto em Pedido.status não passa por aqui; nesse caso
+# chame sincronizar_compras_entregues() ou rode o comando de reconstrução.
+#
+# Para a página de produto, o conjunto de produtos que o usuário pode avaliar
+# fica em cache (loja:avaliaveis:<usuario_id>), então a verificação é grátis
+# num acerto de cache.
+
+TIMEOUT_AVALIAVEIS = 60 * 60
+
+
+def _chave_avaliaveis(usuario_id):
+    return f'loja:avaliaveis:{usuario_id}'
+
+
+def invalidar_avaliaveis(usuario_ids):
+    chaves = [_chave_avaliaveis(uid) for uid in usuario_ids]
+    transaction.on_commit(lambda: cache.delete_many(chaves))
+
+
+def _sem_avaliacao():
+    return ~Exists(Avaliacao.objects.filter(usuario=OuterRef('usuario'), produto=OuterRef('produto')))
+
+
+def produtos_avaliaveis(usuario):
+    """
+    Conjunto de ids de produtos que o usuário pode avaliar agora. Uma consulta
+    na primeira chamada; depois vem do cache até algo mudar.
+    """
+    chave = _chave_avaliaveis(usuario.pk)
+    avaliaveis = cache.get(chave)
+    if avaliaveis is None:
+        # Vai para o cache: lido da primária (loja/replicas.py)
+        with ler_da_primaria():
+            avaliaveis = frozenset(
+                CompraEntregue.objects.filter(usuario=usuario).filter(_sem_avaliacao()).values_list('produto_id', flat=True)
+            )
+        cache.set(chave, avaliaveis, TIMEOUT_AVALIAVEIS)
+    return avaliaveis
+
+
+async def aprodutos_avaliaveis(usuario):
+    # Versão assíncrona de produtos_avaliaveis, com a mesma chave de cache
+    chave = _chave_avaliaveis(usuario.pk)
+    avaliaveis = await cache.aget(chave)
+    if avaliaveis is None:
+        with ler_da_primaria():
+            avaliaveis = frozenset([
+                produto_id async for produto_id in
+                CompraEntregue.objects.filter(usuario=usuario).filter(_sem_avaliacao()).values_list('produto_id', flat=True)
+            ])
+        await cache.aset(chave, avaliaveis, TIMEOUT_AVALIAVEIS)
+    return avaliaveis
+
+
+def pode_avaliar_produto(usuario, produto):
+    # Verificação exata, direto no banco (uma consulta pelo índice único): usada ao gravar a avaliação
+    return CompraEntregue.objects.filter(usuario=usuario, produto=produto).filter(_sem_avaliacao()).exists()
+
+
+def sincronizar_compras_entregues(pedido_ids):
+    """
+    Acerta CompraEntregue para os pares (usuário, produto) dos pedidos
+    informados, depois que eles entraram ou saíram do status "entregue".
+    O número de consultas não depende da quantidade de pedidos ou itens.
+    """
+    sincronizar_pares(pares_dos_pedidos(pedido_ids))
+
+
+def pares_dos_pedidos(pedido_ids):
+    # Pares (usuário, produto) dos itens dos pedidos
+    return set(
+        ItemPedido.objects.filter(pedido_id__in=pedido_ids).values_list('pedido__usuario_id', 'produto_id').distinct()
+    )
+
+
+def sincronizar_pares(pares):
+    """
+    Acerta CompraEntregue para os pares (usuário, produto) informados. Usado
+    diretamente quando os pedidos já foram excluídos (loja/signals.py).
+    """
+    if not pares:
+        return
+    usuarios = {u for u, _ in pares}
+    produtos = {p for _, p in pares}
+
+    # O par continua valendo se QUALQUER pedido entregue do usuário tiver o produto
+    entregues = set(
+        ItemPedido.objects.filter(
+            pedido__status='entregue', pedido__usuario_id__in=usuarios, produto_id__in=produtos
+        ).values_list('pedido__usuario_id', 'produto_id').distinct()
+    ) & pares
+
+    CompraEntregue.objects.bulk_create(
+        [CompraEntregue(usuario_id=u, produto_id=p) for u, p in entregues], ignore_conflicts=True
+    )
+    removidos = pares - entregues
+    if removidos:
+        filtro = Q()
+        for u, p in removidos:
+            filtro |= Q(usuario_id=u, produto_id=p)
+        CompraEntregue.objects.filter(filtro).delete()
+    invalidar_avaliaveis(usuarios)
+
+
+def reconstruir_compras_entregues(lote=5000):
+    # Refaz a tabela inteira a partir dos pedidos entregues
+    with transaction.atomic():
+        usuarios = set(CompraEntregue.objects.values_list('usuario_id', flat=True).distinct())
+        CompraEntregue.objects.all().delete()
+        pares = (
+            ItemPedido.objects.filter(pedido__status='entregue')
+            .values_list('pedido__usuario_id', 'produto_id')
+            .distinct()
+            .order_by()
+        )
+        novos = []
+        total = 0
+        for usuario_id, produto_id in pares.iterator(chunk_size=lote):
+            usuarios.add(usuario_id)
+            novos.append(CompraEntregue(usuario_id=usuario_id, produto_id=produto_id))
+            if len(novos) >= lote:
+                CompraEntregue.objects.bulk_create(novos)
+                total += len(novos)
+                novos = []
+        CompraEntregue.objects.bulk_create(novos)
+        total += len(novos)
+        invalidar_avaliaveis(usuarios)
+    return total
@@ -0,0 +1,104 @@
+from datetime import timedelta
+
+from django.core.mail import EmailMultiAlternatives
+from django.db import connection, transaction
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .conexoes import enviar_emails
+from .models import EmailPendente, Pedido
+
+
+REMETENTE = 'nao-responda@fluorita.com'
+
+# Backoff exponencial entre tentativas: 1 min, 2 min, 4 min ... até 1 hora
+ESPERA_INICIAL = timedelta(minutes=1)
+ESPERA_MAXIMA = timedelta(hours=1)
+MAX_TENTATIVAS = 5
+
+
+def enfileirar_confirmacao_pedido(pedido):
+    # Deve ser chamado dentro da transação que cria o pedido
+    return EmailPendente.objects.create(pedido=pedido, tipo='confirmacao_pedido')
+
+
+def montar_email_confirmacao_pedido(pedido):
+    # O pedido deve vir com usuario/endereco_entrega (select_related) e
+    # itens__produto (prefetch_related) para o template não fazer consultas extras
+    context = {'pedido': pedido}
+    mensagem = EmailMultiAlternatives(
+        subject=f'Confirmação do Pedido #{pedido.id} - Loja Fluorita',
+        body=render_to_string('loja/email/confirmacao_pedido.txt', context),
+        from_email=REMETENTE,
+        to=[pedido.usuario.email],
+    )
+    mensagem.attach_alternative(render_to_string('loja/email/confirmacao_pedido.html', context), 'text/html')
+    return mensagem
+
+
+def enviar_email_confirmacao_pedido(pedido, conexao=None):
+    # Envio imediato de um único e-mail, fora da fila (ex: reenvio manual).
+    # Sem `conexao`, usa a conexão SMTP reutilizável da thread (loja/conexoes.py)
+    mensagem = montar_email_confirmacao_pedido(pedido)
+    if conexao is not None:
+        return mensagem.send(connection=conexao)
+    return enviar_emails([mensagem])
+
+
+def _proxima_espera(tentativas):
+    return min(ESPERA_INICIAL * (2 ** (tentativas - 1)), ESPERA_MAXIMA)
+
+
+def processar_fila(lote=50, max_tentativas=MAX_TENTATIVAS):
+    """
+    Envia um lote de e-mails pendentes e retorna (enviados, falhas).
+
+    Os e-mails saem pela conexão SMTP reutilizável (loja/conexoes.py), que
+    continua aberta entre um lote e outro no modo contínuo. As linhas
+    são travadas com SKIP LOCKED (quando o banco suporta), então vários
+    workers podem rodar ao mesmo tempo sem enviar o mesmo e-mail duas vezes.
+    """
+    agora = timezone.now()
+    enviados = falhas = 0
+
+    with transaction.atomic():
+        pendentes = list(
+            EmailPendente.objects
+            .select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked)
+            .filter(status='pendente', proxima_tentativa__lte=agora)
+            .order_by('proxima_tentativa', 'id')[:lote]
+        )
+        if not pendentes:
+            return 0, 0
+
+        # Carrega todos os pedidos do lote de uma vez, já com o que o template usa
+        pedidos = (
+            Pedido.objects
+            .select_related('usuario', 'endereco_entrega')
+            .prefetch_related('itens__produto')
+            .in_bulk([p.pedido_id for p in pendentes])
+        )
+
+        for pendente in pendentes:
+            pendente.tentativas += 1
+            try:
+                # Um e-mail por vez para registrar o resultado de cada um separadamente
+                enviar_emails([montar_email_confirmacao_pedido(pedidos[pendente.pedido_id])])
+            except Exception as e:
+                falhas += 1
+                pendente.ultimo_erro = str(e)
+                if pendente.tentativas >= max_tentativas:
+                    pendente.status = 'falhou'
+                else:
+                    pendente.proxima_tentativa = agora + _proxima_espera(pendente.tentativas)
+            else:
+                enviados += 1
+                pendente.status = 'enviado'
+                pendente.enviado_em = timezone.now()
+                pendente.ultimo_erro = ''
+
+        EmailPendente.objects.bulk_update(
+            pendentes, ['status', 'tentativas', 'proxima_tentativa', 'ultimo_erro', 'enviado_em']
+        )
+
+    return enviados, falhas
@@ -0,0 +1,191 @@
+import gzip
+import logging
+import mimetypes
+import os
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.template.utils import get_app_template_dirs
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:  # Está no requirements.txt; sem ele o collectstatic gera só o .gz (e avisa)
+    brotli = None
+
+
+# Arquivos estáticos para produção.
+#
+# O collectstatic com ArmazenamentoEstatico (veja STORAGES em settings.py):
+#   1. remove as webfonts do Font Awesome que nenhum template usa (e os
+#      @font-face que apontam para elas);
+#   2. gera nomes com o hash do conteúdo (ex: bootstrap.min.4f1c2a9b3e7d.css)
+#      e o staticfiles.json, como o ManifestStaticFilesStorage do Django;
+#   3. grava ao lado de cada arquivo com hash as versões .gz e .br (a .br
+#      precisa do pacote "brotli", do requirements.txt).
+#
+# Como o nome muda quando o conteúdo muda, esses arquivos podem ser servidos
+# com "Cache-Control: immutable". Quem serve é o nginx (veja o README) ou,
+# sem proxy na frente, a view servir_estatico abaixo.
+
+logger = logging.getLogger('loja.estaticos')
+
+EXTENSOES_COMPRIMIVEIS = ('.css', '.js', '.map', '.svg', '.json', '.txt', '.xml', '.html', '.ico', '.ttf', '.eot')
+# Só guardamos a versão comprimida se ela economizar pelo menos 5%
+ECONOMIA_MINIMA = 0.95
+
+CSS_FONTAWESOME = 'fa/css/all.min.css'
+PASTA_WEBFONTS = 'fa/webfonts/'
+# Webfont -> classes que precisam dela. O "fa" sozinho é a sintaxe da v4
+# (solid + fonte de compatibilidade).
+WEBFONTS_FONTAWESOME = {
+    'fa-solid-900.woff2': ('fa-solid', 'fas', 'fa'),
+    'fa-regular-400.woff2': ('fa-regular', 'far'),
+    'fa-brands-400.woff2': ('fa-brands', 'fab'),
+    'fa-v4compatibility.woff2': ('fa',),
+}
+
+_HASH_NO_NOME = re.compile(r'\.[0-9a-f]{12}\.')
+
+
+def _classe_no_texto(classe, texto):
+    # "fa" não pode casar com "fa-solid" nem com "sofa"
+    return re.search(rf'(?<![\w-]){re.escape(classe)}(?![\w-])', texto) is not None
+
+
+def templates_do_projeto():
+    # Templates da loja (não os do admin/jazzmin, que trazem o próprio Font Awesome)
+    base = Path(settings.BASE_DIR)
+    pastas = [Path(p) for engine in settings.TEMPLATES for p in engine.get('DIRS', [])]
+    pastas += [Path(p) for p in get_app_template_dirs('templates') if base in Path(p).parents]
+    for pasta in pastas:
+        yield from pasta.rglob('*.html')
+
+
+def webfonts_usadas():
+    texto = '\n'.join(arquivo.read_text(encoding='utf-8') for arquivo in templates_do_projeto())
+    return {
+        fonte for fonte, classes in WEBFONTS_FONTAWESOME.items()
+        if any(_classe_no_texto(classe, texto) for classe in classes)
+    }
+
+
+class ArmazenamentoEstatico(ManifestStaticFilesStorage):
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            yield from super().post_process(paths, dry_run, **options)
+            return
+
+        self._remover_webfonts_nao_usadas(paths)
+        yield from super().post_process(paths, dry_run, **options)
+
+        if brotli is None:
+            # Sem o .br, o brotli_static do nginx nunca acha arquivo: avisa em vez de falhar
+            logger.warning('Pacote "brotli" não instalado: só as versões .gz foram geradas (pip install -r requirements.txt).')
+
+        for nome in sorted(set(self.hashed_files.values())):
+            for comprimido in self._comprimir(nome):
+                yield comprimido, comprimido, True
+
+    def _remover_webfonts_nao_usadas(self, paths):
+        if CSS_FONTAWESOME not in paths:
+            return
+        removidas = {
+            fonte for fonte in WEBFONTS_FONTAWESOME
+            if PASTA_WEBFONTS + fonte in paths
+        } - webfonts_usadas()
+        if not removidas:
+            return
+
+        for fonte in removidas:
+            del paths[PASTA_WEBFONTS + fonte]
+            self.delete(PASTA_WEBFONTS + fonte)
+
+        origem, caminho = paths[CSS_FONTAWESOME]
+        with origem.open(caminho) as arquivo:
+            css = arquivo.read().decode('utf-8')
+        css = re.sub(
+            r'@font-face\{[^}]*\}',
+            lambda bloco: '' if any(fonte in bloco.group(0) for fonte in removidas) else bloco.group(0),
+            css,
+        )
+        # O hash passa a ser calculado sobre a cópia já editada em STATIC_ROOT
+        self.delete(CSS_FONTAWESOME)
+        self._save(CSS_FONTAWESOME, ContentFile(css.encode('utf-8')))
+        paths[CSS_FONTAWESOME] = (self, CSS_FONTAWESOME)
+
+    def _comprimir(self, nome):
+        if not nome.endswith(EXTENSOES_COMPRIMIVEIS):
+            return
+        with self.open(nome) as arquivo:
+            conteudo = arquivo.read()
+        variantes = [('.gz', gzip.compress(conteudo, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variantes.append(('.br', brotli.compress(conteudo, quality=11)))
+        for sufixo, comprimido in variantes:
+            if len(comprimido) > len(conteudo) * ECONOMIA_MINIMA:
+                continue
+            if self.exists(nome + sufixo):
+                self.delete(nome + sufixo)
+            self._save(nome + sufixo, ContentFile(comprimido))
+            yield nome + sufixo
+
+
+def _codificacoes_aceitas(request):
+    # "gzip, deflate, br;q=0" -> {'gzip', 'deflate'}
+    aceitas = set()
+    for parte in request.headers.get('Accept-Encoding', '').split(','):
+        codificacao, _, parametros = parte.partition(';')
+        _, _, peso = parametros.partition('q=')
+        try:
+            if peso and float(peso) == 0:
+                continue
+        except ValueError:
+            continue
+        aceitas.add(codificacao.strip().lower())
+    return aceitas
+
+
+def servir_estatico(request, caminho):
+    """
+    Serve STATIC_ROOT pelo próprio Django, para instalações sem nginx na frente
+    (ligado com LOJA_SERVIR_ESTATICOS). Entrega o .br ou .gz pré-comprimido
+    quando o navegador aceita e marca os arquivos com hash como imutáveis.
+    """
+    try:
+        completo = safe_join(settings.STATIC_ROOT, caminho)
+    except SuspiciousFileOperation:
+        raise Http404('Arquivo não encontrado')
+    if not os.path.isfile(completo):
+        raise Http404('Arquivo não encontrado')
+
+    tipo, _ = mimetypes.guess_type(completo)
+    aceitas = _codificacoes_aceitas(request)
+    enviado, codificacao = completo, None
+    for nome, sufixo in (('br', '.br'), ('gzip', '.gz')):
+        if nome in aceitas and os.path.isfile(completo + sufixo):
+            enviado, codificacao = completo + sufixo, nome
+            break
+
+    estado = os.stat(enviado)
+    if not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), estado.st_mtime):
+        return HttpResponseNotModified()
+
+    resposta = FileResponse(open(enviado, 'rb'), content_type=tipo or 'application/octet-stream')
+    resposta['Last-Modified'] = http_date(estado.st_mtime)
+    resposta['Vary'] = 'Accept-Encoding'
+    if codificacao:
+        resposta['Content-Encoding'] = codificacao
+    if _HASH_NO_NOME.search(os.path.basename(caminho)):
+        resposta['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        resposta['Cache-Control'] = 'public, max-age=300'
+    return resposta
@@ -0,0 +1,133 @@
+import csv
+import json
+
+from django.db.models import Prefetch
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .models import ItemPedido
+
+
+# Exportação de pedidos e itens (CSV ou JSONL) para a contabilidade, usada
+# pelo PedidoAdmin e pelo comando "python manage.py exportar_pedidos".
+#
+# Tudo é gerado sob demanda: linhas_exportacao() devolve um gerador de
+# strings que vai direto para um StreamingHttpResponse ou para um arquivo.
+# Os pedidos são lidos em lotes pela chave primária (id > último id do lote
+# anterior), cada lote com os seus itens num único prefetch. A memória fica
+# limitada ao tamanho do lote em qualquer banco: o iterator() sozinho não
+# resolve no MySQL, onde o driver traz o resultado inteiro para o cliente.
+
+FORMATOS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'jsonl': ('application/x-ndjson; charset=utf-8', 'jsonl'),
+}
+LOTE_PADRAO = 500
+
+# Uma linha por item; os dados do pedido se repetem em cada item dele
+COLUNAS_CSV = (
+    'pedido_id', 'criado_em', 'status', 'usuario', 'email', 'total', 'cidade', 'estado', 'cep',
+    'item_id', 'produto_id', 'produto', 'preco', 'quantidade', 'subtotal',
+)
+
+
+def pedidos_em_lotes(pedidos, lote=LOTE_PADRAO):
+    """
+    Percorre os pedidos do queryset em ordem de id, `lote` por vez, com
+    usuário, endereço e itens (com produto) já carregados. Duas consultas por
+    lote, qualquer que seja o total.
+    """
+    base = (
+        pedidos.order_by('id')
+        .select_related('usuario', 'endereco_entrega')
+        .prefetch_related(Prefetch('itens', queryset=ItemPedido.objects.select_related('produto').order_by('id')))
+    )
+    ultimo = 0
+    while True:
+        pedidos_do_lote = list(base.filter(id__gt=ultimo)[:lote])
+        yield from pedidos_do_lote
+        if len(pedidos_do_lote) < lote:
+            return
+        ultimo = pedidos_do_lote[-1].id
+
+
+def _dados_pedido(pedido):
+    endereco = pedido.endereco_entrega
+    return {
+        'pedido_id': pedido.id,
+        'criado_em': pedido.criado_em.isoformat(),
+        'status': pedido.status,
+        'usuario': pedido.usuario.username,
+        'email': pedido.usuario.email,
+        'total': str(pedido.total),
+        'cidade': endereco.cidade if endereco else '',
+        'estado': endereco.estado if endereco else '',
+        'cep': endereco.cep if endereco else '',
+    }
+
+
+def _dados_item(item):
+    return {
+        'item_id': item.id,
+        'produto_id': item.produto_id,
+        'produto': item.produto.nome,
+        'preco': str(item.preco),
+        'quantidade': item.quantidade,
+        'subtotal': str(item.subtotal),
+    }
+
+
+# Planilhas executam como fórmula a célula que começa com um desses caracteres
+# (ex: um nome de usuário "=HYPERLINK(...)"): no CSV ganham um ' na frente
+INICIO_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _celulas(dados):
+    return {
+        coluna: "'" + valor if isinstance(valor, str) and valor.startswith(INICIO_FORMULA) else valor
+        for coluna, valor in dados.items()
+    }
+
+
+class _Eco:
+    # "Arquivo" do csv.writer que devolve a linha em vez de guardá-la
+    def write(self, valor):
+        return valor
+
+
+def _linhas_csv(pedidos, lote):
+    escritor = csv.DictWriter(_Eco(), fieldnames=COLUNAS_CSV)
+    # BOM para o Excel reconhecer o UTF-8 (acentos nos nomes)
+    yield '\ufeff' + escritor.writeheader()
+    for pedido in pedidos_em_lotes(pedidos, lote):
+        dados = _celulas(_dados_pedido(pedido))
+        itens = pedido.itens.all()
+        if not itens:
+            yield escritor.writerow(dados)
+        for item in itens:
+            yield escritor.writerow({**dados, **_celulas(_dados_item(item))})
+
+
+def _linhas_jsonl(pedidos, lote):
+    # Um pedido por linha, com a lista de itens
+    for pedido in pedidos_em_lotes(pedidos, lote):
+        dados = _dados_pedido(pedido)
+        dados['itens'] = [_dados_item(item) for item in pedido.itens.all()]
+        yield json.dumps(dados, ensure_ascii=False) + '\n'
+
+
+def linhas_exportacao(pedidos, formato='csv', lote=LOTE_PADRAO):
+    if formato not in FORMATOS:
+        raise ValueError(f'Formato de exportação desconhecido: {formato}')
+    if formato == 'csv':
+        return _linhas_csv(pedidos, lote)
+    return _linhas_jsonl(pedidos, lote)
+
+
+def resposta_exportacao(pedidos, formato='csv'):
+    # Download em streaming: as linhas são enviadas à medida que são geradas
+    tipo, extensao = FORMATOS[formato]
+    resposta = StreamingHttpResponse(linhas_exportacao(pedidos, formato), content_type=tipo)
+    nome = f'pedidos-{timezone.localtime():%Y%m%d-%H%M%S}.{extensao}'
+    resposta['Content-Disposition'] = f'attachment; filename="{nome}"'
+    return resposta
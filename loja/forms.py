@@ -28,4 +28,31 @@ class AvaliacaoForm(forms.ModelForm):
         fields = ['nota', 'comentario']
         widgets = {
             'comentario': forms.Textarea(attrs={'rows': 4}),
-        }
\ No newline at end of file
+        }
+
+# Formulário (GET) com os filtros da listagem de produtos
+class FiltroCatalogoForm(forms.Form):
+    categoria = forms.SlugField(required=False)
+    disponivel = forms.NullBooleanField(required=False)
+    preco_min = forms.DecimalField(required=False, min_value=0, max_digits=10, decimal_places=2)
+    preco_max = forms.DecimalField(required=False, min_value=0, max_digits=10, decimal_places=2)
+    cursor = forms.CharField(required=False, max_length=512)
+    tamanho = forms.IntegerField(required=False, min_value=1)
+
+# Formulário (GET) da busca de produtos
+class BuscaForm(forms.Form):
+    q = forms.CharField(required=False, max_length=200)
+    categoria = forms.SlugField(required=False)
+    cursor = forms.CharField(required=False, max_length=512)
+    tamanho = forms.IntegerField(required=False, min_value=1)
+
+# Formulário (GET) do período do painel de vendas
+class PeriodoVendasForm(forms.Form):
+    inicio = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    fim = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+
+    def clean(self):
+        dados = super().clean()
+        if dados.get('inicio') and dados.get('fim') and dados['inicio'] > dados['fim']:
+            raise forms.ValidationError('A data inicial deve ser anterior à final.')
+        return dados
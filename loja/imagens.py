@@ -0,0 +1,98 @@
+import hashlib
+import logging
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError, features
+
+
+# Derivados de Produto.imagem em tamanhos fixos, gerados com o Pillow.
+#
+# Os arquivos ficam em produtos/derivados/<hash>/<largura>.<formato>, onde
+# <hash> vem do conteúdo da imagem original e é guardado em
+# Produto.imagem_hash. Como o nome muda sempre que a imagem muda, os
+# derivados podem ser servidos com cache "para sempre".
+#
+# São gerados no upload (sinal post_save de Produto) e, para imagens antigas,
+# pelo comando "python manage.py gerar_derivados_imagens". A tag
+# {% imagem_produto %} (templatetags/loja_imagens.py) monta o srcset.
+
+logger = logging.getLogger('loja.imagens')
+
+LARGURAS = (200, 400, 800)
+# Do mais preferido para o fallback; o WebP só entra se o Pillow tiver suporte
+FORMATOS = ('webp', 'jpeg') if features.check('webp') else ('jpeg',)
+QUALIDADE = 82
+PASTA = 'produtos/derivados'
+TAMANHO_HASH = 16
+
+ERROS_IMAGEM = (OSError, UnidentifiedImageError, Image.DecompressionBombError)
+
+
+def caminho_derivado(imagem_hash, largura, formato):
+    return f'{PASTA}/{imagem_hash}/{largura}.{formato}'
+
+
+def _codificar(imagem, formato):
+    saida = BytesIO()
+    if formato == 'jpeg':
+        # JPEG não tem transparência: fundo branco
+        if imagem.mode in ('RGBA', 'LA', 'P'):
+            imagem = imagem.convert('RGBA')
+            fundo = Image.new('RGB', imagem.size, 'white')
+            fundo.paste(imagem, mask=imagem.getchannel('A'))
+            imagem = fundo
+        elif imagem.mode != 'RGB':
+            imagem = imagem.convert('RGB')
+        imagem.save(saida, 'JPEG', quality=QUALIDADE, optimize=True, progressive=True)
+    else:
+        if imagem.mode not in ('RGB', 'RGBA'):
+            imagem = imagem.convert('RGBA')
+        imagem.save(saida, 'WEBP', quality=QUALIDADE, method=4)
+    return saida.getvalue()
+
+
+def gerar_derivados(nome_arquivo, storage=default_storage):
+    """
+    Gera os derivados da imagem `nome_arquivo` (caminho no storage) e retorna
+    o hash do conteúdo. Derivados que já existem não são refeitos, então
+    chamar de novo para a mesma imagem é barato.
+    """
+    with storage.open(nome_arquivo, 'rb') as arquivo:
+        conteudo = arquivo.read()
+    imagem_hash = hashlib.sha256(conteudo).hexdigest()[:TAMANHO_HASH]
+
+    faltando = [
+        (largura, formato) for largura in LARGURAS for formato in FORMATOS
+        if not storage.exists(caminho_derivado(imagem_hash, largura, formato))
+    ]
+    if not faltando:
+        return imagem_hash
+
+    with Image.open(BytesIO(conteudo)) as original:
+        # Aplica a rotação do EXIF (fotos de celular) antes de redimensionar
+        original = ImageOps.exif_transpose(original)
+        for largura, formato in faltando:
+            copia = original.copy()
+            # Nunca amplia: imagens menores que a largura ficam no tamanho original
+            if copia.width > largura:
+                altura = round(copia.height * largura / copia.width)
+                copia = copia.resize((largura, altura), Image.LANCZOS)
+            storage.save(caminho_derivado(imagem_hash, largura, formato), ContentFile(_codificar(copia, formato)))
+    return imagem_hash
+
+
+def gerar_derivados_seguro(nome_arquivo):
+    # Versão usada no upload e no comando: uma imagem inválida não pode derrubar o save
+    try:
+        return gerar_derivados(nome_arquivo)
+    except ERROS_IMAGEM:
+        logger.exception('Não foi possível gerar os derivados de %s', nome_arquivo)
+        return ''
+
+
+def srcset(imagem_hash, formato):
+    return ', '.join(
+        f'{default_storage.url(caminho_derivado(imagem_hash, largura, formato))} {largura}w' for largura in LARGURAS
+    )
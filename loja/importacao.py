@@ -0,0 +1,299 @@
+import csv
+import json
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.text import slugify
+
+from . import autocompletar
+from .busca import indexar_produtos
+from .cache import invalidar_slugs
+from .models import Categoria, Produto
+
+
+# Importação/sincronização do catálogo a partir dos arquivos dos fornecedores
+# (CSV com cabeçalho ou JSONL), usada pelo comando "importar_catalogo".
+#
+# O arquivo é lido em streaming e processado em lotes. Para cada lote:
+#   1. uma consulta (values_list, sem montar objetos) traz os produtos que já
+#      existem, pelo slug;
+#   2. cada registro é comparado com o produto: novo, alterado ou inalterado;
+#   3. numa transação curta, um bulk_create dos novos e um UPDATE ... WHERE
+#      id IN (...) para cada combinação de mudanças. Num arquivo de estoque
+#      e preços muitos produtos recebem os mesmos valores, e isso sai bem mais
+#      barato que o bulk_update, que monta um CASE WHEN por produto e campo;
+#   4. como bulk_create/update() não disparam os sinais de Produto, o
+#      índice de busca é refeito para quem mudou de nome ou descrição e o
+#      cache das páginas e o autocompletar são invalidados depois do COMMIT.
+#
+# Só os campos presentes no registro são alterados: um arquivo só com
+# "slug,estoque" atualiza o estoque e não mexe no resto. Categorias são
+# informadas pelo nome e criadas quando não existem.
+
+LOTE_PADRAO = 1000
+CAMPOS = ('nome', 'descricao', 'preco', 'estoque', 'disponivel', 'categoria')
+# Campo do arquivo -> coluna de Produto
+COLUNAS = {campo: campo for campo in CAMPOS} | {'categoria': 'categoria_id'}
+OBRIGATORIOS_NOVO = ('nome', 'preco', 'categoria')
+# Mudanças nesses campos mudam o que o autocompletar mostra
+CAMPOS_AUTOCOMPLETAR = {'nome', 'disponivel'}
+CAMPOS_BUSCA = {'nome', 'descricao'}
+
+# Limites das colunas: um valor fora deles vira erro da linha, e não um erro
+# do banco que derrubaria o lote inteiro
+TAMANHOS = {
+    'slug': Produto._meta.get_field('slug').max_length,
+    'nome': Produto._meta.get_field('nome').max_length,
+    'categoria': Categoria._meta.get_field('nome').max_length,
+}
+_preco = Produto._meta.get_field('preco')
+PRECO_MAXIMO = Decimal(10) ** (_preco.max_digits - _preco.decimal_places)
+CASAS_PRECO = Decimal(1).scaleb(-_preco.decimal_places)
+# PositiveIntegerField: o maior inteiro aceito por todos os bancos
+ESTOQUE_MAXIMO = 2147483647
+
+VERDADEIRO = {'1', 'true', 'sim', 's', 'yes', 'y'}
+FALSO = {'0', 'false', 'nao', 'não', 'n', 'no'}
+
+
+class RegistroInvalido(ValueError):
+    pass
+
+
+def ler_registros(arquivo, formato):
+    # Gera (número da linha, dicionário) sem carregar o arquivo inteiro
+    if formato == 'csv':
+        for numero, registro in enumerate(csv.DictReader(arquivo), start=2):
+            yield numero, registro
+    elif formato == 'jsonl':
+        for numero, linha in enumerate(arquivo, start=1):
+            if not linha.strip():
+                continue
+            try:
+                yield numero, json.loads(linha)
+            except json.JSONDecodeError as erro:
+                yield numero, RegistroInvalido(f'JSON inválido: {erro.msg}')
+    else:
+        raise ValueError(f'Formato de importação desconhecido: {formato}')
+
+
+def _texto(valor):
+    return str(valor).strip() if valor is not None else ''
+
+
+def _limpar(registro):
+    """
+    Converte um registro do arquivo em {campo: valor} com os tipos do modelo,
+    só com os campos presentes. Levanta RegistroInvalido.
+    """
+    if isinstance(registro, RegistroInvalido):
+        raise registro
+    if not isinstance(registro, dict):
+        raise RegistroInvalido('o registro deve ser um objeto')
+    slug = _texto(registro.get('slug'))
+    if not slug or slugify(slug) != slug:
+        raise RegistroInvalido(f'slug inválido: "{slug}"')
+    if len(slug) > TAMANHOS['slug']:
+        raise RegistroInvalido(f'slug com mais de {TAMANHOS["slug"]} caracteres')
+
+    dados = {'slug': slug}
+    for campo in CAMPOS:
+        valor = _texto(registro.get(campo))
+        if not valor:
+            # Coluna ausente ou célula vazia: o campo não é alterado
+            continue
+        if campo in TAMANHOS and len(valor) > TAMANHOS[campo]:
+            raise RegistroInvalido(f'{campo} com mais de {TAMANHOS[campo]} caracteres')
+        if campo == 'preco':
+            try:
+                # Aceita "12.50" e "12,50"
+                preco = Decimal(valor.replace(',', '.') if '.' not in valor else valor)
+                # "NaN" e "Infinity" são Decimais válidos, mas não preços
+                if not preco.is_finite():
+                    raise InvalidOperation
+                preco = preco.quantize(CASAS_PRECO)
+            except InvalidOperation:
+                raise RegistroInvalido(f'preço inválido: "{valor}"')
+            if preco < 0:
+                raise RegistroInvalido(f'preço negativo: "{valor}"')
+            if preco >= PRECO_MAXIMO:
+                raise RegistroInvalido(f'preço acima do limite: "{valor}"')
+            dados[campo] = preco
+        elif campo == 'estoque':
+            if not (valor.isascii() and valor.isdigit()) or int(valor) > ESTOQUE_MAXIMO:
+                raise RegistroInvalido(f'estoque inválido: "{valor}"')
+            dados[campo] = int(valor)
+        elif campo == 'disponivel':
+            # true/false do JSON chegam aqui como "True"/"False"
+            if valor.lower() not in VERDADEIRO | FALSO:
+                raise RegistroInvalido(f'disponível inválido: "{valor}"')
+            dados[campo] = valor.lower() in VERDADEIRO
+        elif campo == 'categoria':
+            if not slugify(valor):
+                raise RegistroInvalido(f'categoria inválida: "{valor}"')
+            dados[campo] = valor
+        else:
+            dados[campo] = valor
+    return dados
+
+
+class _Categorias:
+    # Nome -> id das categorias, carregado uma vez; as que faltam são criadas em lote.
+    # "Minerais Raros" e "minerais raros" têm o mesmo slug e são a mesma categoria.
+
+    def __init__(self):
+        self.ids = {}
+        self.por_slug = {}
+        for categoria_id, nome, slug in Categoria.objects.values_list('id', 'nome', 'slug'):
+            self._registrar(categoria_id, nome, slug)
+        self.criadas = 0
+
+    def _registrar(self, categoria_id, nome, slug):
+        self.ids[nome] = self.por_slug[slug] = categoria_id
+        # Slug editado à mão: o nome ainda acha a categoria pelo slug que geraria
+        self.por_slug.setdefault(slugify(nome), categoria_id)
+
+    def garantir(self, nomes):
+        """
+        Cria as categorias que faltam. Retorna os nomes que não puderam ser
+        resolvidos (ex: o insert foi ignorado por conflito com um nome que o
+        banco considera igual e a categoria não foi encontrada).
+        """
+        faltando = {}
+        for nome in nomes:
+            if nome in self.ids:
+                continue
+            slug = slugify(nome)
+            if slug in self.por_slug:
+                self.ids[nome] = self.por_slug[slug]
+            else:
+                faltando.setdefault(slug, nome)
+        if not faltando:
+            return set()
+        # ignore_conflicts: o nome também é único, e o banco pode considerar
+        # iguais nomes diferentes aqui (ex: maiúsculas na collation do MySQL)
+        Categoria.objects.bulk_create(
+            [Categoria(nome=nome, slug=slug) for slug, nome in faltando.items()], ignore_conflicts=True
+        )
+        # bulk_create não devolve o id em todos os bancos (MySQL) nem diz quais
+        # linhas foram ignoradas: relê pelo slug e pelo nome
+        encontradas = Categoria.objects.filter(
+            Q(slug__in=faltando) | Q(nome__in=faltando.values())
+        ).values_list('id', 'nome', 'slug')
+        for categoria_id, nome, slug in encontradas:
+            if faltando.get(slug) == nome:
+                self.criadas += 1
+            self._registrar(categoria_id, nome, slug)
+        sem_categoria = set()
+        for nome in nomes:
+            if nome not in self.ids:
+                if slugify(nome) in self.por_slug:
+                    self.ids[nome] = self.por_slug[slugify(nome)]
+                else:
+                    sem_categoria.add(nome)
+        return sem_categoria
+
+
+def _processar_lote(registros, categorias, resultado):
+    """`registros`: {slug: dados limpos}. Aplica o lote numa transação."""
+    sem_categoria = categorias.garantir({d['categoria'] for d in registros.values() if 'categoria' in d})
+
+    colunas = [COLUNAS[campo] for campo in CAMPOS]
+    existentes = {
+        linha[0]: dict(zip(['id', *colunas], linha[1:]))
+        for linha in Produto.objects.filter(slug__in=registros).values_list('slug', 'id', *colunas)
+    }
+
+    novos = []
+    # Produtos com exatamente as mesmas mudanças viram um único UPDATE ... WHERE id IN (...)
+    grupos = defaultdict(list)
+    reindexar, mudou_autocompletar = [], False
+
+    for slug, dados in registros.items():
+        if dados.get('categoria') in sem_categoria:
+            resultado['erros'] += 1
+            resultado['mensagens'].append(f'{slug}: não foi possível criar a categoria "{dados["categoria"]}"')
+            continue
+        valores = {
+            COLUNAS[campo]: (categorias.ids[valor] if campo == 'categoria' else valor)
+            for campo, valor in dados.items() if campo != 'slug'
+        }
+        atual = existentes.get(slug)
+        if atual is None:
+            faltando = [campo for campo in OBRIGATORIOS_NOVO if campo not in dados]
+            if faltando:
+                resultado['erros'] += 1
+                resultado['mensagens'].append(f'{slug}: produto novo sem {", ".join(faltando)}')
+                continue
+            valores.setdefault('descricao', '')
+            novos.append(Produto(slug=slug, **valores))
+            continue
+
+        mudancas = {coluna: valor for coluna, valor in valores.items() if atual[coluna] != valor}
+        if not mudancas:
+            resultado['inalterados'] += 1
+            continue
+        grupos[tuple(sorted(mudancas.items()))].append((atual['id'], slug))
+        if mudancas.keys() & CAMPOS_BUSCA:
+            atual.update(mudancas)
+            reindexar.append(Produto(pk=atual['id'], nome=atual['nome'], descricao=atual['descricao']))
+        mudou_autocompletar |= bool(mudancas.keys() & CAMPOS_AUTOCOMPLETAR)
+
+    agora = timezone.now()
+    with transaction.atomic():
+        if novos:
+            Produto.objects.bulk_create(novos)
+            # bulk_create não devolve o id em todos os bancos (MySQL): relê pelo slug
+            ids = dict(Produto.objects.filter(slug__in=[p.slug for p in novos]).values_list('slug', 'id'))
+            for produto in novos:
+                produto.pk = ids[produto.slug]
+            reindexar += novos
+            mudou_autocompletar = True
+        for mudancas, produtos in grupos.items():
+            # update() não aplica o auto_now (validadores de cache HTTP, loja/condicional.py)
+            Produto.objects.filter(id__in=[pid for pid, _ in produtos]).update(**dict(mudancas), atualizado_em=agora)
+        if reindexar:
+            indexar_produtos(reindexar)
+
+        slugs_alterados = [slug for produtos in grupos.values() for _, slug in produtos]
+        transaction.on_commit(lambda: invalidar_slugs(slugs_alterados))
+        if mudou_autocompletar:
+            transaction.on_commit(autocompletar.invalidar)
+
+    resultado['inseridos'] += len(novos)
+    resultado['atualizados'] += len(slugs_alterados)
+
+
+def importar_catalogo(arquivo, formato='csv', lote=LOTE_PADRAO):
+    """
+    Importa/sincroniza os produtos do arquivo (aberto em modo texto).
+    Retorna um dicionário com inseridos, atualizados, inalterados, erros,
+    categorias_criadas e as mensagens de erro (com o número da linha).
+    """
+    resultado = {'inseridos': 0, 'atualizados': 0, 'inalterados': 0, 'erros': 0, 'mensagens': []}
+    categorias = _Categorias()
+    registros = ler_registros(arquivo, formato)
+
+    while True:
+        pedaco = list(islice(registros, lote))
+        if not pedaco:
+            break
+        limpos = {}
+        for numero, registro in pedaco:
+            try:
+                dados = _limpar(registro)
+            except RegistroInvalido as erro:
+                resultado['erros'] += 1
+                resultado['mensagens'].append(f'linha {numero}: {erro}')
+                continue
+            # O mesmo slug repetido no lote: valem os últimos valores de cada campo
+            limpos.setdefault(dados['slug'], {}).update(dados)
+        if limpos:
+            _processar_lote(limpos, categorias, resultado)
+
+    resultado['categorias_criadas'] = categorias.criadas
+    return resultado
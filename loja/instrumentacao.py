@@ -0,0 +1,95 @@
+import time
+from contextvars import ContextVar
+
+from django.dispatch import Signal, receiver
+from django.template.base import Template
+
+
+# Métricas da requisição atual, usadas pelo InstrumentacaoMiddleware.
+# Fora de uma requisição amostrada o ContextVar fica vazio e todos os
+# ganchos abaixo retornam logo na primeira linha.
+
+_registro_atual = ContextVar('loja_instrumentacao', default=None)
+
+# Enviado ao fim de cada renderização de template de nível mais alto (includes e
+# extends ficam dentro dela). O sinal template_rendered do Django só existe no
+# ambiente de testes, por isso a loja tem o seu.
+template_renderizado = Signal()
+
+
+class Registro:
+    __slots__ = ('consultas', 'tempo_sql', 'tempo_render', 'cache_acertos', 'cache_falhas', '_profundidade')
+
+    def __init__(self):
+        self.consultas = 0
+        self.tempo_sql = 0.0
+        self.tempo_render = 0.0
+        self.cache_acertos = 0
+        self.cache_falhas = 0
+        self._profundidade = 0
+
+
+def iniciar():
+    registro = Registro()
+    return registro, _registro_atual.set(registro)
+
+
+def encerrar(token):
+    _registro_atual.reset(token)
+
+
+def registrar_cache(acerto):
+    # Chamado pelas camadas de cache da loja (ex: loja/cache.py)
+    registro = _registro_atual.get()
+    if registro is not None:
+        if acerto:
+            registro.cache_acertos += 1
+        else:
+            registro.cache_falhas += 1
+
+
+def medir_sql(execute, sql, params, many, context):
+    # Usado com connection.execute_wrapper(); não depende de DEBUG
+    registro = _registro_atual.get()
+    if registro is None:
+        return execute(sql, params, many, context)
+    inicio = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        registro.tempo_sql += time.perf_counter() - inicio
+        registro.consultas += 1
+
+
+_render_original = None
+
+
+def instalar_medicao_templates():
+    # Envolve Template.render uma única vez por processo. Sem registro ativo
+    # o custo extra é uma leitura de ContextVar.
+    global _render_original
+    if _render_original is not None:
+        return
+    _render_original = Template.render
+
+    def render(self, context):
+        registro = _registro_atual.get()
+        if registro is None:
+            return _render_original(self, context)
+        registro._profundidade += 1
+        inicio = time.perf_counter()
+        try:
+            return _render_original(self, context)
+        finally:
+            registro._profundidade -= 1
+            if registro._profundidade == 0:
+                template_renderizado.send(sender=Template, template=self, duracao=time.perf_counter() - inicio)
+
+    Template.render = render
+
+
+@receiver(template_renderizado)
+def acumular_tempo_render(sender, template, duracao, **kwargs):
+    registro = _registro_atual.get()
+    if registro is not None:
+        registro.tempo_render += duracao
@@ -0,0 +1,40 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from loja.aquecimento import aquecer_templates, medir_templates, templates_da_loja
+
+
+class Command(BaseCommand):
+    help = (
+        'Compila todos os templates da loja (templates/loja, incluindo loja/email, e base.html) e falha se '
+        'algum tiver erro. Com --medir, mostra a renderização a frio e a quente de cada template.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--medir', action='store_true', help='Mede a latência a frio e a quente de cada template.')
+        parser.add_argument('--repeticoes', type=int, default=5, help='Medições por template (usa a mediana).')
+        parser.add_argument('--saida', help='Grava as medições em JSON neste arquivo (com --medir).')
+
+    def handle(self, *args, **options):
+        nomes = templates_da_loja()
+        erros = aquecer_templates(nomes)
+        for nome, erro in erros.items():
+            self.stderr.write(f'{nome}: {erro}')
+        if erros:
+            raise CommandError(f'{len(erros)} template(s) com erro.')
+        self.stdout.write(self.style.SUCCESS(f'{len(nomes)} templates compilados.'))
+
+        if not options['medir']:
+            return
+        medidas = medir_templates(nomes, repeticoes=max(1, options['repeticoes']))
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{"template":<42} {"frio":>10} {"quente":>10}'))
+        for nome, medida in medidas.items():
+            # * = não renderiza sem contexto: os tempos são só da compilação
+            marca = '' if medida['renderiza'] else ' *'
+            self.stdout.write(
+                f'{nome:<42} {medida["frio_ms"]:>7.3f} ms {medida["quente_ms"]:>7.3f} ms{marca}'
+            )
+        if options['saida']:
+            with open(options['saida'], 'w', encoding='utf-8') as arquivo:
+                json.dump({'repeticoes': options['repeticoes'], 'templates': medidas}, arquivo, indent=2, ensure_ascii=False)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from loja.vendas import atualizar_vendas
+
+
+class Command(BaseCommand):
+    help = 'Atualiza as vendas diárias (painel de vendas) com os pedidos novos ou alterados desde a última execução.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--completo', action='store_true',
+            help='Recalcula todos os dias, não só os que mudaram desde a última execução.',
+        )
+
+    def handle(self, *args, **options):
+        dias = atualizar_vendas(completo=options['completo'])
+        self.stdout.write(self.style.SUCCESS(f'{dias} dia(s) de vendas recalculado(s).'))
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from loja.emails import MAX_TENTATIVAS, processar_fila
+
+
+class Command(BaseCommand):
+    help = 'Envia os e-mails pendentes da fila (outbox) em lotes, reutilizando a mesma conexão SMTP entre os lotes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=50, help='Quantidade de e-mails por lote.')
+        parser.add_argument('--max-tentativas', type=int, default=MAX_TENTATIVAS,
+                            help='Depois de tantas falhas o e-mail é marcado como "falhou".')
+        parser.add_argument('--continuo', action='store_true',
+                            help='Não termina quando a fila esvazia: continua verificando a cada --intervalo segundos.')
+        parser.add_argument('--intervalo', type=float, default=5.0, help='Pausa (em segundos) no modo contínuo.')
+
+    def handle(self, *args, **options):
+        total_enviados = total_falhas = 0
+
+        while True:
+            # O worker fica no ar por muito tempo: descarta a conexão com o banco
+            # quando passou de CONN_MAX_AGE ou não responde mais, como o Django faz
+            # a cada requisição
+            close_old_connections()
+            enviados, falhas = processar_fila(lote=options['lote'], max_tentativas=options['max_tentativas'])
+            total_enviados += enviados
+            total_falhas += falhas
+            if enviados or falhas:
+                self.stdout.write(f'Lote processado: {enviados} enviado(s), {falhas} falha(s).')
+                continue
+            if not options['continuo']:
+                break
+            time.sleep(options['intervalo'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Fila processada: {total_enviados} e-mail(s) enviado(s), {total_falhas} falha(s).'
+        ))
@@ -0,0 +1,44 @@
+from datetime import date, datetime, time, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from loja.exportacao import FORMATOS, LOTE_PADRAO, linhas_exportacao
+from loja.models import Pedido
+
+
+def _inicio_do_dia(dia):
+    return timezone.make_aware(datetime.combine(dia, time.min))
+
+
+class Command(BaseCommand):
+    help = 'Exporta pedidos e itens em CSV ou JSONL, em streaming (memória constante).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--formato', choices=sorted(FORMATOS), default='csv')
+        parser.add_argument('--status', action='append', choices=[s for s, _ in Pedido.STATUS_CHOICES],
+                            help='Só pedidos com este status (pode repetir).')
+        parser.add_argument('--desde', type=date.fromisoformat,
+                            help='Pedidos criados a partir desta data (AAAA-MM-DD).')
+        parser.add_argument('--ate', type=date.fromisoformat,
+                            help='Pedidos criados até esta data, inclusive (AAAA-MM-DD).')
+        parser.add_argument('--lote', type=int, default=LOTE_PADRAO, help='Pedidos lidos do banco por vez.')
+        parser.add_argument('--saida', help='Arquivo de saída (padrão: a saída padrão).')
+
+    def handle(self, *args, **options):
+        pedidos = Pedido.objects.all()
+        if options['status']:
+            pedidos = pedidos.filter(status__in=options['status'])
+        # Intervalos em criado_em (e não criado_em__date) para usar o índice
+        if options['desde']:
+            pedidos = pedidos.filter(criado_em__gte=_inicio_do_dia(options['desde']))
+        if options['ate']:
+            pedidos = pedidos.filter(criado_em__lt=_inicio_do_dia(options['ate'] + timedelta(days=1)))
+
+        linhas = linhas_exportacao(pedidos, options['formato'], options['lote'])
+        if options['saida']:
+            with open(options['saida'], 'w', encoding='utf-8', newline='') as arquivo:
+                arquivo.writelines(linhas)
+        else:
+            for linha in linhas:
+                self.stdout.write(linha, ending='')
@@ -0,0 +1,56 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from loja.cache import invalidar_produtos
+from loja.imagens import gerar_derivados_seguro
+from loja.models import Produto
+
+
+def _processar(item):
+    # Roda nos processos filhos: só Pillow e storage, nada de banco
+    produto_id, nome_arquivo = item
+    return produto_id, gerar_derivados_seguro(nome_arquivo)
+
+
+class Command(BaseCommand):
+    help = 'Gera os derivados redimensionados (miniaturas e WebP) das imagens de produtos, em paralelo.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processos', type=int, default=os.cpu_count() or 1, help='Quantidade de processos em paralelo.')
+        parser.add_argument('--todos', action='store_true', help='Inclui produtos que já têm derivados (ex: após mudar as larguras).')
+
+    def handle(self, *args, **options):
+        produtos = Produto.objects.exclude(imagem='').exclude(imagem__isnull=True)
+        if not options['todos']:
+            produtos = produtos.filter(imagem_hash='')
+        itens = list(produtos.order_by('id').values_list('id', 'imagem'))
+        hashes_anteriores = dict(produtos.values_list('id', 'imagem_hash'))
+
+        if options['processos'] > 1:
+            # Os filhos não podem herdar as conexões abertas com o banco
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['processos'], initializer=django.setup) as executor:
+                resultados = list(executor.map(_processar, itens, chunksize=8))
+        else:
+            resultados = [_processar(item) for item in itens]
+
+        gerados = [(produto_id, h) for produto_id, h in resultados if h]
+        # Só os produtos cujo hash mudou. bulk_update não aplica o auto_now: o
+        # atualizado_em move o ETag/Last-Modified das páginas (loja/condicional.py),
+        # senão o navegador receberia 304 e continuaria com as URLs antigas
+        agora = timezone.now()
+        atualizados = [
+            Produto(id=produto_id, imagem_hash=h, atualizado_em=agora)
+            for produto_id, h in gerados if h != hashes_anteriores.get(produto_id)
+        ]
+        Produto.objects.bulk_update(atualizados, ['imagem_hash', 'atualizado_em'], batch_size=1000)
+        # bulk_update não dispara sinais: as páginas de produto em cache ainda têm o hash antigo
+        invalidar_produtos([p.id for p in atualizados])
+
+        falhas = len(resultados) - len(gerados)
+        self.stdout.write(self.style.SUCCESS(f'Derivados gerados para {len(gerados)} produto(s), {falhas} falha(s).'))
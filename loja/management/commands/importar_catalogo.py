@@ -0,0 +1,43 @@
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from loja.importacao import LOTE_PADRAO, importar_catalogo
+
+# Quantas mensagens de erro são mostradas no fim
+MENSAGENS_MOSTRADAS = 20
+
+
+class Command(BaseCommand):
+    help = (
+        'Importa ou atualiza produtos, preços e estoque a partir de um arquivo CSV (com cabeçalho) ou JSONL. '
+        'Campos: slug (obrigatório), nome, descricao, preco, estoque, disponivel, categoria (nome).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help='Caminho do arquivo.')
+        parser.add_argument('--formato', choices=['csv', 'jsonl'],
+                            help='Formato do arquivo (padrão: pela extensão).')
+        parser.add_argument('--lote', type=int, default=LOTE_PADRAO, help='Registros processados por transação.')
+
+    def handle(self, *args, **options):
+        caminho = Path(options['arquivo'])
+        formato = options['formato'] or caminho.suffix.lstrip('.').lower()
+        if formato not in ('csv', 'jsonl'):
+            raise CommandError('Não foi possível descobrir o formato pela extensão; use --formato.')
+        if not caminho.is_file():
+            raise CommandError(f'Arquivo não encontrado: {caminho}')
+
+        # utf-8-sig: aceita o BOM que o Excel grava no CSV
+        with caminho.open(encoding='utf-8-sig', newline='') as arquivo:
+            resultado = importar_catalogo(arquivo, formato, options['lote'])
+
+        for mensagem in resultado['mensagens'][:MENSAGENS_MOSTRADAS]:
+            self.stderr.write(mensagem)
+        if len(resultado['mensagens']) > MENSAGENS_MOSTRADAS:
+            self.stderr.write(f'... e mais {len(resultado["mensagens"]) - MENSAGENS_MOSTRADAS} erro(s).')
+        self.stdout.write(self.style.SUCCESS(
+            f'{resultado["inseridos"]} inserido(s), {resultado["atualizados"]} atualizado(s), '
+            f'{resultado["inalterados"]} inalterado(s), {resultado["erros"]} com erro; '
+            f'{resultado["categorias_criadas"]} categoria(s) criada(s).'
+        ))
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from loja.sessoes import LOTE, limpar_sessoes_expiradas, usa_banco
+
+
+class Command(BaseCommand):
+    help = (
+        'Apaga as sessões expiradas da tabela django_session em lotes pequenos, sem segurar a tabela. '
+        'Use no lugar do clearsessions (ex: agendado uma vez por hora).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=LOTE, help='Sessões apagadas por transação.')
+        parser.add_argument('--pausa', type=float, default=0, help='Segundos de espera entre os lotes.')
+
+    def handle(self, *args, **options):
+        if not usa_banco():
+            self.stdout.write(f'{settings.SESSION_ENGINE} não guarda sessões no banco: nada a apagar.')
+            return
+        apagadas = limpar_sessoes_expiradas(lote=max(1, options['lote']), pausa=options['pausa'])
+        self.stdout.write(self.style.SUCCESS(f'{apagadas} sessões expiradas apagadas.'))
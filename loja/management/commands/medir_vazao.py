@@ -0,0 +1,73 @@
+import json
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+from loja.models import Produto
+from loja.vazao import MODOS, medir
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara a vazão (requisições por segundo) das páginas de leitura no WSGI, com as views síncronas, '
+        'e no ASGI, com as views assíncronas. Usa o banco configurado: rode numa cópia com dados realistas.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requisicoes', type=int, default=200, help='Requisições por página e modo.')
+        parser.add_argument('--concorrencia', type=int, default=10, help='Requisições ao mesmo tempo.')
+        parser.add_argument('--modo', action='append', choices=sorted(MODOS),
+                            help='Só este modo (pode repetir). Padrão: todos.')
+        parser.add_argument('--usuario', help='Usuário logado nas páginas (o histórico de pedidos só é medido com ele).')
+        parser.add_argument('--host', default='localhost', help='Host das requisições (precisa estar em ALLOWED_HOSTS).')
+        parser.add_argument('--saida', help='Grava o resultado em JSON neste arquivo.')
+
+    def handle(self, *args, **options):
+        produtos = list(Produto.objects.filter(disponivel=True).order_by('id').values_list('id', 'slug')[:5])
+        if not produtos:
+            raise CommandError('Nenhum produto disponível para medir.')
+
+        client = Client(HTTP_HOST=options['host'])
+        if options['usuario']:
+            try:
+                client.force_login(User.objects.get(username=options['usuario']))
+            except User.DoesNotExist:
+                raise CommandError(f'Usuário "{options["usuario"]}" não encontrado.')
+        # Um carrinho com alguns produtos, gravado no armazenamento configurado
+        for produto_id, _ in produtos:
+            client.post(reverse('loja:adicionar_ao_carrinho', args=[produto_id]), {'quantidade': 1})
+        cookies = '; '.join(f'{nome}={cookie.value}' for nome, cookie in client.cookies.items())
+
+        cenarios = {
+            'lista_produtos': (reverse('loja:lista_produtos'), cookies),
+            'detalhe_produto': (reverse('loja:detalhe_produto', args=[produtos[0][1]]), cookies),
+            'detalhe_carrinho': (reverse('loja:detalhe_carrinho'), cookies),
+        }
+        if options['usuario']:
+            cenarios['meus_pedidos'] = (reverse('loja:meus_pedidos'), cookies)
+
+        resultado = medir(
+            cenarios, modos=options['modo'] or tuple(MODOS), requisicoes=options['requisicoes'],
+            concorrencia=options['concorrencia'], host=options['host'],
+        )
+
+        for modo, paginas in resultado.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(modo))
+            for nome, medida in paginas.items():
+                self.stdout.write(
+                    f'  {nome:<18} {medida["por_segundo"]:>8.1f} req/s   '
+                    f'p50 {medida["latencia_p50_ms"]:>7.2f} ms   p95 {medida["latencia_p95_ms"]:>7.2f} ms   '
+                    f'erros {medida["erros"]}'
+                )
+        if options['saida']:
+            relatorio = {
+                'banco': settings.DATABASES['default']['ENGINE'],
+                'requisicoes': options['requisicoes'],
+                'concorrencia': options['concorrencia'],
+                'modos': resultado,
+            }
+            with open(options['saida'], 'w', encoding='utf-8') as arquivo:
+                json.dump(relatorio, arquivo, indent=2, ensure_ascii=False)
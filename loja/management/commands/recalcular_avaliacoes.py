@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from loja.models import Avaliacao, Produto
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói em lote os agregados de avaliações (contagem, soma e histograma) de todos os produtos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help='Quantidade de produtos processados por transação.')
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        ids = list(Produto.objects.order_by('id').values_list('id', flat=True))
+        total = 0
+
+        for inicio in range(0, len(ids), lote):
+            ids_lote = ids[inicio:inicio + lote]
+            with transaction.atomic():
+                # Trava os produtos do lote para que nenhuma avaliação nova
+                # seja contada pela metade enquanto recalculamos
+                produtos = list(Produto.objects.select_for_update().filter(id__in=ids_lote).only('id', *Produto.CAMPOS_AGREGADOS))
+
+                # Uma única consulta agregada por lote, com o histograma via Count(filter=...)
+                agregados = {
+                    a['produto']: a for a in Avaliacao.objects.filter(produto__in=ids_lote)
+                    .order_by()
+                    .values('produto')
+                    .annotate(
+                        contagem=Count('id'),
+                        soma=Sum('nota'),
+                        **{f'nota_{n}': Count('id', filter=Q(nota=n)) for n in range(1, 6)},
+                    )
+                }
+
+                for produto in produtos:
+                    agregado = agregados.get(produto.id, {})
+                    produto.avaliacoes_contagem = agregado.get('contagem', 0)
+                    produto.avaliacoes_soma = agregado.get('soma') or 0
+                    for n in range(1, 6):
+                        setattr(produto, f'avaliacoes_nota_{n}', agregado.get(f'nota_{n}', 0))
+
+                Produto.objects.bulk_update(produtos, Produto.CAMPOS_AGREGADOS)
+            total += len(produtos)
+
+        self.stdout.write(self.style.SUCCESS(f'Agregados de avaliações recalculados para {total} produto(s).'))
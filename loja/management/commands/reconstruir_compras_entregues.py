@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from loja.elegibilidade import reconstruir_compras_entregues
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói a tabela de compras entregues (quem pode avaliar cada produto) a partir dos pedidos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=5000, help='Quantidade de registros inseridos por vez.')
+
+    def handle(self, *args, **options):
+        total = reconstruir_compras_entregues(lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(f'{total} compra(s) entregue(s) registradas.'))
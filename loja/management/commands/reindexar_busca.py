@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from loja.busca import indexar_produtos
+from loja.models import Produto
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói em lote o índice de busca (TermoBusca) de todos os produtos.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help='Quantidade de produtos processados por transação.')
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        ids = list(Produto.objects.order_by('id').values_list('id', flat=True))
+
+        for inicio in range(0, len(ids), lote):
+            with transaction.atomic():
+                indexar_produtos(Produto.objects.filter(id__in=ids[inicio:inicio + lote]).only('id', 'nome', 'descricao'))
+
+        self.stdout.write(self.style.SUCCESS(f'Índice de busca reconstruído para {len(ids)} produto(s).'))
@@ -0,0 +1,166 @@
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.functional import SimpleLazyObject
+
+from . import instrumentacao, replicas
+from .carrinho import Carrinho
+
+
+logger = logging.getLogger('loja.instrumentacao')
+
+
+class CarrinhoMiddleware:
+    """
+    Disponibiliza request.carrinho (criado só se alguma view usar) e grava as
+    alterações do carrinho uma única vez, na resposta. Funciona também com as
+    views assíncronas (loja/views_assincronas.py), sem passar por uma thread.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _preparar(self, request):
+        criado = []
+
+        def obter_carrinho():
+            criado.append(Carrinho(request))
+            return criado[0]
+
+        request.carrinho = SimpleLazyObject(obter_carrinho)
+        return criado
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        criado = self._preparar(request)
+        response = self.get_response(request)
+
+        if criado:
+            criado[0].persistir(response)
+        return response
+
+    async def __acall__(self, request):
+        criado = self._preparar(request)
+        response = await self.get_response(request)
+
+        if criado:
+            # O armazenamento na sessão ou no cache não é assíncrono
+            await sync_to_async(criado[0].persistir)(response)
+        return response
+
+
+class InstrumentacaoMiddleware:
+    """
+    Mede, por requisição amostrada: número de consultas, tempo de SQL, tempo de
+    renderização de templates, acertos e falhas de cache e tempo total.
+
+    O resultado vai no cabeçalho Server-Timing e num log estruturado (JSON) no
+    logger 'loja.instrumentacao', marcado com o nome da URL (ex: loja:lista_produtos).
+    A fração de requisições medidas vem de LOJA_INSTRUMENTACAO_AMOSTRAGEM (0 a 1);
+    com 0 o middleware nem é carregado. É só síncrono: ligado no ASGI, as
+    views assíncronas passam a rodar numa thread.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.amostragem = float(getattr(settings, 'LOJA_INSTRUMENTACAO_AMOSTRAGEM', 0))
+        if self.amostragem <= 0:
+            raise MiddlewareNotUsed
+        instrumentacao.instalar_medicao_templates()
+
+    def __call__(self, request):
+        if self.amostragem < 1 and random.random() >= self.amostragem:
+            return self.get_response(request)
+
+        registro, token = instrumentacao.iniciar()
+        inicio = time.perf_counter()
+        try:
+            with ExitStack() as pilha:
+                for conexao in connections.all():
+                    pilha.enter_context(conexao.execute_wrapper(instrumentacao.medir_sql))
+                response = self.get_response(request)
+        finally:
+            instrumentacao.encerrar(token)
+        total = time.perf_counter() - inicio
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else None
+
+        response['Server-Timing'] = ', '.join([
+            f'db;dur={registro.tempo_sql * 1000:.1f};desc="{registro.consultas} consultas"',
+            f'tpl;dur={registro.tempo_render * 1000:.1f}',
+            f'cache;desc="acertos={registro.cache_acertos} falhas={registro.cache_falhas}"',
+            f'total;dur={total * 1000:.1f}',
+        ])
+        logger.info(json.dumps({
+            'view': view,
+            'metodo': request.method,
+            'status': response.status_code,
+            'consultas': registro.consultas,
+            'tempo_sql_ms': round(registro.tempo_sql * 1000, 3),
+            'tempo_render_ms': round(registro.tempo_render * 1000, 3),
+            'cache_acertos': registro.cache_acertos,
+            'cache_falhas': registro.cache_falhas,
+            'tempo_total_ms': round(total * 1000, 3),
+        }))
+        return response
+
+
+class ReplicaMiddleware:
+    """
+    Prepara o roteamento para as réplicas de leitura (loja/replicas.py) e
+    garante "ler o que escreveu": depois de uma requisição que escreveu no
+    banco (ou de qualquer POST), o navegador recebe um cookie e, enquanto ele
+    durar, as leituras dele vão para a primária. Sem réplicas configuradas o
+    middleware nem é carregado.
+    """
+
+    METODOS_SEGUROS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if not replicas.replicas():
+            raise MiddlewareNotUsed
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        self.cookie = getattr(settings, 'LOJA_REPLICA_COOKIE', 'loja_primaria')
+        self.segundos = int(getattr(settings, 'LOJA_REPLICA_FIXAR_SEGUNDOS', 10))
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        estado, token = replicas.iniciar_requisicao(fixado=self.cookie in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            replicas.encerrar_requisicao(token)
+        return self._fixar(request, response, estado)
+
+    async def __acall__(self, request):
+        # O estado vai junto para as threads do ORM assíncrono (sync_to_async copia o contexto)
+        estado, token = replicas.iniciar_requisicao(fixado=self.cookie in request.COOKIES)
+        try:
+            response = await self.get_response(request)
+        finally:
+            replicas.encerrar_requisicao(token)
+        return self._fixar(request, response, estado)
+
+    def _fixar(self, request, response, estado):
+        if estado['escreveu'] or request.method not in self.METODOS_SEGUROS:
+            response.set_cookie(self.cookie, '1', max_age=self.segundos, httponly=True, samesite='Lax')
+        return response
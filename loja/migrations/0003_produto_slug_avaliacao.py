@@ -0,0 +1,52 @@
+# Migração que faltava no repositório: o campo Produto.slug e o modelo
+# Avaliacao já existiam em models.py, mas nunca tinham sido migrados.
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+def preencher_slugs(apps, schema_editor):
+    # Gera um slug único para os produtos que já existem no banco
+    Produto = apps.get_model('loja', 'Produto')
+    for produto in Produto.objects.filter(slug__isnull=True).only('id', 'nome'):
+        produto.slug = f'{slugify(produto.nome)[:180]}-{produto.id}'
+        produto.save(update_fields=['slug'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0002_produto_disponivel'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='produto',
+            name='slug',
+            field=models.SlugField(max_length=200, null=True),
+        ),
+        migrations.RunPython(preencher_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='produto',
+            name='slug',
+            field=models.SlugField(max_length=200, unique=True),
+        ),
+        migrations.CreateModel(
+            name='Avaliacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nota', models.IntegerField(choices=[(1, '★☆☆☆☆'), (2, '★★☆☆☆'), (3, '★★★☆☆'), (4, '★★★★☆'), (5, '★★★★★')])),
+                ('comentario', models.TextField(max_length=500)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='avaliacoes', to='loja.produto')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-criado_em'],
+                'unique_together': {('produto', 'usuario')},
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0003_produto_slug_avaliacao'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='produto',
+            index=models.Index(fields=['nome', 'id'], name='produto_nome_id_idx'),
+        ),
+    ]
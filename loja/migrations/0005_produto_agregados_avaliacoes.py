@@ -0,0 +1,71 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:08
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def preencher_agregados(apps, schema_editor):
+    # Calcula os agregados das avaliações que já existem no banco
+    Avaliacao = apps.get_model('loja', 'Avaliacao')
+    Produto = apps.get_model('loja', 'Produto')
+    agregados = (
+        Avaliacao.objects.order_by()
+        .values('produto')
+        .annotate(
+            contagem=Count('id'),
+            soma=Sum('nota'),
+            **{f'nota_{n}': Count('id', filter=Q(nota=n)) for n in range(1, 6)},
+        )
+    )
+    for a in agregados.iterator():
+        Produto.objects.filter(pk=a['produto']).update(
+            avaliacoes_contagem=a['contagem'],
+            avaliacoes_soma=a['soma'],
+            **{f'avaliacoes_nota_{n}': a[f'nota_{n}'] for n in range(1, 6)},
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0004_produto_nome_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='produto',
+            name='avaliacoes_contagem',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='produto',
+            name='avaliacoes_nota_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='produto',
+            name='avaliacoes_nota_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='produto',
+            name='avaliacoes_nota_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='produto',
+            name='avaliacoes_nota_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='produto',
+            name='avaliacoes_nota_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='produto',
+            name='avaliacoes_soma',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(preencher_agregados, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0005_produto_agregados_avaliacoes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailPendente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('confirmacao_pedido', 'Confirmação de pedido')], default='confirmacao_pedido', max_length=30)),
+                ('status', models.CharField(choices=[('pendente', 'Pendente'), ('enviado', 'Enviado'), ('falhou', 'Falhou')], default='pendente', max_length=10)),
+                ('tentativas', models.PositiveIntegerField(default=0)),
+                ('proxima_tentativa', models.DateTimeField(default=django.utils.timezone.now)),
+                ('ultimo_erro', models.TextField(blank=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('enviado_em', models.DateTimeField(blank=True, null=True)),
+                ('pedido', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='emails', to='loja.pedido')),
+            ],
+            options={
+                'verbose_name': 'E-mail pendente',
+                'verbose_name_plural': 'E-mails pendentes',
+                'indexes': [models.Index(fields=['status', 'proxima_tentativa'], name='email_status_tentativa_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0006_emailpendente'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='avaliacao',
+            index=models.Index(fields=['produto', 'criado_em'], name='avaliacao_produto_criado_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0007_avaliacao_produto_criado_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['status', 'criado_em'], name='pedido_status_criado_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['criado_em'], name='pedido_criado_idx'),
+        ),
+    ]
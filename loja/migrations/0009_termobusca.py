@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def indexar_produtos_existentes(apps, schema_editor):
+    # Monta o índice de busca dos produtos que já existem no banco
+    from loja.busca import termos_produto
+
+    Produto = apps.get_model('loja', 'Produto')
+    TermoBusca = apps.get_model('loja', 'TermoBusca')
+    termos = []
+    for produto in Produto.objects.only('id', 'nome', 'descricao').iterator():
+        termos += [
+            TermoBusca(termo=termo, produto_id=produto.pk, peso=peso)
+            for termo, peso in termos_produto(produto.nome, produto.descricao).items()
+        ]
+        if len(termos) >= 2000:
+            TermoBusca.objects.bulk_create(termos)
+            termos = []
+    TermoBusca.objects.bulk_create(termos)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0008_pedido_indices_admin'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TermoBusca',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('termo', models.CharField(max_length=40)),
+                ('peso', models.PositiveSmallIntegerField()),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='termos_busca', to='loja.produto')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('termo', 'produto'), name='termobusca_termo_produto_uniq')],
+            },
+        ),
+        migrations.RunPython(indexar_produtos_existentes, migrations.RunPython.noop),
+    ]
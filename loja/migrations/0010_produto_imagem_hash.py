@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0009_termobusca'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='produto',
+            name='imagem_hash',
+            field=models.CharField(blank=True, editable=False, max_length=16),
+        ),
+    ]
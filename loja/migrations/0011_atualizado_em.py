@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0010_produto_imagem_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='avaliacao',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='categoria',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='produto',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='produto',
+            index=models.Index(fields=['atualizado_em'], name='produto_atualizado_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:33
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0011_atualizado_em'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['usuario', '-criado_em'], name='pedido_usuario_criado_idx'),
+        ),
+    ]
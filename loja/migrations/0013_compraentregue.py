@@ -0,0 +1,45 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:34
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def preencher_compras_entregues(apps, schema_editor):
+    # Registra as compras dos pedidos que já foram entregues
+    ItemPedido = apps.get_model('loja', 'ItemPedido')
+    CompraEntregue = apps.get_model('loja', 'CompraEntregue')
+    pares = (
+        ItemPedido.objects.filter(pedido__status='entregue')
+        .values_list('pedido__usuario_id', 'produto_id')
+        .distinct()
+        .order_by()
+    )
+    CompraEntregue.objects.bulk_create(
+        [CompraEntregue(usuario_id=u, produto_id=p) for u, p in pares.iterator()], batch_size=2000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0012_pedido_usuario_criado_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompraEntregue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('produto', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='loja.produto')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='compras_entregues', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Compra entregue',
+                'verbose_name_plural': 'Compras entregues',
+                'constraints': [models.UniqueConstraint(fields=('usuario', 'produto'), name='compraentregue_usuario_produto_uniq')],
+            },
+        ),
+        migrations.RunPython(preencher_compras_entregues, migrations.RunPython.noop),
+    ]
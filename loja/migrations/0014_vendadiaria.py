@@ -0,0 +1,65 @@
+# Generated by Django 5.2.5 on 2026-10-18 07:38
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copiar_criado_em(apps, schema_editor):
+    # Pedidos antigos: a última alteração conhecida é a criação
+    Pedido = apps.get_model('loja', 'Pedido')
+    Pedido.objects.update(atualizado_em=F('criado_em'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('loja', '0013_compraentregue'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MarcaProcessamento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=50, unique=True)),
+                ('processado_ate', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='VendaDiaria',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('status', models.CharField(choices=[('pendente', 'Pendente'), ('em_preparacao', 'Em Preparação'), ('enviado', 'Enviado'), ('entregue', 'Entregue'), ('cancelado', 'Cancelado')], max_length=20)),
+                ('quantidade', models.PositiveIntegerField(default=0)),
+                ('receita', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('pedidos', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Venda diária',
+                'verbose_name_plural': 'Vendas diárias',
+            },
+        ),
+        migrations.AddField(
+            model_name='pedido',
+            name='atualizado_em',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='pedido',
+            index=models.Index(fields=['atualizado_em'], name='pedido_atualizado_idx'),
+        ),
+        migrations.RunPython(copiar_criado_em, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='vendadiaria',
+            name='produto',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='loja.produto'),
+        ),
+        migrations.AddConstraint(
+            model_name='vendadiaria',
+            constraint=models.UniqueConstraint(fields=('dia', 'produto', 'status'), name='vendadiaria_dia_produto_status_uniq'),
+        ),
+    ]
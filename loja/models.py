@@ -1,6 +1,6 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User # Importa o modelo de usuário
-from django.db.models import Avg
+from django.utils import timezone
 from decimal import Decimal
 
 
@@ -8,6 +8,8 @@ from decimal import Decimal
 class Categoria(models.Model):
     nome = models.CharField(max_length=100, unique=True, help_text='Nome da categoria')
     slug = models.SlugField(max_length=100, unique=True, help_text='Identificador único para a URL da categoria')
+    # Validadores de cache HTTP (ETag/Last-Modified) das páginas do catálogo
+    atualizado_em = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name_plural = "Categorias" # Define o nome plural no admin
@@ -31,21 +33,72 @@ class Produto(models.Model):
     disponivel = models.BooleanField(default=True, help_text='Indica se o produto está disponível para venda')
     # ImageField precisa da biblioteca Pillow. Instale com: pip install Pillow
     imagem = models.ImageField(upload_to='produtos/', blank=True, null=True, help_text='Imagem do produto')
+    # Hash do conteúdo da imagem, que dá nome aos derivados redimensionados
+    # (loja/imagens.py). Vazio enquanto os derivados não existem.
+    imagem_hash = models.CharField(max_length=16, blank=True, editable=False)
+    # Também é atualizado pelos UPDATEs em massa que mudam o que a página
+    # mostra (agregados de avaliações, baixa de estoque), veja loja/condicional.py
+    atualizado_em = models.DateTimeField(auto_now=True)
+    # Agregados das avaliações, guardados no próprio produto para que o catálogo
+    # e a página de detalhes não precisem de Avg/Count. São mantidos por
+    # loja/signals.py (sempre via UPDATE com F()) e podem ser reconstruídos com
+    # o comando "python manage.py recalcular_avaliacoes".
+    avaliacoes_contagem = models.PositiveIntegerField(default=0, editable=False)
+    avaliacoes_soma = models.PositiveIntegerField(default=0, editable=False)
+    avaliacoes_nota_1 = models.PositiveIntegerField(default=0, editable=False)
+    avaliacoes_nota_2 = models.PositiveIntegerField(default=0, editable=False)
+    avaliacoes_nota_3 = models.PositiveIntegerField(default=0, editable=False)
+    avaliacoes_nota_4 = models.PositiveIntegerField(default=0, editable=False)
+    avaliacoes_nota_5 = models.PositiveIntegerField(default=0, editable=False)
+
+    CAMPOS_AGREGADOS = (
+        'avaliacoes_contagem', 'avaliacoes_soma',
+        'avaliacoes_nota_1', 'avaliacoes_nota_2', 'avaliacoes_nota_3', 'avaliacoes_nota_4', 'avaliacoes_nota_5',
+    )
+
+    class Meta:
+        indexes = [
+            # Cobre a ordenação estável do catálogo (paginação por chave em loja/catalogo.py)
+            models.Index(fields=['nome', 'id'], name='produto_nome_id_idx'),
+            # MAX(atualizado_em) do validador do catálogo sem varrer a tabela
+            models.Index(fields=['atualizado_em'], name='produto_atualizado_idx'),
+        ]
 
     def __str__(self):
         return self.nome
+
+    def save(self, *args, **kwargs):
+        # Um save() comum (ex: pelo admin) regravaria os agregados com os valores
+        # lidos antes, apagando avaliações feitas nesse meio-tempo. Por isso, em
+        # atualizações, salvamos todos os campos MENOS os agregados.
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.CAMPOS_AGREGADOS
+            ]
+        super().save(*args, **kwargs)
+
     # trabalhando com as avaliaões
     def media_avaliacoes(self):
-        # Calcula a média das 'notas' de todas as avaliações relacionadas a este produto.
-        # O aggregate retorna um dicionário, ex: {'media': 4.5}
-        media = self.avaliacoes.all().aggregate(media=Avg('nota'))
-        # Se não houver avaliações, a média será None. Nesse caso, retornamos 0.
-        return media['media'] or 0
+        # Média calculada a partir dos agregados guardados, sem consultar o banco.
+        # Se não houver avaliações, retornamos 0.
+        if not self.avaliacoes_contagem:
+            return 0
+        return self.avaliacoes_soma / self.avaliacoes_contagem
 
     # trabalhando com as avaliaões
     def contagem_avaliacoes(self):
-        # Simplesmente conta quantas avaliações este produto tem.
-        return self.avaliacoes.count()
+        # Quantas avaliações este produto tem (campo agregado)
+        return self.avaliacoes_contagem
+
+    def histograma_avaliacoes(self):
+        # Lista de (nota, quantidade, percentual) da 5 para a 1, para exibir no template
+        histograma = []
+        for nota in range(5, 0, -1):
+            quantidade = getattr(self, f'avaliacoes_nota_{nota}')
+            percentual = round(100 * quantidade / self.avaliacoes_contagem) if self.avaliacoes_contagem else 0
+            histograma.append({'nota': nota, 'quantidade': quantidade, 'percentual': percentual})
+        return histograma
 
 class Endereco(models.Model):
     usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='enderecos')
@@ -81,9 +134,23 @@ class Pedido(models.Model):
     # Liga o pedido a um usuário. Se o usuário for deletado, seus pedidos também serão.
     usuario = models.ForeignKey(User, on_delete=models.CASCADE)
     criado_em = models.DateTimeField(auto_now_add=True) # Data e hora da criação do pedido
+    # Marca d'água da agregação de vendas (loja/vendas.py); update() em massa precisa atualizá-lo à mão
+    atualizado_em = models.DateTimeField(auto_now=True)
     total = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pendente')
 
+    class Meta:
+        indexes = [
+            # Filtro por status + navegação por data no PedidoAdmin
+            models.Index(fields=['status', 'criado_em'], name='pedido_status_criado_idx'),
+            # date_hierarchy e filtro por data sem status
+            models.Index(fields=['criado_em'], name='pedido_criado_idx'),
+            # Histórico "Meus Pedidos" (paginação por chave em loja/pedidos.py)
+            models.Index(fields=['usuario', '-criado_em'], name='pedido_usuario_criado_idx'),
+            # Pedidos novos ou alterados desde a última agregação de vendas
+            models.Index(fields=['atualizado_em'], name='pedido_atualizado_idx'),
+        ]
+
     def __str__(self):
         return f"Pedido {self.id} - {self.usuario.username}"
 
@@ -104,6 +171,40 @@ class ItemPedido(models.Model):
         return self.preco * self.quantidade
 
 
+# Fila (outbox) de e-mails transacionais. O registro é gravado na mesma
+# transação do pedido e enviado depois pelo comando "enviar_emails", assim a
+# latência do SMTP nunca entra no tempo de resposta do checkout.
+class EmailPendente(models.Model):
+    TIPO_CHOICES = (
+        ('confirmacao_pedido', 'Confirmação de pedido'),
+    )
+    STATUS_CHOICES = (
+        ('pendente', 'Pendente'),
+        ('enviado', 'Enviado'),
+        ('falhou', 'Falhou'),
+    )
+    tipo = models.CharField(max_length=30, choices=TIPO_CHOICES, default='confirmacao_pedido')
+    pedido = models.ForeignKey(Pedido, related_name='emails', on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pendente')
+    tentativas = models.PositiveIntegerField(default=0)
+    # Só é enviado a partir deste momento (usado para o backoff entre tentativas)
+    proxima_tentativa = models.DateTimeField(default=timezone.now)
+    ultimo_erro = models.TextField(blank=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    enviado_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'E-mail pendente'
+        verbose_name_plural = 'E-mails pendentes'
+        indexes = [
+            # O worker busca sempre "pendentes cuja próxima tentativa já chegou"
+            models.Index(fields=['status', 'proxima_tentativa'], name='email_status_tentativa_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_tipo_display()} - Pedido {self.pedido_id} ({self.get_status_display()})'
+
+
 # Classe para avaliação dos clientes
 class Avaliacao(models.Model):
     NOTA_CHOICES = (
@@ -118,11 +219,93 @@ class Avaliacao(models.Model):
     nota = models.IntegerField(choices=NOTA_CHOICES)
     comentario = models.TextField(max_length=500)
     criado_em = models.DateTimeField(auto_now_add=True)
+    atualizado_em = models.DateTimeField(auto_now=True)
 
     class Meta:
         # Garante que um usuário só pode fazer uma avaliação por produto
         unique_together = ('produto', 'usuario')
         ordering = ['-criado_em'] # Ordena da mais recente para a mais antiga
+        indexes = [
+            # Cobre a paginação por cursor das avaliações de um produto (loja/catalogo.py)
+            models.Index(fields=['produto', 'criado_em'], name='avaliacao_produto_criado_idx'),
+        ]
+
+    def __str__(self):
+        return f'Avaliação de {self.usuario.username} para {self.produto.nome}'
+
+    def save(self, *args, **kwargs):
+        # A avaliação e os agregados do produto (atualizados pelo sinal post_save)
+        # precisam ser gravados na mesma transação.
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+# Índice invertido da busca de produtos (loja/busca.py): uma linha por termo
+# normalizado (minúsculo e sem acentos) de cada produto. A busca consulta só
+# esta tabela, pelo índice único (termo, produto), em vez de varrer
+# "descricao LIKE '%termo%'". Mantido pelos sinais de Produto e reconstruído
+# com o comando "python manage.py reindexar_busca".
+class TermoBusca(models.Model):
+    termo = models.CharField(max_length=40)
+    produto = models.ForeignKey(Produto, on_delete=models.CASCADE, related_name='termos_busca')
+    # Relevância do termo no produto: aparecer no nome vale mais que na descrição
+    peso = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['termo', 'produto'], name='termobusca_termo_produto_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.termo} ({self.produto_id})'
+
+
+# Compras entregues: um registro por (usuário, produto) que o usuário comprou
+# num pedido com status "entregue". É o que dá direito a avaliar o produto.
+# Mantida por loja/elegibilidade.py (sinais de Pedido e ação do admin) e
+# reconstruída com "python manage.py reconstruir_compras_entregues".
+class CompraEntregue(models.Model):
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='compras_entregues')
+    produto = models.ForeignKey(Produto, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        verbose_name = 'Compra entregue'
+        verbose_name_plural = 'Compras entregues'
+        constraints = [
+            # Também é o índice da consulta "este usuário pode avaliar este produto?"
+            models.UniqueConstraint(fields=['usuario', 'produto'], name='compraentregue_usuario_produto_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.usuario_id} comprou {self.produto_id}'
+
+
+# Vendas agregadas por dia, produto e status do pedido, para o painel de
+# vendas. Mantida pelo comando "python manage.py atualizar_vendas"
+# (loja/vendas.py), que só reprocessa os dias com pedidos novos ou alterados.
+class VendaDiaria(models.Model):
+    dia = models.DateField()
+    produto = models.ForeignKey(Produto, on_delete=models.CASCADE, related_name='+')
+    status = models.CharField(max_length=20, choices=Pedido.STATUS_CHOICES)
+    quantidade = models.PositiveIntegerField(default=0) # Unidades vendidas
+    receita = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    pedidos = models.PositiveIntegerField(default=0) # Pedidos que tinham o produto
+
+    class Meta:
+        verbose_name = 'Venda diária'
+        verbose_name_plural = 'Vendas diárias'
+        constraints = [
+            models.UniqueConstraint(fields=['dia', 'produto', 'status'], name='vendadiaria_dia_produto_status_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.dia} - {self.produto_id} ({self.status})'
+
+
+# Até onde um processamento incremental já foi (ex: a agregação de vendas)
+class MarcaProcessamento(models.Model):
+    nome = models.CharField(max_length=50, unique=True)
+    processado_ate = models.DateTimeField()
 
     def __str__(self):
-        return f'Avaliação de {self.usuario.username} para {self.produto.nome}'
\ No newline at end of file
+        return f'{self.nome}: {self.processado_ate}'
@@ -0,0 +1,193 @@
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+# Paginação por chave (keyset / "seek"): em vez de OFFSET, cada página
+# começa logo depois do último registro da anterior. O custo de uma página
+# não cresce com a posição dela na listagem, desde que exista um índice
+# cobrindo a ordenação usada.
+
+TAMANHO_PAGINA_PADRAO = 24
+TAMANHO_PAGINA_MAXIMO = 100
+
+
+def limitar_tamanho(tamanho, padrao=TAMANHO_PAGINA_PADRAO, maximo=TAMANHO_PAGINA_MAXIMO):
+    # Converte o tamanho vindo da URL e garante que ele fique entre 1 e o máximo
+    try:
+        tamanho = int(tamanho)
+    except (TypeError, ValueError):
+        return padrao
+    return max(1, min(tamanho, maximo))
+
+
+class _CursorEncoder(DjangoJSONEncoder):
+    # O DjangoJSONEncoder corta datas nos milissegundos; no cursor precisamos da
+    # precisão completa, senão registros do mesmo milissegundo seriam pulados
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def codificar_cursor(direcao, valores):
+    # O cursor é opaco para o cliente: JSON em base64 seguro para URL
+    bruto = json.dumps({'d': direcao, 'v': valores}, cls=_CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(bruto.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(cursor, campos):
+    # Cursores inválidos ou adulterados são tratados como "primeira página"
+    if not cursor:
+        return None, None
+    try:
+        preenchimento = '=' * (-len(cursor) % 4)
+        dados = json.loads(base64.urlsafe_b64decode(cursor + preenchimento))
+        direcao, valores = dados['d'], dados['v']
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        return None, None
+    if direcao not in ('p', 'a') or not isinstance(valores, list) or len(valores) != len(campos):
+        return None, None
+    return direcao, valores
+
+
+def _filtro_apos(campos, valores):
+    # Monta (c1 > v1) OR (c1 = v1 AND c2 > v2) OR ... respeitando a direção de cada campo
+    filtro = Q()
+    iguais = {}
+    for campo, valor in zip(campos, valores):
+        nome = campo.lstrip('-')
+        operador = 'lt' if campo.startswith('-') else 'gt'
+        filtro |= Q(**iguais, **{f'{nome}__{operador}': valor})
+        iguais[nome] = valor
+    return filtro
+
+
+def _inverter(campos):
+    return [campo[1:] if campo.startswith('-') else f'-{campo}' for campo in campos]
+
+
+class PaginaKeyset:
+    def __init__(self, itens, campos, tem_proximo, tem_anterior):
+        self.itens = itens
+        self.campos = campos
+        self.tem_proximo = tem_proximo
+        self.tem_anterior = tem_anterior
+
+    def __iter__(self):
+        return iter(self.itens)
+
+    def __len__(self):
+        return len(self.itens)
+
+    def _valores(self, item):
+        return [getattr(item, campo.lstrip('-')) for campo in self.campos]
+
+    @property
+    def cursor_proximo(self):
+        if not self.tem_proximo:
+            return None
+        return codificar_cursor('p', self._valores(self.itens[-1]))
+
+    @property
+    def cursor_anterior(self):
+        if not self.tem_anterior:
+            return None
+        return codificar_cursor('a', self._valores(self.itens[0]))
+
+
+def _consulta_keyset(queryset, campos, cursor, tamanho):
+    # Monta a consulta da página (ainda não executada) e a direção do cursor
+    direcao, valores = decodificar_cursor(cursor, campos)
+
+    if direcao is not None:
+        # Valores adulterados (ex: uma data inválida) falham ao montar o filtro
+        try:
+            filtro = _filtro_apos(_inverter(campos) if direcao == 'a' else campos, valores)
+            queryset.filter(filtro)
+        except (ValidationError, ValueError, TypeError):
+            direcao = None
+
+    if direcao == 'a':
+        # Voltando: percorre a ordenação invertida e desfaz a inversão no final
+        return queryset.filter(filtro).order_by(*_inverter(campos))[:tamanho + 1], direcao
+
+    qs = queryset.order_by(*campos)
+    if direcao == 'p':
+        qs = qs.filter(filtro)
+    return qs[:tamanho + 1], direcao
+
+
+def _montar_pagina(itens, campos, direcao, tamanho):
+    if direcao == 'a':
+        tem_anterior = len(itens) > tamanho
+        return PaginaKeyset(itens[:tamanho][::-1], campos, tem_proximo=True, tem_anterior=tem_anterior)
+    tem_proximo = len(itens) > tamanho
+    return PaginaKeyset(itens[:tamanho], campos, tem_proximo=tem_proximo, tem_anterior=direcao == 'p')
+
+
+def paginar_keyset(queryset, campos, cursor=None, tamanho=TAMANHO_PAGINA_PADRAO):
+    """
+    Retorna uma PaginaKeyset com no máximo `tamanho` itens de `queryset`.
+
+    `campos` é a ordenação estável da listagem (ex: ['nome', 'id']); o último
+    campo precisa ser único para desempatar. Sempre executa uma única consulta,
+    buscando um item a mais para saber se existe página seguinte.
+    """
+    campos = list(campos)
+    qs, direcao = _consulta_keyset(queryset, campos, cursor, tamanho)
+    return _montar_pagina(list(qs), campos, direcao, tamanho)
+
+
+async def apaginar_keyset(queryset, campos, cursor=None, tamanho=TAMANHO_PAGINA_PADRAO):
+    # Versão assíncrona de paginar_keyset (ORM assíncrono), para loja/views_assincronas.py
+    campos = list(campos)
+    qs, direcao = _consulta_keyset(queryset, campos, cursor, tamanho)
+    return _montar_pagina([item async for item in qs], campos, direcao, tamanho)
+
+
+class PaginadorContagemEstimada(Paginator):
+    """
+    Paginator para tabelas grandes no admin.
+
+    Sem filtros, o COUNT(*) de uma tabela InnoDB com milhões de linhas percorre
+    o índice inteiro. Nesse caso usamos a estimativa das estatísticas do banco
+    e, só se ela ficar abaixo de LIMIAR_CONTAGEM_EXATA, fazemos a contagem exata.
+    Com filtros, ou em bancos sem estatísticas (SQLite), a contagem é a normal.
+    """
+    LIMIAR_CONTAGEM_EXATA = 100_000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if getattr(queryset, 'query', None) is not None and not queryset.query.where:
+            estimativa = estimar_linhas(queryset.model, queryset.db)
+            if estimativa is not None and estimativa >= self.LIMIAR_CONTAGEM_EXATA:
+                return estimativa
+        return super().count
+
+
+def estimar_linhas(model, alias=DEFAULT_DB_ALIAS):
+    # Número aproximado de linhas da tabela, lido das estatísticas do banco
+    conexao = connections[alias]
+    tabela = model._meta.db_table
+    if conexao.vendor == 'mysql':
+        sql = 'SELECT TABLE_ROWS FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s'
+    elif conexao.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s'
+    else:
+        return None
+    with conexao.cursor() as cursor:
+        cursor.execute(sql, [tabela])
+        linha = cursor.fetchone()
+    if not linha or linha[0] is None or linha[0] < 0:
+        return None
+    return int(linha[0])
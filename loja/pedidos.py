@@ -0,0 +1,153 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, F, OuterRef, Prefetch, Q, Subquery, When
+from django.utils import timezone
+
+from .cache import invalidar_produtos
+from .elegibilidade import sincronizar_compras_entregues
+from .emails import enfileirar_confirmacao_pedido
+from .models import ItemPedido, Pedido, Produto
+from .paginacao import apaginar_keyset, limitar_tamanho, paginar_keyset
+
+
+class EstoqueInsuficiente(Exception):
+    # Levantada quando algum item do carrinho não pode ser atendido.
+    # A mensagem já está pronta para ser exibida ao cliente.
+    def __init__(self, mensagem, produto=None):
+        self.produto = produto
+        super().__init__(mensagem)
+
+
+def criar_pedido(usuario, endereco, quantidades):
+    """
+    Cria o Pedido e seus itens e reserva o estoque, tudo numa transação.
+
+    `quantidades` é um dicionário {produto_id: quantidade}. O número de
+    consultas não depende da quantidade de linhas do carrinho:
+
+    1. um SELECT ... FOR UPDATE de todos os produtos, em ordem de id (a ordem
+       fixa evita deadlock entre dois checkouts com os mesmos produtos);
+    2. o INSERT do pedido;
+    3. um único INSERT em lote dos itens (bulk_create);
+    4. um único UPDATE do estoque com CASE, protegido por estoque >= quantidade;
+    5. o INSERT do e-mail de confirmação na fila (EmailPendente).
+    """
+    # Linhas com quantidade zero ou negativa são ignoradas
+    quantidades = {int(produto_id): int(q) for produto_id, q in quantidades.items() if int(q) > 0}
+    if not quantidades:
+        raise EstoqueInsuficiente('Seu carrinho está vazio.')
+
+    with transaction.atomic():
+        produtos = Produto.objects.select_for_update().filter(id__in=quantidades).order_by('id').in_bulk()
+
+        for produto_id, quantidade in sorted(quantidades.items()):
+            produto = produtos.get(produto_id)
+            if produto is None:
+                raise EstoqueInsuficiente('Um dos produtos do seu carrinho não está mais disponível.')
+            if produto.estoque < quantidade:
+                raise EstoqueInsuficiente(
+                    f"Desculpe, não temos estoque suficiente para '{produto.nome}'. Disponível: {produto.estoque}.",
+                    produto,
+                )
+
+        # O preço vem do banco (linha travada), não do que foi guardado no carrinho
+        total = sum((produtos[pid].preco * q for pid, q in quantidades.items()), Decimal('0.00'))
+
+        pedido = Pedido.objects.create(usuario=usuario, total=total, endereco_entrega=endereco)
+
+        ItemPedido.objects.bulk_create([
+            ItemPedido(pedido=pedido, produto=produtos[pid], preco=produtos[pid].preco, quantidade=q)
+            for pid, q in sorted(quantidades.items())
+        ])
+
+        # Baixa de estoque numa única instrução. A condição estoque >= q em cada
+        # linha garante que nunca fique negativo, mesmo sem a trava (ex: SQLite).
+        condicao = Q()
+        for pid, q in quantidades.items():
+            condicao |= Q(id=pid, estoque__gte=q)
+        atualizados = Produto.objects.filter(condicao).update(
+            estoque=Case(*[When(id=pid, then=F('estoque') - q) for pid, q in quantidades.items()]),
+            # update() não aplica o auto_now; o estoque aparece nas páginas do catálogo
+            atualizado_em=timezone.now(),
+        )
+        if atualizados != len(quantidades):
+            # Outro checkout levou o estoque entre a verificação e o UPDATE:
+            # a exceção desfaz o pedido e os itens já inseridos
+            raise EstoqueInsuficiente('O estoque de um dos produtos acabou de mudar. Revise seu carrinho e tente novamente.')
+
+        # O e-mail de confirmação entra na fila na mesma transação: se o pedido
+        # for desfeito, o e-mail também some. Quem envia é o comando "enviar_emails".
+        enfileirar_confirmacao_pedido(pedido)
+
+        # O estoque mudou via UPDATE (sem sinais): invalida o cache das páginas
+        # desses produtos só depois do COMMIT
+        transaction.on_commit(lambda: invalidar_produtos(list(quantidades)))
+
+    return pedido
+
+
+def alterar_status(pedidos, status):
+    """
+    Muda o status de vários pedidos de uma vez (ex: ação do PedidoAdmin) e
+    acerta as compras entregues, que o update() sozinho não atualizaria.
+    Retorna quantos pedidos mudaram.
+    """
+    with transaction.atomic():
+        ids = list(pedidos.exclude(status=status).values_list('id', flat=True))
+        if not ids:
+            return 0
+        # update() não aplica o auto_now; atualizado_em é a marca d'água das vendas (loja/vendas.py)
+        Pedido.objects.filter(id__in=ids).update(status=status, atualizado_em=timezone.now())
+        sincronizar_compras_entregues(ids)
+    return len(ids)
+
+
+# Histórico de pedidos do cliente, do mais recente para o mais antigo. O 'id'
+# desempata pedidos do mesmo instante. Coberto pelo índice
+# 'pedido_usuario_criado_idx' (usuario, -criado_em).
+ORDENACAO_HISTORICO = ('-criado_em', '-id')
+PEDIDOS_POR_PAGINA = 20
+PEDIDOS_POR_PAGINA_MAXIMO = 100
+
+
+def _historico(usuario):
+    # Subconsulta correlacionada em vez de JOIN + GROUP BY: só é calculada
+    # para os pedidos da página, usando o índice de ItemPedido.pedido
+    quantidade_itens = (
+        ItemPedido.objects.filter(pedido=OuterRef('pk'))
+        .order_by()
+        .values('pedido')
+        .annotate(total=Count('id'))
+        .values('total')
+    )
+    return Pedido.objects.filter(usuario=usuario).annotate(quantidade_itens=Subquery(quantidade_itens))
+
+
+def pagina_historico(usuario, cursor=None, tamanho=None):
+    """
+    Uma página dos pedidos do usuário, cada um com `quantidade_itens`.
+    Sempre uma única consulta, com qualquer quantidade de pedidos.
+    """
+    return paginar_keyset(
+        _historico(usuario),
+        ORDENACAO_HISTORICO,
+        cursor=cursor,
+        tamanho=limitar_tamanho(tamanho, padrao=PEDIDOS_POR_PAGINA, maximo=PEDIDOS_POR_PAGINA_MAXIMO),
+    )
+
+
+async def apagina_historico(usuario, cursor=None, tamanho=None):
+    return await apaginar_keyset(
+        _historico(usuario),
+        ORDENACAO_HISTORICO,
+        cursor=cursor,
+        tamanho=limitar_tamanho(tamanho, padrao=PEDIDOS_POR_PAGINA, maximo=PEDIDOS_POR_PAGINA_MAXIMO),
+    )
+
+
+def pedidos_detalhados():
+    # Pedido com endereço (JOIN) e itens já com o produto (uma consulta para todos os itens)
+    return Pedido.objects.select_related('endereco_entrega').prefetch_related(
+        Prefetch('itens', queryset=ItemPedido.objects.select_related('produto').order_by('id'))
+    )
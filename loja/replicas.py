@@ -0,0 +1,147 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+# Réplicas de leitura.
+#
+# As réplicas são os aliases de LOJA_REPLICAS (montados em settings.py a
+# partir de DB_REPLICAS). Por padrão tudo vai para a primária ('default');
+# só as leituras feitas dentro de ler_da_replica() podem ir para uma réplica:
+# as views de catálogo e histórico (decoradas com @leitura_na_replica) e as
+# listas do admin (LeituraReplicaAdminMixin).
+#
+# Mesmo dentro de ler_da_replica(), a leitura fica na primária quando:
+#   - a requisição já escreveu alguma coisa (lê o que acabou de gravar);
+#   - o navegador escreveu há pouco: o ReplicaMiddleware marca a resposta
+#     com um cookie por LOJA_REPLICA_FIXAR_SEGUNDOS, para que a página
+#     seguinte (ex: "Meus Pedidos" depois do checkout) não venha de uma
+#     réplica atrasada;
+#   - há uma transação aberta na primária;
+#   - o modelo é de um app em APPS_SEMPRE_NA_PRIMARIA: a sessão e o usuário
+#     logado (um cadastro ou login recente não pode "sumir");
+#   - o código está dentro de ler_da_primaria(): dados que vão para o cache
+#     (snapshots de produto, produtos que o usuário pode avaliar) são lidos
+#     da primária, senão uma réplica atrasada deixaria o cache velho depois
+#     da invalidação.
+
+APPS_SEMPRE_NA_PRIMARIA = {'sessions', 'auth'}
+
+_estado = ContextVar('loja_replicas', default=None)
+
+
+def replicas():
+    return getattr(settings, 'LOJA_REPLICAS', [])
+
+
+def _novo_estado(fixado=False):
+    # Um dicionário (mutável) por requisição: o que o roteador marca aparece
+    # para o middleware mesmo se a view rodar em outra thread (ASGI)
+    return {'leitura': 0, 'primaria': 0, 'fixado': fixado, 'escreveu': False, 'replica': None}
+
+
+def iniciar_requisicao(fixado=False):
+    # Usado pelo ReplicaMiddleware; retorna o estado e o token para encerrar
+    estado = _novo_estado(fixado)
+    return estado, _estado.set(estado)
+
+
+def encerrar_requisicao(token):
+    _estado.reset(token)
+
+
+@contextmanager
+def ler_da_replica():
+    """
+    Permite que as leituras feitas dentro do bloco usem uma réplica. Fora de
+    uma requisição (ex: um comando) também funciona.
+    """
+    estado = _estado.get()
+    token = None
+    if estado is None:
+        estado = _novo_estado()
+        token = _estado.set(estado)
+    estado['leitura'] += 1
+    try:
+        yield
+    finally:
+        estado['leitura'] -= 1
+        if token is not None:
+            _estado.reset(token)
+
+
+@contextmanager
+def ler_da_primaria():
+    # Dentro de ler_da_replica(), volta a ler da primária durante o bloco
+    estado = _estado.get()
+    if estado is None:
+        yield
+        return
+    estado['primaria'] += 1
+    try:
+        yield
+    finally:
+        estado['primaria'] -= 1
+
+
+def leitura_na_replica(view):
+    # Decorador das views só de leitura. Deve ficar por fora de @condition,
+    # para que os validadores de cache também leiam da réplica.
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def _view_assincrona(request, *args, **kwargs):
+            with ler_da_replica():
+                return await view(request, *args, **kwargs)
+        return _view_assincrona
+
+    @wraps(view)
+    def _view(request, *args, **kwargs):
+        with ler_da_replica():
+            return view(request, *args, **kwargs)
+    return _view
+
+
+class RoteadorReplicas:
+    """Roteador de banco (DATABASE_ROUTERS) das réplicas de leitura."""
+
+    def db_for_read(self, model, **hints):
+        estado = _estado.get()
+        if estado is None or not estado['leitura'] or estado['primaria'] or estado['fixado'] or estado['escreveu']:
+            return None
+        if model._meta.app_label in APPS_SEMPRE_NA_PRIMARIA:
+            return None
+        # Relações de um objeto ficam no banco de onde ele veio
+        instancia = hints.get('instance')
+        if instancia is not None and instancia._state.db:
+            return instancia._state.db
+        aliases = replicas()
+        if not aliases or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        if estado['replica'] is None:
+            # A mesma réplica durante toda a requisição: as consultas veem o mesmo momento
+            estado['replica'] = random.choice(aliases)
+        return estado['replica']
+
+    def db_for_write(self, model, **hints):
+        estado = _estado.get()
+        if estado is not None:
+            estado['escreveu'] = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Réplicas têm os mesmos dados da primária
+        bancos = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in bancos and obj2._state.db in bancos:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # As réplicas recebem o schema pela replicação do banco
+        if db in replicas():
+            return False
+        return None
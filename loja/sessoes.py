@@ -0,0 +1,49 @@
+import time
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.utils import timezone
+
+
+# Sessões.
+#
+# SESSION_ENGINE vem do .env (veja settings.py). Com um cache compartilhado o
+# padrão é o cached_db (com o LocMemCache, que é de cada processo, é o db): a
+# sessão é lida do cache e só vai ao banco numa falha de cache ou quando muda
+# (login, logout, troca de senha, carrinho em ArmazenamentoSessao); páginas
+# que só leem a sessão não consultam nem gravam a tabela django_session.
+# Com o engine "cache" a tabela nem é usada (o cache precisa ser compartilhado
+# e persistente, ex: Redis).
+#
+# Nos modos com banco as sessões expiradas continuam na tabela até alguém
+# apagá-las. O clearsessions do Django faz isso num único DELETE, que segura
+# a tabela (e os logins) enquanto apaga tudo de uma vez; limpar_sessoes_expiradas()
+# apaga em lotes pequenos, cada um na sua transação curta.
+
+LOTE = 1000
+
+
+def usa_banco():
+    return settings.SESSION_ENGINE in (
+        'django.contrib.sessions.backends.db', 'django.contrib.sessions.backends.cached_db',
+    )
+
+
+def limpar_sessoes_expiradas(lote=LOTE, pausa=0, agora=None):
+    """
+    Apaga as sessões expiradas até `agora`, `lote` por vez (pela chave, usando
+    o índice de expire_date), esperando `pausa` segundos entre os lotes.
+    Retorna quantas foram apagadas.
+    """
+    agora = agora or timezone.now()
+    expiradas = Session.objects.filter(expire_date__lt=agora)
+    apagadas = 0
+    while True:
+        chaves = list(expiradas.order_by('expire_date').values_list('session_key', flat=True)[:lote])
+        if not chaves:
+            return apagadas
+        apagadas += expiradas.filter(session_key__in=chaves).delete()[0]
+        if len(chaves) < lote:
+            return apagadas
+        if pausa:
+            time.sleep(pausa)
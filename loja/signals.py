@@ -0,0 +1,202 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import autocompletar
+from .busca import indexar_produtos
+from .cache import invalidar_categoria, invalidar_produtos, invalidar_slugs
+from .elegibilidade import invalidar_avaliaveis, pares_dos_pedidos, sincronizar_compras_entregues, sincronizar_pares
+from .imagens import gerar_derivados_seguro
+from .models import Avaliacao, Categoria, Pedido, Produto
+from .vendas import dia_do_pedido, recalcular_dias
+
+
+# --- Agregados de avaliações do Produto ---
+# Cada criação, alteração ou exclusão de Avaliacao ajusta os contadores do
+# produto com um UPDATE relativo (F()), na mesma transação da avaliação.
+# Isso vale também para o AvaliacaoAdmin, inclusive a ação de excluir em massa,
+# porque QuerySet.delete() dispara post_delete para cada objeto.
+
+def _ajustar_agregados(produto_id, nota, sinal):
+    Produto.objects.filter(pk=produto_id).update(**{
+        'avaliacoes_contagem': F('avaliacoes_contagem') + sinal,
+        'avaliacoes_soma': F('avaliacoes_soma') + sinal * nota,
+        f'avaliacoes_nota_{nota}': F(f'avaliacoes_nota_{nota}') + sinal,
+        # A página do produto mudou: move o Last-Modified/ETag (loja/condicional.py)
+        'atualizado_em': timezone.now(),
+    })
+
+
+@receiver(pre_save, sender=Avaliacao)
+def guardar_avaliacao_anterior(sender, instance, **kwargs):
+    # Em edições (ex: pelo admin) precisamos saber a nota e o produto antigos
+    instance._anterior = None
+    if instance.pk and not instance._state.adding:
+        instance._anterior = (
+            Avaliacao.objects.filter(pk=instance.pk).values_list('produto_id', 'nota').first()
+        )
+
+
+@receiver(post_save, sender=Avaliacao)
+def atualizar_agregados_ao_salvar(sender, instance, created, **kwargs):
+    anterior = getattr(instance, '_anterior', None)
+    if not created and anterior == (instance.produto_id, instance.nota):
+        # Só o comentário mudou: os agregados continuam certos, mas a página não
+        Produto.objects.filter(pk=instance.produto_id).update(atualizado_em=timezone.now())
+        transaction.on_commit(lambda: invalidar_produtos([instance.produto_id]))
+        return
+    if anterior:
+        _ajustar_agregados(anterior[0], anterior[1], -1)
+    _ajustar_agregados(instance.produto_id, instance.nota, +1)
+    afetados = {instance.produto_id, anterior[0]} if anterior else {instance.produto_id}
+    transaction.on_commit(lambda: invalidar_produtos(afetados))
+
+
+@receiver(post_delete, sender=Avaliacao)
+def atualizar_agregados_ao_excluir(sender, instance, **kwargs):
+    _ajustar_agregados(instance.produto_id, instance.nota, -1)
+    transaction.on_commit(lambda: invalidar_produtos([instance.produto_id]))
+
+
+# --- Cache da página de produto (loja/cache.py) ---
+# As versões só são trocadas depois do COMMIT; antes disso outra requisição
+# poderia guardar no cache os dados antigos com a versão nova.
+
+@receiver(pre_save, sender=Produto)
+def guardar_produto_anterior(sender, instance, **kwargs):
+    # Se o slug mudar, o snapshot do slug antigo também precisa ser invalidado.
+    # Nome e descrição antigos dizem se o índice de busca precisa ser refeito,
+    # e nome, slug e disponibilidade se o autocompletar precisa ser atualizado.
+    instance._slug_anterior = None
+    instance._texto_anterior = None
+    instance._disponivel_anterior = None
+    instance._imagem_anterior = None
+    if instance.pk and not instance._state.adding:
+        anterior = (
+            Produto.objects.filter(pk=instance.pk)
+            .values_list('slug', 'nome', 'descricao', 'disponivel', 'imagem')
+            .first()
+        )
+        if anterior:
+            instance._slug_anterior = anterior[0]
+            instance._texto_anterior = anterior[1:3]
+            instance._disponivel_anterior = anterior[3]
+            instance._imagem_anterior = anterior[4]
+
+
+@receiver(post_save, sender=Produto)
+@receiver(post_delete, sender=Produto)
+def invalidar_cache_produto(sender, instance, **kwargs):
+    slugs = {instance.slug, getattr(instance, '_slug_anterior', None)} - {None}
+    transaction.on_commit(lambda: invalidar_slugs(slugs))
+
+
+@receiver(post_delete, sender=Produto)
+def marcar_categoria_alterada(sender, instance, **kwargs):
+    # Um produto excluído não move o MAX(atualizado_em) dos produtos; a
+    # categoria dele é que registra a mudança para o validador do catálogo
+    Categoria.objects.filter(pk=instance.categoria_id).update(atualizado_em=timezone.now())
+
+
+@receiver(post_save, sender=Categoria)
+@receiver(post_delete, sender=Categoria)
+def invalidar_cache_categoria(sender, instance, **kwargs):
+    transaction.on_commit(lambda: invalidar_categoria(instance.pk))
+
+
+# --- Índice de busca (loja/busca.py) ---
+# Gravado na mesma transação do produto, e só quando nome ou descrição mudam.
+# A exclusão não precisa de nada: os termos somem junto (on_delete=CASCADE).
+
+@receiver(post_save, sender=Produto)
+def indexar_produto(sender, instance, created, **kwargs):
+    if created or getattr(instance, '_texto_anterior', None) != (instance.nome, instance.descricao):
+        indexar_produtos([instance])
+
+
+# --- Autocompletar (loja/autocompletar.py) ---
+# O índice em memória só muda depois do COMMIT, e só se nome, slug ou
+# disponibilidade mudaram (ex: baixas de estoque pelo admin não contam).
+
+@receiver(post_save, sender=Produto)
+def atualizar_autocompletar(sender, instance, created, **kwargs):
+    texto_anterior = getattr(instance, '_texto_anterior', None)
+    if not created and texto_anterior is not None:
+        anterior = (instance._slug_anterior, texto_anterior[0], instance._disponivel_anterior)
+        if anterior == (instance.slug, instance.nome, instance.disponivel):
+            return
+    produto_id, slug = instance.pk, instance.slug
+    nome = instance.nome if instance.disponivel else None
+    transaction.on_commit(lambda: autocompletar.atualizar_produto(produto_id, nome, slug))
+
+
+@receiver(post_delete, sender=Produto)
+def remover_do_autocompletar(sender, instance, **kwargs):
+    produto_id = instance.pk
+    transaction.on_commit(lambda: autocompletar.atualizar_produto(produto_id))
+
+
+# --- Derivados da imagem (loja/imagens.py) ---
+# Gerados logo depois do upload. O hash é gravado com update() para não
+# disparar os sinais de novo.
+
+@receiver(post_save, sender=Produto)
+def gerar_derivados_imagem(sender, instance, created, **kwargs):
+    nome = instance.imagem.name or ''
+    if not created and nome == (getattr(instance, '_imagem_anterior', None) or ''):
+        return
+    imagem_hash = gerar_derivados_seguro(nome) if nome else ''
+    if imagem_hash != instance.imagem_hash:
+        instance.imagem_hash = imagem_hash
+        Produto.objects.filter(pk=instance.pk).update(imagem_hash=imagem_hash)
+
+
+# --- Compras entregues (loja/elegibilidade.py) ---
+# Quando um pedido entra ou sai do status "entregue" (ex: pelo PedidoAdmin) ou
+# um pedido entregue é excluído, os pares (usuário, produto) dele são acertados
+# na mesma transação. Uma avaliação nova ou excluída muda o que o usuário ainda
+# pode avaliar.
+
+@receiver(pre_save, sender=Pedido)
+def guardar_status_anterior(sender, instance, **kwargs):
+    instance._status_anterior = None
+    if instance.pk and not instance._state.adding:
+        instance._status_anterior = Pedido.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+
+@receiver(post_save, sender=Pedido)
+def atualizar_compras_entregues(sender, instance, created, **kwargs):
+    anterior = getattr(instance, '_status_anterior', None)
+    if 'entregue' in (anterior, instance.status) and anterior != instance.status:
+        sincronizar_compras_entregues([instance.pk])
+
+
+@receiver(pre_delete, sender=Pedido)
+def guardar_compras_do_pedido_excluido(sender, instance, **kwargs):
+    # Antes da exclusão, enquanto os itens ainda existem (o CASCADE só os apaga
+    # depois de todos os pre_delete)
+    instance._pares_entregues = pares_dos_pedidos([instance.pk]) if instance.status == 'entregue' else set()
+
+
+@receiver(post_delete, sender=Pedido)
+def remover_compras_do_pedido_excluido(sender, instance, **kwargs):
+    # Pedido entregue excluído: os pares só continuam se outro pedido entregue tiver o produto
+    sincronizar_pares(getattr(instance, '_pares_entregues', set()))
+
+
+@receiver(post_save, sender=Avaliacao)
+@receiver(post_delete, sender=Avaliacao)
+def invalidar_avaliaveis_do_usuario(sender, instance, **kwargs):
+    invalidar_avaliaveis([instance.usuario_id])
+
+
+# --- Vendas diárias (loja/vendas.py) ---
+# Criações e alterações de pedidos são achadas pelo atualizado_em no comando
+# atualizar_vendas; uma exclusão não deixa rastro, então o dia é refeito aqui.
+
+@receiver(post_delete, sender=Pedido)
+def recalcular_vendas_do_dia(sender, instance, **kwargs):
+    dia = dia_do_pedido(instance)
+    transaction.on_commit(lambda: recalcular_dias([dia]))
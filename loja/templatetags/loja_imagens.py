@@ -0,0 +1,41 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.utils.html import format_html, format_html_join
+
+from ..imagens import FORMATOS, LARGURAS, caminho_derivado, srcset
+
+register = template.Library()
+
+
+def _atributos(produto, largura, estilo):
+    # alt sempre; width e style só quando informados
+    pares = [('alt', produto.nome), ('width', largura), ('style', estilo), ('loading', 'lazy')]
+    return format_html_join(' ', '{}="{}"', ((nome, valor) for nome, valor in pares if valor != ''))
+
+
+@register.simple_tag
+def imagem_produto(produto, tamanhos='100vw', largura='', estilo=''):
+    """
+    <picture> com os derivados da imagem do produto (srcset por largura, WebP
+    primeiro e JPEG como fallback). Sem derivados gerados, usa a imagem original.
+
+    Uso: {% imagem_produto produto tamanhos="200px" largura=200 %}
+    """
+    if not produto.imagem:
+        return ''
+    if not produto.imagem_hash:
+        return format_html('<img src="{}" {}>', produto.imagem.url, _atributos(produto, largura, estilo))
+
+    *preferidos, fallback = FORMATOS
+    fontes = format_html_join(
+        '', '<source type="image/{}" srcset="{}" sizes="{}">',
+        ((formato, srcset(produto.imagem_hash, formato), tamanhos) for formato in preferidos),
+    )
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" {}></picture>',
+        fontes,
+        default_storage.url(caminho_derivado(produto.imagem_hash, LARGURAS[0], fallback)),
+        srcset(produto.imagem_hash, fallback),
+        tamanhos,
+        _atributos(produto, largura, estilo),
+    )
@@ -1,3 +1,2214 @@
-from django.test import TestCase
+import csv
+import gzip
+import json
+import os
+import re
+import shutil
+import smtplib
+import tempfile
+import threading
+import statistics
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock, skipIf
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.cached_db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core import mail
+from django.core.mail import EmailMultiAlternatives
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections, transaction
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from django.template import Context, engines
+from django.template.base import Template
+from django.test import AsyncClient, Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_resolver, reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import autocompletar
+from .aquecimento import aquecer_templates, templates_da_loja
+from .busca import indexar_produtos, normalizar, pagina_busca, facetas_busca
+from .cache import _nova_versao, asnapshot_produto, invalidar_slugs, snapshot_produto
+from .catalogo import pagina_catalogo
+from .carrinho import MAX_ITENS, ArmazenamentoCookie, ArmazenamentoSessao, Carrinho, codificar, decodificar
+from .conexoes import conexao_email, enviar_emails, fechar_conexao_email, metricas, zerar_metricas
+from .emails import MAX_TENTATIVAS, _proxima_espera, processar_fila
+from .elegibilidade import produtos_avaliaveis, reconstruir_compras_entregues
+from .estaticos import brotli, servir_estatico
+from .exportacao import linhas_exportacao
+from .imagens import FORMATOS, LARGURAS, caminho_derivado
+from .importacao import importar_catalogo
+from .models import (
+    Avaliacao, Categoria, CompraEntregue, EmailPendente, Endereco, ItemPedido, MarcaProcessamento, Pedido, Produto,
+    TermoBusca, VendaDiaria,
+)
+from .paginacao import TAMANHO_PAGINA_PADRAO, PaginadorContagemEstimada, codificar_cursor
+from .pedidos import EstoqueInsuficiente, alterar_status, criar_pedido
+from .replicas import RoteadorReplicas, ler_da_primaria, ler_da_replica
+from .sessoes import limpar_sessoes_expiradas
+from .vendas import atualizar_vendas
+
+
+# --- Benchmark e regressão de consultas das views da loja ---
+#
+# Semeia catálogos e históricos sintéticos em escalas crescentes, chama cada URL
+# de loja/urls.py pelo Client e registra número de consultas, tempo de banco,
+# tempo de renderização de templates e tempo total. O teste falha se o número
+# de consultas de alguma view crescer junto com o volume de dados (N+1).
+#
+# Escalas (quantidade de produtos e de avaliações) e o arquivo de saída podem
+# ser ajustados por variáveis de ambiente:
+#
+#   DB_ENGINE=django.db.backends.sqlite3 LOJA_BENCH_ESCALAS=1000,10000,100000 \
+#       LOJA_BENCH_SAIDA=bench_output.json python manage.py test loja
+
+ESCALAS = [int(e) for e in os.environ.get('LOJA_BENCH_ESCALAS', '1000,10000').split(',') if e.strip()]
+SAIDA = os.environ.get('LOJA_BENCH_SAIDA', str(settings.BASE_DIR / 'bench_output.json'))
+REPETICOES = int(os.environ.get('LOJA_BENCH_REPETICOES', '3'))
+
+# Views com N+1 conhecido: são medidas, mas não reprovam o teste.
+# Remova a view daqui quando o problema for corrigido.
+CRESCIMENTO_CONHECIDO = set()
+
+
+class Massa:
+    """Dados sintéticos acumulados entre as escalas (cada escala só acrescenta o que falta)."""
+
+    def __init__(self):
+        self.categorias = Categoria.objects.bulk_create(
+            [Categoria(nome=f'Categoria {i}', slug=f'categoria-{i}') for i in range(10)]
+        )
+        self.cliente = User.objects.create_user('cliente', 'cliente@fluorita.com', 'senha-de-teste-123')
+        self.gerente = User.objects.create_user('gerente', 'gerente@fluorita.com', 'senha-de-teste-123', is_staff=True)
+        self.endereco = Endereco.objects.create(
+            usuario=self.cliente, logradouro='Rua das Pedras', numero='1', bairro='Centro',
+            cidade='Ouro Preto', estado='MG', cep='35400-000',
+        )
+        self.produtos = 0
+        self.usuarios = []
+        self.destaque = None
+
+    def semear(self, escala):
+        # Produtos: completa até `escala`
+        novos = Produto.objects.bulk_create([
+            Produto(
+                nome=f'Mineral {i:06d}', slug=f'mineral-{i:06d}', descricao='Descrição ' * 20,
+                preco=10 + i % 90, categoria=self.categorias[i % len(self.categorias)],
+                estoque=10 ** 6, disponivel=i % 7 != 0,
+            )
+            for i in range(self.produtos, escala)
+        ], batch_size=2000)
+        # bulk_create não dispara sinais: o índice de busca é montado à mão
+        indexar_produtos(novos)
+        self.produtos = escala
+        if self.destaque is None:
+            self.destaque = novos[0]
+
+        # Avaliadores: um para cada dez produtos
+        faltam = escala // 10 - len(self.usuarios)
+        inicio = len(self.usuarios)
+        self.usuarios += User.objects.bulk_create(
+            [User(username=f'avaliador{i}') for i in range(inicio, inicio + faltam)], batch_size=2000
+        )
+
+        # Avaliações: uma por produto novo e, no produto em destaque, uma de cada avaliador novo
+        avaliacoes = [
+            Avaliacao(produto=p, usuario=self.usuarios[i % len(self.usuarios)], nota=1 + i % 5, comentario='Lindo!')
+            for i, p in enumerate(novos) if p.pk != self.destaque.pk
+        ]
+        avaliacoes += [
+            Avaliacao(produto=self.destaque, usuario=u, nota=1 + i % 5, comentario='Brilha muito!')
+            for i, u in enumerate(self.usuarios[inicio:])
+        ]
+        Avaliacao.objects.bulk_create(avaliacoes, batch_size=2000, ignore_conflicts=True)
+        call_command('recalcular_avaliacoes', stdout=open(os.devnull, 'w'))
+
+        # Histórico do cliente: um pedido a cada 50 produtos, com 3 itens cada
+        ids = list(Produto.objects.order_by('-id').values_list('id', flat=True)[:escala // 100 + 3])
+        pedidos = Pedido.objects.bulk_create([
+            Pedido(usuario=self.cliente, endereco_entrega=self.endereco, total=30, status='entregue')
+            for _ in range(escala // 50)
+        ])
+        # O pedido "medido" tem um item para cada 100 produtos
+        self.pedido = pedidos[-1]
+        ItemPedido.objects.bulk_create(
+            [ItemPedido(pedido=p, produto_id=ids[j], preco=10, quantidade=1) for p in pedidos[:-1] for j in range(3)]
+            + [ItemPedido(pedido=self.pedido, produto_id=pid, preco=10, quantidade=1) for pid in ids[:escala // 100]],
+            batch_size=2000,
+        )
+
+        # Pedidos criados com bulk_create não passam pelos sinais
+        reconstruir_compras_entregues()
+        atualizar_vendas()
+
+        # Carrinho: uma linha para cada 100 produtos (até o limite do carrinho)
+        self.carrinho = {pid: 1 for pid in ids[:min(escala // 100, 50)]}
+        # Produto que o cliente ainda não avaliou, para o POST de avaliação
+        self.produto_para_avaliar = Produto.objects.order_by('-id').values_list('slug', flat=True)[0]
+
+
+@contextmanager
+def medir_renderizacao(acumulado):
+    # Soma o tempo das renderizações de template mais externas (includes e
+    # extends ficam dentro da renderização do template principal)
+    original = Template.render
+    profundidade = [0]
+
+    def render(self, context):
+        profundidade[0] += 1
+        inicio = time.perf_counter()
+        try:
+            return original(self, context)
+        finally:
+            profundidade[0] -= 1
+            if profundidade[0] == 0:
+                acumulado.append(time.perf_counter() - inicio)
+
+    with mock.patch.object(Template, 'render', render):
+        yield
+
+
+def preencher_carrinho(client, itens):
+    # Grava o cookie do carrinho como o CarrinhoMiddleware faria
+    resposta = HttpResponse()
+    ArmazenamentoCookie(request=None).salvar(resposta, itens)
+    client.cookies.update(resposta.cookies)
+
+
+def cenarios(massa):
+    """
+    Uma entrada por URL de loja/urls.py: (nome, método, url, dados, preparar).
+    `preparar(client)` deixa o estado pronto antes de cada execução.
+    """
+    carrinho = lambda client: preencher_carrinho(client, massa.carrinho)
+    produto = massa.destaque.slug
+    return [
+        ('home', 'get', reverse('loja:home'), None, None),
+        ('lista_produtos', 'get', reverse('loja:lista_produtos'), None, None),
+        ('busca', 'get', reverse('loja:busca'), {'q': 'minerál'}, None),
+        ('autocompletar', 'get', reverse('loja:autocompletar'), {'q': 'mineral 00'}, None),
+        ('sobre', 'get', reverse('loja:sobre'), None, None),
+        ('cadastro', 'get', reverse('loja:cadastro'), None, None),
+        ('login', 'get', reverse('loja:login'), None, None),
+        ('logout', 'post', reverse('loja:logout'), None, None),
+        ('adicionar_ao_carrinho', 'post', reverse('loja:adicionar_ao_carrinho', args=[massa.destaque.pk]),
+         {'quantidade': 1}, carrinho),
+        ('detalhe_carrinho', 'get', reverse('loja:detalhe_carrinho'), None, carrinho),
+        ('remover_do_carrinho', 'get', reverse('loja:remover_do_carrinho', args=[next(iter(massa.carrinho))]),
+         None, carrinho),
+        ('finalizar_pedido', 'post', reverse('loja:finalizar_pedido'), {'endereco_id': massa.endereco.pk}, carrinho),
+        ('meus_pedidos', 'get', reverse('loja:meus_pedidos'), None, None),
+        ('detalhe_pedido', 'get', reverse('loja:detalhe_pedido', args=[massa.pedido.pk]), None, None),
+        ('painel_vendas', 'get', reverse('loja:painel_vendas'), None, lambda client: client.force_login(massa.gerente)),
+        ('painel_conexoes', 'get', reverse('loja:painel_conexoes'), None,
+         lambda client: client.force_login(massa.gerente)),
+        ('lista_enderecos', 'get', reverse('loja:lista_enderecos'), None, None),
+        ('adicionar_endereco', 'get', reverse('loja:adicionar_endereco'), None, None),
+        ('checkout', 'get', reverse('loja:checkout'), None, carrinho),
+        ('detalhe_produto', 'get', reverse('loja:detalhe_produto', args=[produto]), None, None),
+        ('perfil', 'get', reverse('loja:perfil'), None, None),
+        ('adicionar_avaliacao', 'post', reverse('loja:adicionar_avaliacao', args=[massa.produto_para_avaliar]),
+         {'nota': 5, 'comentario': 'Excelente'}, None),
+        ('avaliacoes_produto', 'get', reverse('loja:avaliacoes_produto', args=[produto]), None, None),
+        ('alterar_senha', 'get', reverse('loja:alterar_senha'), None, None),
+        ('alterar_senha_sucesso', 'get', reverse('loja:alterar_senha_sucesso'), None, None),
+    ]
+
+
+@override_settings(LOJA_CARRINHO_ARMAZENAMENTO='loja.carrinho.ArmazenamentoCookie')
+class BenchmarkViewsTest(TestCase):
+
+    def executar(self, massa, nome, metodo, url, dados, preparar):
+        consultas = None
+        tempos_db, tempos_render, tempos_total = [], [], []
+
+        for _ in range(REPETICOES):
+            client = Client()
+            client.force_login(massa.cliente)
+            if preparar:
+                preparar(client)
+            # Sempre a frio: sem snapshots de página guardados por execuções anteriores
+            cache.clear()
+
+            renders = []
+            with CaptureQueriesContext(connection) as capturadas, medir_renderizacao(renders):
+                inicio = time.perf_counter()
+                resposta = getattr(client, metodo)(url, dados)
+                total = time.perf_counter() - inicio
+
+            self.assertLess(resposta.status_code, 400, f'{nome} respondeu {resposta.status_code}')
+            if consultas is None:
+                consultas = len(capturadas)
+            tempos_db.append(sum(float(q['time']) for q in capturadas.captured_queries))
+            tempos_render.append(sum(renders))
+            tempos_total.append(total)
+
+        return {
+            'consultas': consultas,
+            'tempo_db_ms': round(statistics.median(tempos_db) * 1000, 3),
+            'tempo_render_ms': round(statistics.median(tempos_render) * 1000, 3),
+            'tempo_total_ms': round(statistics.median(tempos_total) * 1000, 3),
+        }
+
+    def test_todas_as_urls_tem_cenario(self):
+        # Uma URL nova em loja/urls.py precisa entrar no benchmark
+        massa = Massa()
+        massa.semear(100)
+        nomes_cenarios = {c[0] for c in cenarios(massa)}
+        nomes_urls = {
+            p.name for p in get_resolver('loja.urls').url_patterns if getattr(p, 'name', None)
+        }
+        self.assertEqual(nomes_urls - nomes_cenarios, set())
+
+    def test_consultas_nao_crescem_com_os_dados(self):
+        massa = Massa()
+        resultados = {}
+
+        for escala in sorted(ESCALAS):
+            massa.semear(escala)
+            resultados[escala] = {
+                nome: self.executar(massa, nome, metodo, url, dados, preparar)
+                for nome, metodo, url, dados, preparar in cenarios(massa)
+            }
+
+        self.gravar(resultados)
+
+        menor = min(resultados)
+        for escala, medidas in resultados.items():
+            for nome, medida in medidas.items():
+                if nome in CRESCIMENTO_CONHECIDO:
+                    continue
+                with self.subTest(view=nome, escala=escala):
+                    self.assertLessEqual(
+                        medida['consultas'], resultados[menor][nome]['consultas'],
+                        f'{nome}: {medida["consultas"]} consultas com {escala} produtos, '
+                        f'{resultados[menor][nome]["consultas"]} com {menor}',
+                    )
+
+    def gravar(self, resultados):
+        if not SAIDA:
+            return
+        relatorio = {
+            'gerado_em': datetime.now(dt_timezone.utc).isoformat(),
+            'banco': connection.vendor,
+            'repeticoes': REPETICOES,
+            'escalas': {str(escala): medidas for escala, medidas in resultados.items()},
+        }
+        with open(SAIDA, 'w', encoding='utf-8') as arquivo:
+            json.dump(relatorio, arquivo, indent=2, ensure_ascii=False)
+
+
+class InstrumentacaoMiddlewareTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nome='Quartzo', slug='quartzo')
+        Produto.objects.create(nome='Drusa', slug='drusa', descricao='Drusa de quartzo', preco=50, categoria=categoria)
+
+    @override_settings(LOJA_INSTRUMENTACAO_AMOSTRAGEM=1)
+    def test_server_timing_e_log_estruturado(self):
+        cache.clear()
+        with self.assertLogs('loja.instrumentacao', level='INFO') as logs:
+            resposta = Client().get(reverse('loja:detalhe_produto', args=['drusa']))
+
+        self.assertIn('db;dur=', resposta['Server-Timing'])
+        self.assertIn('tpl;dur=', resposta['Server-Timing'])
+        registro = json.loads(logs.records[0].getMessage())
+        self.assertEqual(registro['view'], 'loja:detalhe_produto')
+        self.assertGreater(registro['consultas'], 0)
+        self.assertGreater(registro['tempo_render_ms'], 0)
+        self.assertEqual((registro['cache_acertos'], registro['cache_falhas']), (0, 1))
+
+    @override_settings(LOJA_INSTRUMENTACAO_AMOSTRAGEM=0)
+    def test_desligado_sem_amostragem(self):
+        resposta = Client().get(reverse('loja:lista_produtos'))
+        self.assertNotIn('Server-Timing', resposta)
+
+
+class PedidoAdminTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@fluorita.com', 'senha-de-teste-123')
+        categoria = Categoria.objects.create(nome='Quartzo', slug='quartzo')
+        cls.produto = Produto.objects.create(nome='Drusa', slug='drusa', descricao='d', preco=50, categoria=categoria)
+
+    def criar_pedidos(self, quantidade):
+        usuarios = User.objects.bulk_create(
+            [User(username=f'comprador{User.objects.count()}-{i}') for i in range(quantidade)]
+        )
+        pedidos = Pedido.objects.bulk_create([Pedido(usuario=u, total=50) for u in usuarios])
+        ItemPedido.objects.bulk_create(
+            [ItemPedido(pedido=p, produto=self.produto, preco=50, quantidade=1) for p in pedidos for _ in range(3)]
+        )
+        return pedidos
+
+    def contar_consultas(self, url):
+        client = Client()
+        client.force_login(self.admin)
+        with CaptureQueriesContext(connection) as capturadas:
+            resposta = client.get(url)
+        self.assertEqual(resposta.status_code, 200)
+        return len(capturadas)
+
+    def test_changelist_com_consultas_limitadas(self):
+        self.criar_pedidos(5)
+        self.contar_consultas(reverse('admin:loja_pedido_changelist'))
+        poucos = self.contar_consultas(reverse('admin:loja_pedido_changelist'))
+        self.criar_pedidos(60)
+        muitos = self.contar_consultas(reverse('admin:loja_pedido_changelist'))
+        self.assertEqual(poucos, muitos)
+
+    def test_inline_de_itens_sem_n_mais_1(self):
+        pedido = self.criar_pedidos(1)[0]
+        url = reverse('admin:loja_pedido_change', args=[pedido.pk])
+        # A primeira visita aquece o cache de ContentType do admin
+        self.contar_consultas(url)
+        poucos = self.contar_consultas(url)
+        ItemPedido.objects.bulk_create(
+            [ItemPedido(pedido=pedido, produto=self.produto, preco=50, quantidade=1) for _ in range(20)]
+        )
+        self.assertEqual(self.contar_consultas(url), poucos)
+
+    def test_paginador_usa_estimativa_acima_do_limiar(self):
+        self.criar_pedidos(3)
+        with mock.patch('loja.paginacao.estimar_linhas', return_value=5_000_000):
+            self.assertEqual(PaginadorContagemEstimada(Pedido.objects.order_by('-id'), 100).count, 5_000_000)
+            # Com filtro a contagem continua exata
+            self.assertEqual(PaginadorContagemEstimada(Pedido.objects.filter(status='pendente').order_by('-id'), 100).count, 3)
+        with mock.patch('loja.paginacao.estimar_linhas', return_value=10):
+            self.assertEqual(PaginadorContagemEstimada(Pedido.objects.order_by('-id'), 100).count, 3)
+
+
+class BuscaTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.quartzos = Categoria.objects.create(nome='Quartzos', slug='quartzos')
+        cls.berilos = Categoria.objects.create(nome='Berilos', slug='berilos')
+        cls.ametista = Produto.objects.create(
+            nome='Ametista Roxa', slug='ametista-roxa', descricao='Drusa de quartzo violeta', preco=80, categoria=cls.quartzos,
+        )
+        cls.citrino = Produto.objects.create(
+            nome='Citrino', slug='citrino', descricao='Quartzo amarelo, parente da ametista', preco=60, categoria=cls.quartzos,
+        )
+        cls.agua_marinha = Produto.objects.create(
+            nome='Água-Marinha', slug='agua-marinha', descricao='Berilo azul', preco=200, categoria=cls.berilos,
+        )
+
+    def buscar(self, **filtros):
+        return list(pagina_busca(filtros))
+
+    def test_normalizacao_ignora_acentos_e_maiusculas(self):
+        self.assertEqual(normalizar('Água-Marinha ÇÃO'), 'agua-marinha cao')
+        self.assertEqual(self.buscar(q='AGUA marinha'), [self.agua_marinha])
+
+    def test_todos_os_termos_e_relevancia(self):
+        # Ametista no nome pesa mais que na descrição
+        self.assertEqual(self.buscar(q='ametista'), [self.ametista, self.citrino])
+        self.assertEqual(self.buscar(q='ametista amarelo'), [self.citrino])
+        self.assertEqual(self.buscar(q='ametista inexistente'), [])
+        self.assertEqual(self.buscar(q='de'), [])
+
+    def test_facetas_e_filtro_por_categoria(self):
+        facetas = facetas_busca({'q': 'quartzo'})
+        self.assertEqual([(c.slug, c.total) for c in facetas], [('quartzos', 2)])
+        self.assertEqual(self.buscar(q='azul', categoria='quartzos'), [])
+
+    def test_indice_acompanha_alteracoes_do_produto(self):
+        self.citrino.descricao = 'Pedra solar'
+        self.citrino.save()
+        self.assertEqual(self.buscar(q='ametista'), [self.ametista])
+        self.assertEqual(self.buscar(q='solar'), [self.citrino])
+        # Salvar sem mudar o texto não regrava o índice
+        with CaptureQueriesContext(connection) as capturadas:
+            self.citrino.save()
+        self.assertFalse(any('termobusca' in q['sql'].lower() for q in capturadas))
+
+    def test_paginacao_por_cursor(self):
+        pagina = pagina_busca({'q': 'quartzo', 'tamanho': 1})
+        seguinte = pagina_busca({'q': 'quartzo', 'tamanho': 1, 'cursor': pagina.cursor_proximo})
+        self.assertEqual(len(pagina) + len(seguinte), 2)
+        self.assertNotEqual(pagina.itens, seguinte.itens)
+        self.assertFalse(seguinte.tem_proximo)
+
+    def test_reindexar_busca(self):
+        TermoBusca.objects.all().delete()
+        call_command('reindexar_busca', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.buscar(q='violeta'), [self.ametista])
+
+    def test_view_e_admin_usam_o_indice(self):
+        resposta = self.client.get(reverse('loja:busca'), {'q': 'berilo'})
+        self.assertContains(resposta, 'Água-Marinha')
+        self.assertContains(resposta, 'Berilos (1)')
+
+        admin = User.objects.create_superuser('admin', 'admin@fluorita.com', 'senha-de-teste-123')
+        self.client.force_login(admin)
+        with CaptureQueriesContext(connection) as capturadas:
+            resposta = self.client.get(reverse('admin:loja_produto_changelist'), {'q': 'violeta'})
+        self.assertContains(resposta, 'Ametista Roxa')
+        self.assertNotContains(resposta, 'Citrino')
+        self.assertFalse(any('LIKE' in q['sql'] and 'descricao' in q['sql'] for q in capturadas))
+
+
+class AutocompletarTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nome='Berilos', slug='berilos')
+        cls.agua_marinha = Produto.objects.create(
+            nome='Água-Marinha Azul', slug='agua-marinha-azul', descricao='d', preco=200, categoria=categoria,
+        )
+        cls.morganita = Produto.objects.create(
+            nome='Morganita', slug='morganita', descricao='d', preco=150, categoria=categoria,
+        )
+        Produto.objects.create(nome='Maxixe', slug='maxixe', descricao='d', preco=90, categoria=categoria, disponivel=False)
+
+    def setUp(self):
+        cache.clear()
+        autocompletar._indice = None
+
+    def slugs(self, prefixo):
+        return [slug for _, _, slug in autocompletar.sugerir(prefixo)]
+
+    def test_prefixo_de_qualquer_palavra_sem_acento(self):
+        self.assertEqual(self.slugs('agua'), ['agua-marinha-azul'])
+        self.assertEqual(self.slugs('MAR'), ['agua-marinha-azul'])
+        self.assertEqual(self.slugs('m'), ['agua-marinha-azul', 'morganita'])
+        self.assertEqual(self.slugs(''), [])
+
+    def test_caminho_quente_sem_consultas(self):
+        self.slugs('mor')
+        with self.assertNumQueries(0):
+            resposta = self.client.get(reverse('loja:autocompletar'), {'q': 'mor'})
+        self.assertEqual(resposta.json()['resultados'][0]['url'], reverse('loja:detalhe_produto', args=['morganita']))
+
+    def test_atualizacao_incremental_pelos_sinais(self):
+        self.slugs('m')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.morganita.disponivel = False
+            self.morganita.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.agua_marinha.nome = 'Berilo Azul'
+            self.agua_marinha.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.slugs('m'), [])
+            self.assertEqual(self.slugs('beri'), ['agua-marinha-azul'])
+
+    def test_versao_no_cache_invalida_outros_processos(self):
+        self.slugs('m')
+        Produto.objects.filter(pk=self.morganita.pk).update(nome='Kunzita')
+        # Outro processo alterou o catálogo e trocou a versão
+        autocompletar.invalidar()
+        self.assertEqual(self.slugs('kun'), ['morganita'])
+
+    def test_com_produto_igual_ao_indice_remontado(self):
+        produtos = {1: ('Água-marinha Azul', 'agua'), 2: ('Ametista', 'ametista'), 3: ('Quartzo Azul', 'quartzo')}
+        indice = autocompletar.IndicePrefixos('v0', produtos)
+        alteracoes = [
+            (4, 'Azurita', 'azurita'),           # novo
+            (3, 'Quartzo Rosa', 'quartzo'),      # nome trocado
+            (2, None, None),                     # removido
+            (1, 'Água-marinha Azul', 'agua-2'),  # só o slug
+            (5, 'Azul Azul', 'azul'),            # palavra repetida
+            (9, None, None),                     # removido sem estar no índice
+        ]
+        def pares(indice):
+            return [par for chaves, ids in indice.blocos for par in zip(chaves, ids)]
+
+        for versao, (pid, nome, slug) in enumerate(alteracoes, 1):
+            # Nada é reordenado: só as chaves do produto entram e saem
+            with mock.patch('loja.autocompletar.sorted', create=True, side_effect=AssertionError('reordenou')):
+                indice = indice.com_produto(f'v{versao}', pid, nome, slug)
+            if nome is None:
+                produtos.pop(pid, None)
+            else:
+                produtos[pid] = (nome, slug)
+            remontado = autocompletar.IndicePrefixos('x', dict(produtos))
+            with self.subTest(produto=pid):
+                self.assertEqual((pares(indice), indice.produtos), (pares(remontado), remontado.produtos))
+                self.assertEqual(indice.inicios, [(chaves[0], ids[0]) for chaves, ids in indice.blocos])
+        self.assertEqual([pid for pid, _, _ in indice.buscar('azu')], [1, 5, 4])
+        self.assertEqual(indice.buscar('ametista'), [])
+        self.assertEqual(indice.buscar('agua'), [(1, 'Água-marinha Azul', 'agua-2')])
+
+    @mock.patch('loja.autocompletar.TAMANHO_BLOCO', 2)
+    def test_com_produto_copia_so_os_blocos_alterados(self):
+        produtos = {pid: (f'Mineral {pid:02}', f'mineral-{pid}') for pid in range(1, 21)}
+        indice = autocompletar.IndicePrefixos('v0', produtos)
+        self.assertEqual(len(indice.blocos), 20)
+        novo = indice.com_produto('v1', 7, 'Mineral 99', 'mineral-7')
+        compartilhados = sum(any(bloco is antigo for antigo in indice.blocos) for bloco in novo.blocos)
+        # 2 chaves saem e 2 entram: no máximo 4 blocos copiados
+        self.assertGreaterEqual(compartilhados, len(indice.blocos) - 4)
+        self.assertEqual([slug for _, _, slug in novo.buscar('99')], ['mineral-7'])
+        self.assertEqual(novo.buscar('07'), [])
+        self.assertEqual(len(novo.buscar('mineral', limite=20)), 20)
+
+        # Blocos que crescem são divididos; os que esvaziam, retirados
+        for pid in range(21, 31):
+            novo = novo.com_produto(f'v{pid}', pid, 'Quartzo', f'quartzo-{pid}')
+        for pid in range(1, 21):
+            novo = novo.com_produto(f'x{pid}', pid)
+        self.assertTrue(all(1 <= len(chaves) <= 4 for chaves, _ in novo.blocos))
+        self.assertEqual([pid for pid, _, _ in novo.buscar('qua', limite=20)], list(range(21, 31)))
+        self.assertEqual(novo.buscar('mineral'), [])
+
+    def test_processo_com_indice_desatualizado_remonta(self):
+        # Dois processos compartilhando o cache: o índice de cada um é trocado à mão
+        self.slugs('m')
+        processo_a = autocompletar._indice
+        # O processo B renomeia a Morganita
+        autocompletar._indice = None
+        self.slugs('m')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.morganita.nome = 'Berilo Rosa'
+            self.morganita.save()
+        # Depois o processo A altera outro produto
+        autocompletar._indice = processo_a
+        with self.captureOnCommitCallbacks(execute=True):
+            self.agua_marinha.nome = 'Água-Marinha Celeste'
+            self.agua_marinha.save()
+        self.assertEqual(self.slugs('mor'), [])
+        self.assertEqual(self.slugs('ber'), ['morganita'])
+        self.assertEqual(self.slugs('cel'), ['agua-marinha-azul'])
+
+
+def imagem_de_teste(largura=1200, altura=900, formato='PNG'):
+    saida = BytesIO()
+    Image.new('RGBA', (largura, altura), (120, 60, 200, 255)).save(saida, formato)
+    return SimpleUploadedFile(f'foto.{formato.lower()}', saida.getvalue())
+
+
+class DerivadosImagemTest(TestCase):
+
+    def setUp(self):
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pasta)
+        configuracao = override_settings(MEDIA_ROOT=pasta)
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        self.categoria = Categoria.objects.create(nome='Quartzos', slug='quartzos')
+
+    def criar_produto(self, **kwargs):
+        return Produto.objects.create(
+            nome='Ametista', slug='ametista', descricao='d', preco=80, categoria=self.categoria, **kwargs
+        )
+
+    def test_upload_gera_derivados_com_nome_pelo_conteudo(self):
+        produto = self.criar_produto(imagem=imagem_de_teste())
+        self.assertEqual(len(produto.imagem_hash), 16)
+        self.assertEqual(Produto.objects.get(pk=produto.pk).imagem_hash, produto.imagem_hash)
+        for largura in LARGURAS:
+            for formato in FORMATOS:
+                with default_storage.open(caminho_derivado(produto.imagem_hash, largura, formato)) as arquivo:
+                    self.assertEqual(Image.open(arquivo).width, largura)
+
+        # Trocar a imagem troca o hash (e portanto as URLs)
+        hash_anterior = produto.imagem_hash
+        produto.imagem = imagem_de_teste(640, 480)
+        produto.save()
+        self.assertNotEqual(produto.imagem_hash, hash_anterior)
+
+    def test_imagem_invalida_nao_quebra_o_save(self):
+        with self.assertLogs('loja.imagens', 'ERROR'):
+            produto = self.criar_produto(imagem=SimpleUploadedFile('foto.png', b'nao e uma imagem'))
+        self.assertEqual(produto.imagem_hash, '')
+
+    def test_tag_emite_srcset(self):
+        produto = self.criar_produto(imagem=imagem_de_teste())
+        html = Template('{% load loja_imagens %}{% imagem_produto produto tamanhos="200px" largura=200 %}').render(
+            Context({'produto': produto})
+        )
+        self.assertIn('<picture>', html)
+        self.assertIn(f'{produto.imagem_hash}/400.jpeg 400w', html)
+        self.assertIn('sizes="200px"', html)
+        self.assertIn('width="200"', html)
+
+        # Sem derivados, a imagem original
+        Produto.objects.filter(pk=produto.pk).update(imagem_hash='')
+        produto.refresh_from_db()
+        html = Template('{% load loja_imagens %}{% imagem_produto produto %}').render(Context({'produto': produto}))
+        self.assertIn(f'src="{produto.imagem.url}"', html)
+        self.assertNotIn('width=', html)
+
+    def test_comando_preenche_imagens_antigas(self):
+        produto = self.criar_produto(imagem=imagem_de_teste())
+        esperado = produto.imagem_hash
+        Produto.objects.filter(pk=produto.pk).update(imagem_hash='', atualizado_em=timezone.now() - timedelta(days=1))
+        invalidar_slugs([produto.slug])
+        url = reverse('loja:detalhe_produto', args=[produto.slug])
+        self.client.get(url)
+        antes = self.client.get(url)
+        self.assertNotContains(antes, 'srcset')
+
+        call_command('gerar_derivados_imagens', processos=1, stdout=open(os.devnull, 'w'))
+        produto.refresh_from_db()
+        self.assertEqual(produto.imagem_hash, esperado)
+        self.assertGreater(produto.atualizado_em, timezone.now() - timedelta(minutes=1))
+        # O navegador não recebe 304 com as URLs antigas
+        depois = self.client.get(url, HTTP_IF_NONE_MATCH=antes['ETag'], HTTP_IF_MODIFIED_SINCE=antes['Last-Modified'])
+        self.assertEqual(depois.status_code, 200)
+        self.assertContains(depois, 'srcset')
+
+        # Rodar de novo (--todos) com o mesmo hash não mexe no produto
+        atualizado_em = produto.atualizado_em
+        call_command('gerar_derivados_imagens', processos=1, todos=True, stdout=open(os.devnull, 'w'))
+        produto.refresh_from_db()
+        self.assertEqual(produto.atualizado_em, atualizado_em)
+
+
+class EstaticosTest(TestCase):
+
+    def collectstatic(self, templates=()):
+        destino = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, destino)
+        pasta_templates = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pasta_templates)
+        for i, conteudo in enumerate(templates):
+            Path(pasta_templates, f'extra{i}.html').write_text(conteudo)
+        engines = [dict(settings.TEMPLATES[0], DIRS=[*settings.TEMPLATES[0]['DIRS'], pasta_templates])]
+
+        configuracao = override_settings(
+            STATIC_ROOT=destino,
+            STORAGES=dict(settings.STORAGES, staticfiles={'BACKEND': 'loja.estaticos.ArmazenamentoEstatico'}),
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+            TEMPLATES=engines,
+        )
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        # Sem o pacote brotli o collectstatic avisa que só gerou o .gz
+        with self.assertLogs('loja.estaticos', 'WARNING') if brotli is None else nullcontext():
+            call_command('collectstatic', interactive=False, verbosity=0)
+        with open(os.path.join(destino, 'staticfiles.json')) as arquivo:
+            return destino, json.load(arquivo)['paths']
+
+    def test_nomes_com_hash_e_versoes_comprimidas(self):
+        destino, manifesto = self.collectstatic()
+        css = manifesto['css/bootstrap.min.css']
+        self.assertRegex(css, r'^css/bootstrap\.min\.[0-9a-f]{12}\.css$')
+        with open(os.path.join(destino, css), 'rb') as original, gzip.open(os.path.join(destino, css + '.gz')) as comprimido:
+            self.assertEqual(original.read(), comprimido.read())
+        if brotli is not None:
+            with open(os.path.join(destino, css), 'rb') as original, open(os.path.join(destino, css + '.br'), 'rb') as comprimido:
+                self.assertEqual(original.read(), brotli.decompress(comprimido.read()))
+        else:
+            self.assertFalse(os.path.exists(os.path.join(destino, css + '.br')))
+        # Fontes já são comprimidas
+        self.assertFalse(any(nome.endswith('.woff2.gz') for _, _, nomes in os.walk(destino) for nome in nomes))
+
+    def test_remove_webfonts_que_nenhum_template_usa(self):
+        destino, manifesto = self.collectstatic(templates=['<i class="fa-brands fa-instagram"></i>'])
+        self.assertEqual([n for n in manifesto if n.startswith('fa/webfonts/')], ['fa/webfonts/fa-brands-400.woff2'])
+        with open(os.path.join(destino, manifesto['fa/css/all.min.css'])) as arquivo:
+            css = arquivo.read()
+        self.assertIn('fa-brands-400.', css)
+        self.assertNotIn('fa-solid-900', css)
+        self.assertNotIn('fa-regular-400', css)
+
+    def test_servir_estatico_pre_comprimido_e_imutavel(self):
+        destino, manifesto = self.collectstatic()
+        fabrica = RequestFactory()
+        css = manifesto['css/bootstrap.min.css']
+
+        resposta = servir_estatico(fabrica.get('/', HTTP_ACCEPT_ENCODING='gzip, br;q=0'), css)
+        self.assertEqual(resposta['Content-Encoding'], 'gzip')
+        self.assertEqual(resposta['Content-Type'], 'text/css')
+        self.assertEqual(resposta['Vary'], 'Accept-Encoding')
+        self.assertIn('immutable', resposta['Cache-Control'])
+        resposta.close()
+
+        # Nome sem hash: sem compressão aceita, sem cache longo
+        resposta = servir_estatico(fabrica.get('/'), 'css/bootstrap.min.css')
+        self.assertFalse(resposta.has_header('Content-Encoding'))
+        self.assertNotIn('immutable', resposta['Cache-Control'])
+        resposta.close()
+
+        with self.assertRaises(Http404):
+            servir_estatico(fabrica.get('/'), '../settings.py')
+
+
+class GetCondicionalTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categoria = Categoria.objects.create(nome='Quartzos', slug='quartzos')
+        cls.produto = Produto.objects.create(
+            nome='Ametista', slug='ametista', descricao='d', preco=80, categoria=cls.categoria, estoque=5,
+        )
+        cls.outro = Produto.objects.create(nome='Citrino', slug='citrino', descricao='d', preco=60, categoria=cls.categoria)
+        cls.cliente = User.objects.create_user('cliente', 'cliente@fluorita.com', 'senha-de-teste-123')
+
+    def setUp(self):
+        cache.clear()
+
+    def visitar(self, url):
+        # A primeira visita cria o cookie do CSRF, que faz parte do ETag
+        self.client.get(url)
+        return self.client.get(url)
+
+    def revalidar(self, url, resposta):
+        # Repete a requisição como o navegador faria, com os validadores recebidos
+        cabecalhos = {'HTTP_IF_NONE_MATCH': resposta['ETag']}
+        if resposta.has_header('Last-Modified'):
+            cabecalhos['HTTP_IF_MODIFIED_SINCE'] = resposta['Last-Modified']
+        return self.client.get(url, **cabecalhos)
+
+    def test_produto_304_sem_renderizar(self):
+        url = reverse('loja:detalhe_produto', args=['ametista'])
+        primeira = self.visitar(url)
+        self.assertTrue(primeira.has_header('ETag'))
+        self.assertTrue(primeira.has_header('Last-Modified'))
+        self.assertIn('private', primeira['Cache-Control'])
+
+        renders = []
+        with medir_renderizacao(renders), self.assertNumQueries(0):
+            segunda = self.revalidar(url, primeira)
+        self.assertEqual(segunda.status_code, 304)
+        self.assertEqual(renders, [])
+
+    def test_produto_muda_com_avaliacao_categoria_e_estoque(self):
+        url = reverse('loja:detalhe_produto', args=['ametista'])
+        resposta = self.visitar(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Avaliacao.objects.create(produto=self.produto, usuario=self.cliente, nota=5, comentario='Linda')
+        nova = self.revalidar(url, resposta)
+        self.assertEqual(nova.status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.categoria.nome = 'Quartzos e Variedades'
+            self.categoria.save()
+        self.assertEqual(self.revalidar(url, nova).status_code, 200)
+
+    def test_usuario_logado_so_tem_etag_e_ve_mudancas_pessoais(self):
+        url = reverse('loja:detalhe_produto', args=['ametista'])
+        anonimo = self.visitar(url)
+        self.client.force_login(self.cliente)
+        logado = self.client.get(url)
+        self.assertNotEqual(logado['ETag'], anonimo['ETag'])
+        self.assertFalse(logado.has_header('Last-Modified'))
+        self.assertEqual(self.revalidar(url, logado).status_code, 304)
+
+        # O pedido foi entregue: agora ele pode avaliar o produto
+        pedido = Pedido.objects.create(usuario=self.cliente, total=80)
+        ItemPedido.objects.create(pedido=pedido, produto=self.produto, preco=80, quantidade=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            pedido.status = 'entregue'
+            pedido.save()
+        resposta = self.revalidar(url, logado)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta.context['pode_avaliar'])
+
+    def test_catalogo_muda_com_exclusao_e_estoque(self):
+        url = reverse('loja:lista_produtos')
+        resposta = self.visitar(url)
+        self.assertEqual(self.revalidar(url, resposta).status_code, 304)
+
+        self.outro.delete()
+        resposta_sem_outro = self.revalidar(url, resposta)
+        self.assertEqual(resposta_sem_outro.status_code, 200)
+        self.assertNotContains(resposta_sem_outro, 'Citrino')
+
+        endereco = Endereco.objects.create(
+            usuario=self.cliente, logradouro='Rua', numero='1', bairro='B', cidade='C', estado='MG', cep='00000-000',
+        )
+        criar_pedido(self.cliente, endereco, {self.produto.pk: 2})
+        self.assertEqual(self.revalidar(url, resposta_sem_outro).status_code, 200)
+
+    def test_sem_validadores_com_mensagem_pendente(self):
+        self.client.force_login(self.cliente)
+        with mock.patch('loja.carrinho.MAX_ITENS', 0):
+            self.client.post(reverse('loja:adicionar_ao_carrinho', args=[self.outro.pk]))
+        resposta = self.client.get(reverse('loja:lista_produtos'))
+        self.assertContains(resposta, 'limite de itens')
+        self.assertFalse(resposta.has_header('ETag'))
+
+
+class HistoricoPedidosTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.cliente = User.objects.create_user('cliente', 'cliente@fluorita.com', 'senha-de-teste-123')
+        categoria = Categoria.objects.create(nome='Quartzos', slug='quartzos')
+        cls.produto = Produto.objects.create(nome='Ametista', slug='ametista', descricao='d', preco=80, categoria=categoria)
+        cls.pedidos = Pedido.objects.bulk_create([Pedido(usuario=cls.cliente, total=80) for _ in range(45)])
+        ItemPedido.objects.bulk_create(
+            [ItemPedido(pedido=p, produto=cls.produto, preco=80, quantidade=1) for i, p in enumerate(cls.pedidos) for _ in range(1 + i % 3)]
+        )
+        # Pedido de outro cliente não pode aparecer
+        outro = User.objects.create_user('outro')
+        Pedido.objects.create(usuario=outro, total=1)
+
+    def setUp(self):
+        self.client.force_login(self.cliente)
+
+    def test_paginas_com_quantidade_de_itens(self):
+        vistos = []
+        cursor = None
+        while True:
+            with self.assertNumQueries(3):  # sessão, usuário e a página de pedidos
+                resposta = self.client.get(reverse('loja:meus_pedidos'), {'cursor': cursor} if cursor else {})
+            pagina = resposta.context['pagina']
+            vistos += [(p.pk, p.quantidade_itens) for p in pagina]
+            if not pagina.tem_proximo:
+                break
+            cursor = pagina.cursor_proximo
+        esperado = [(p.pk, 1 + i % 3) for i, p in enumerate(self.pedidos)][::-1]
+        self.assertEqual(vistos, esperado)
+
+    def test_detalhe_sem_consulta_por_item(self):
+        pedido = self.pedidos[2]
+        url = reverse('loja:detalhe_pedido', args=[pedido.pk])
+        with CaptureQueriesContext(connection) as poucos:
+            self.client.get(url)
+        ItemPedido.objects.bulk_create(
+            [ItemPedido(pedido=pedido, produto=self.produto, preco=80, quantidade=2) for _ in range(30)]
+        )
+        with CaptureQueriesContext(connection) as muitos:
+            resposta = self.client.get(url)
+        self.assertEqual(len(poucos), len(muitos))
+        self.assertContains(resposta, 'R$ 160', count=30)
+
+    def test_pedido_de_outro_cliente(self):
+        outro = Pedido.objects.exclude(usuario=self.cliente).get()
+        self.assertEqual(self.client.get(reverse('loja:detalhe_pedido', args=[outro.pk])).status_code, 404)
+
+
+class CompraEntregueTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@fluorita.com', 'senha-de-teste-123')
+        cls.cliente = User.objects.create_user('cliente', 'cliente@fluorita.com', 'senha-de-teste-123')
+        categoria = Categoria.objects.create(nome='Quartzos', slug='quartzos')
+        cls.ametista = Produto.objects.create(nome='Ametista', slug='ametista', descricao='d', preco=80, categoria=categoria)
+        cls.citrino = Produto.objects.create(nome='Citrino', slug='citrino', descricao='d', preco=60, categoria=categoria)
+
+    def setUp(self):
+        cache.clear()
+
+    def criar_pedido(self, *produtos, status='pendente'):
+        # Como no checkout: o pedido nasce pendente e o status muda depois de ter itens
+        pedido = Pedido.objects.create(usuario=self.cliente, total=10)
+        ItemPedido.objects.bulk_create([ItemPedido(pedido=pedido, produto=p, preco=10, quantidade=1) for p in produtos])
+        if status != pedido.status:
+            with self.captureOnCommitCallbacks(execute=True):
+                pedido.status = status
+                pedido.save()
+        return pedido
+
+    def pares(self):
+        return set(CompraEntregue.objects.values_list('usuario__username', 'produto__slug'))
+
+    def test_save_pelo_admin_registra_e_remove(self):
+        pedido = self.criar_pedido(self.ametista, self.citrino)
+        self.client.force_login(self.admin)
+        url = reverse('admin:loja_pedido_change', args=[pedido.pk])
+        self.client.post(url, {
+            'status': 'entregue', 'itens-TOTAL_FORMS': 0, 'itens-INITIAL_FORMS': 0,
+        })
+        self.assertEqual(self.pares(), {('cliente', 'ametista'), ('cliente', 'citrino')})
+
+        pedido.status = 'cancelado'
+        pedido.save()
+        self.assertEqual(self.pares(), set())
+
+    def test_acao_em_massa_e_outro_pedido_entregue(self):
+        primeiro = self.criar_pedido(self.ametista, status='entregue')
+        segundo = self.criar_pedido(self.ametista, self.citrino)
+        self.client.force_login(self.admin)
+        self.client.post(reverse('admin:loja_pedido_changelist'), {
+            'action': 'marcar_como_entregue', '_selected_action': [primeiro.pk, segundo.pk],
+        })
+        self.assertEqual(self.pares(), {('cliente', 'ametista'), ('cliente', 'citrino')})
+
+        # Cancelar o segundo não tira a ametista, que também veio no primeiro
+        self.client.post(reverse('admin:loja_pedido_changelist'), {
+            'action': 'marcar_como_cancelado', '_selected_action': [segundo.pk],
+        })
+        self.assertEqual(self.pares(), {('cliente', 'ametista')})
+
+    def test_pagina_de_produto_sem_consultas_de_elegibilidade(self):
+        self.criar_pedido(self.ametista, status='entregue')
+        self.client.force_login(self.cliente)
+        url = reverse('loja:detalhe_produto', args=['ametista'])
+        self.assertTrue(self.client.get(url).context['pode_avaliar'])
+        with CaptureQueriesContext(connection) as capturadas:
+            self.assertTrue(self.client.get(url).context['pode_avaliar'])
+        self.assertFalse(any('loja_pedido' in q['sql'] or 'compraentregue' in q['sql'] for q in capturadas))
+
+        # Depois de avaliar, o conjunto em cache é invalidado
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('loja:adicionar_avaliacao', args=['ametista']), {'nota': 5, 'comentario': 'Linda'})
+        self.assertEqual(Avaliacao.objects.count(), 1)
+        self.assertFalse(self.client.get(url).context['pode_avaliar'])
+        self.assertEqual(produtos_avaliaveis(self.cliente), frozenset())
+
+    def test_avaliacao_sem_compra_entregue_e_recusada(self):
+        self.criar_pedido(self.citrino)
+        self.client.force_login(self.cliente)
+        self.client.post(reverse('loja:adicionar_avaliacao', args=['citrino']), {'nota': 5, 'comentario': 'Linda'})
+        self.assertFalse(Avaliacao.objects.exists())
+
+    def test_exclusao_de_pedido_entregue(self):
+        primeiro = self.criar_pedido(self.ametista, self.citrino, status='entregue')
+        segundo = self.criar_pedido(self.ametista, status='entregue')
+        pendente = self.criar_pedido(self.citrino)
+        self.client.force_login(self.cliente)
+        self.assertEqual(produtos_avaliaveis(self.cliente), {self.ametista.pk, self.citrino.pk})
+
+        # A ametista também veio no segundo pedido entregue; o citrino só no primeiro
+        with self.captureOnCommitCallbacks(execute=True):
+            primeiro.delete()
+        self.assertEqual(self.pares(), {('cliente', 'ametista')})
+        self.assertEqual(produtos_avaliaveis(self.cliente), {self.ametista.pk})
+        self.client.post(reverse('loja:adicionar_avaliacao', args=['citrino']), {'nota': 5, 'comentario': 'Linda'})
+        self.assertFalse(Avaliacao.objects.exists())
+
+        # Exclusão em massa (ex: ação do admin); o pedido pendente não muda nada
+        with self.captureOnCommitCallbacks(execute=True):
+            Pedido.objects.filter(pk__in=[segundo.pk, pendente.pk]).delete()
+        self.assertEqual(self.pares(), set())
+
+    def test_reconstruir(self):
+        self.criar_pedido(self.ametista, status='entregue')
+        CompraEntregue.objects.all().delete()
+        CompraEntregue.objects.create(usuario=self.cliente, produto=self.citrino)
+        call_command('reconstruir_compras_entregues', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.pares(), {('cliente', 'ametista')})
+
+
+class VendasTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.gerente = User.objects.create_user('gerente', 'gerente@fluorita.com', 'senha-de-teste-123', is_staff=True)
+        cls.cliente = User.objects.create_user('cliente', 'cliente@fluorita.com', 'senha-de-teste-123')
+        quartzos = Categoria.objects.create(nome='Quartzos', slug='quartzos')
+        berilos = Categoria.objects.create(nome='Berilos', slug='berilos')
+        cls.ametista = Produto.objects.create(nome='Ametista', slug='ametista', descricao='d', preco=80, categoria=quartzos)
+        cls.esmeralda = Produto.objects.create(nome='Esmeralda', slug='esmeralda', descricao='d', preco=300, categoria=berilos)
+
+    def criar_pedido(self, dia, *itens):
+        pedido = Pedido.objects.create(usuario=self.cliente, total=0)
+        ItemPedido.objects.bulk_create(
+            [ItemPedido(pedido=pedido, produto=produto, preco=produto.preco, quantidade=q) for produto, q in itens]
+        )
+        # criado_em e atualizado_em são automáticos: as datas do teste são gravadas por update()
+        criado_em = datetime(2026, 3, dia, 15, tzinfo=dt_timezone.utc)
+        Pedido.objects.filter(pk=pedido.pk).update(criado_em=criado_em, atualizado_em=criado_em)
+        return pedido
+
+    def vendas(self):
+        return {
+            (v.dia.day, v.produto.slug, v.status): (v.quantidade, v.receita, v.pedidos)
+            for v in VendaDiaria.objects.select_related('produto')
+        }
+
+    def test_primeira_execucao_e_incremental(self):
+        self.criar_pedido(1, (self.ametista, 2), (self.esmeralda, 1))
+        self.criar_pedido(1, (self.ametista, 1))
+        cancelado = self.criar_pedido(2, (self.esmeralda, 1))
+
+        call_command('atualizar_vendas', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.vendas(), {
+            (1, 'ametista', 'pendente'): (3, 240, 2),
+            (1, 'esmeralda', 'pendente'): (1, 300, 1),
+            (2, 'esmeralda', 'pendente'): (1, 300, 1),
+        })
+
+        # Linha "adulterada" num dia sem mudanças: a execução incremental não toca nela
+        VendaDiaria.objects.filter(dia__day=1, produto=self.esmeralda).update(quantidade=99)
+        alterar_status(Pedido.objects.filter(pk=cancelado.pk), 'cancelado')
+        self.assertEqual(atualizar_vendas(), 1)
+        vendas = self.vendas()
+        self.assertEqual(vendas[(1, 'esmeralda', 'pendente')][0], 99)
+        self.assertEqual(vendas[(2, 'esmeralda', 'cancelado')], (1, 300, 1))
+        self.assertNotIn((2, 'esmeralda', 'pendente'), vendas)
+
+        # --completo refaz tudo
+        call_command('atualizar_vendas', '--completo', stdout=open(os.devnull, 'w'))
+        self.assertEqual(self.vendas()[(1, 'esmeralda', 'pendente')][0], 1)
+
+    def test_marca_dagua_com_folga(self):
+        pedido = self.criar_pedido(1, (self.ametista, 1))
+        atualizar_vendas()
+        # Nada mudou: nenhum dia além dos que caem na folga
+        MarcaProcessamento.objects.filter(nome='vendas').update(processado_ate=timezone.now() + timedelta(hours=1))
+        self.assertEqual(atualizar_vendas(), 0)
+
+        # Um save comum (ex: pelo admin) atualiza atualizado_em
+        MarcaProcessamento.objects.filter(nome='vendas').update(processado_ate=timezone.now() - timedelta(hours=1))
+        pedido.refresh_from_db()
+        pedido.status = 'entregue'
+        pedido.save()
+        self.assertEqual(atualizar_vendas(), 1)
+        self.assertIn((1, 'ametista', 'entregue'), self.vendas())
+
+    def test_exclusao_de_pedido_refaz_o_dia(self):
+        pedido = self.criar_pedido(1, (self.ametista, 1))
+        self.criar_pedido(1, (self.esmeralda, 1))
+        atualizar_vendas()
+        with self.captureOnCommitCallbacks(execute=True):
+            Pedido.objects.get(pk=pedido.pk).delete()
+        self.assertEqual(set(self.vendas()), {(1, 'esmeralda', 'pendente')})
+
+    def test_painel_le_somente_as_vendas_agregadas(self):
+        self.criar_pedido(1, (self.ametista, 2), (self.esmeralda, 1))
+        cancelado = self.criar_pedido(2, (self.esmeralda, 5))
+        alterar_status(Pedido.objects.filter(pk=cancelado.pk), 'cancelado')
+        atualizar_vendas()
+
+        url = reverse('loja:painel_vendas')
+        self.client.force_login(self.cliente)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(self.gerente)
+        with CaptureQueriesContext(connection) as capturadas:
+            resposta = self.client.get(url, {'inicio': '2026-03-01', 'fim': '2026-03-31'})
+        self.assertFalse(any('loja_itempedido' in q['sql'] or '"loja_pedido"' in q['sql'] for q in capturadas))
+        self.assertEqual(resposta.context['totais'], {'total_receita': 460, 'total_unidades': 3})
+        self.assertEqual(
+            [(c['produto__categoria__nome'], c['total_receita']) for c in resposta.context['por_categoria']],
+            [('Berilos', 300), ('Quartzos', 160)],
+        )
+        self.assertEqual(resposta.context['top_produtos'][0]['produto__slug'], 'esmeralda')
+        self.assertContains(resposta, 'Cancelado')
+
+
+class ExportacaoPedidosTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@fluorita.com', 'senha-de-teste-123')
+        cls.cliente = User.objects.create_user('cliente', 'cliente@fluorita.com', 'senha-de-teste-123')
+        categoria = Categoria.objects.create(nome='Quartzos', slug='quartzos')
+        cls.produtos = Produto.objects.bulk_create([
+            Produto(nome=f'Ametista {i}', slug=f'ametista-{i}', descricao='d', preco=10 + i, categoria=categoria)
+            for i in range(4)
+        ])
+        cls.pedidos = []
+        for i in range(5):
+            pedido = Pedido.objects.create(usuario=cls.cliente, total=10, status='entregue' if i % 2 else 'pendente')
+            # O último pedido fica sem itens
+            ItemPedido.objects.bulk_create([
+                ItemPedido(pedido=pedido, produto=produto, preco=produto.preco, quantidade=2)
+                for produto in cls.produtos[:i % 4 + 1] if i < 4
+            ])
+            cls.pedidos.append(pedido)
+
+    def test_csv_uma_linha_por_item_e_consultas_por_lote(self):
+        with CaptureQueriesContext(connection) as capturadas:
+            conteudo = ''.join(linhas_exportacao(Pedido.objects.all(), 'csv', lote=2))
+        # Lotes de 2, 2 e 1 pedidos: pedidos (com usuário e endereço) + itens (com produto) por lote
+        self.assertEqual(len(capturadas), 6)
+
+        linhas = conteudo.lstrip('\ufeff').splitlines()
+        self.assertTrue(linhas[0].startswith('pedido_id,criado_em,status'))
+        # 1 + 2 + 3 + 4 itens, mais uma linha para o pedido sem itens
+        self.assertEqual(len(linhas) - 1, 11)
+        self.assertIn('Ametista 3,13.00,2,26.00', conteudo)
+
+    def test_comando_jsonl_com_filtro(self):
+        saida = os.path.join(tempfile.mkdtemp(), 'pedidos.jsonl')
+        self.addCleanup(shutil.rmtree, os.path.dirname(saida))
+        call_command('exportar_pedidos', '--formato', 'jsonl', '--status', 'entregue', '--lote', '1', '--saida', saida)
+        with open(saida, encoding='utf-8') as arquivo:
+            pedidos = [json.loads(linha) for linha in arquivo]
+        self.assertEqual([p['pedido_id'] for p in pedidos], [self.pedidos[1].pk, self.pedidos[3].pk])
+        self.assertEqual([len(p['itens']) for p in pedidos], [2, 4])
+
+    def test_admin_exporta_a_lista_filtrada_e_a_selecao(self):
+        self.client.force_login(self.admin)
+        url = reverse('admin:loja_pedido_exportar', args=['jsonl'])
+        resposta = self.client.get(url, {'status__exact': 'pendente'})
+        self.assertTrue(resposta.streaming)
+        self.assertIn('attachment;', resposta['Content-Disposition'])
+        pedidos = [json.loads(linha) for linha in b''.join(resposta.streaming_content).decode().splitlines()]
+        self.assertEqual({p['status'] for p in pedidos}, {'pendente'})
+        self.assertEqual(len(pedidos), 3)
+        self.assertEqual(self.client.get(reverse('admin:loja_pedido_exportar', args=['xml'])).status_code, 404)
+
+        # A lista mostra os botões com a querystring atual
+        lista = self.client.get(reverse('admin:loja_pedido_changelist'), {'status__exact': 'pendente'})
+        self.assertContains(lista, f'{reverse("admin:loja_pedido_exportar", args=["csv"])}?status__exact=pendente')
+
+        resposta = self.client.post(reverse('admin:loja_pedido_changelist'), {
+            'action': 'exportar_csv', '_selected_action': [self.pedidos[0].pk],
+        })
+        linhas = b''.join(resposta.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(len(linhas), 2)
+
+
+    def test_csv_neutraliza_formulas(self):
+        self.cliente.username = '=HYPERLINK("http://x")'
+        self.cliente.email = '@cliente@fluorita.com'
+        self.cliente.save()
+        conteudo = ''.join(linhas_exportacao(Pedido.objects.filter(pk=self.pedidos[4].pk), 'csv'))
+        linha = next(csv.DictReader(StringIO(conteudo.lstrip('\ufeff'))))
+        self.assertEqual(linha['usuario'], '\'=HYPERLINK("http://x")')
+        self.assertEqual(linha['email'], "'@cliente@fluorita.com")
+        self.assertEqual(linha['total'], '10.00')
+        # No JSONL o valor vai como está
+        pedido = json.loads(next(linhas_exportacao(Pedido.objects.filter(pk=self.pedidos[4].pk), 'jsonl')))
+        self.assertEqual(pedido['usuario'], '=HYPERLINK("http://x")')
+
+    def test_admin_filtro_invalido_volta_para_a_lista(self):
+        self.client.force_login(self.admin)
+        resposta = self.client.get(reverse('admin:loja_pedido_exportar', args=['csv']), {'criado_em__gte': 'ontem'})
+        self.assertRedirects(resposta, f'{reverse("admin:loja_pedido_changelist")}?e=1', fetch_redirect_response=False)
+
+
+class ImportacaoCatalogoTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.quartzos = Categoria.objects.create(nome='Quartzos', slug='quartzos')
+        cls.citrino = Produto.objects.create(
+            nome='Citrino', slug='citrino', descricao='Quartzo amarelo', preco=60, estoque=3, categoria=cls.quartzos,
+        )
+
+    def setUp(self):
+        cache.clear()
+        autocompletar._indice = None
+
+    def importar(self, conteudo, formato='csv', **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return importar_catalogo(StringIO(conteudo), formato, **kwargs)
+
+    def test_comando_insere_atualiza_e_cria_categorias(self):
+        arquivo = os.path.join(tempfile.mkdtemp(), 'catalogo.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(arquivo))
+        with open(arquivo, 'w', encoding='utf-8-sig') as saida:
+            saida.write(
+                'slug,nome,descricao,preco,estoque,disponivel,categoria\n'
+                'citrino,Citrino,Quartzo amarelo,"64,90",3,sim,Quartzos\n'
+                'ametista,Ametista Roxa,Drusa violeta,80.00,5,sim,Quartzos\n'
+                'esmeralda,Esmeralda,Berilo verde,300,1,nao,Berilos\n'
+            )
+        autocompletar.sugerir('ci')  # monta o índice antes da importação
+        antes = Produto.objects.get(slug='citrino').atualizado_em
+        saida = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('importar_catalogo', arquivo, stdout=saida)
+        self.assertIn('2 inserido(s), 1 atualizado(s), 0 inalterado(s), 0 com erro; 1 categoria(s) criada(s)', saida.getvalue())
+
+        citrino = Produto.objects.get(slug='citrino')
+        self.assertEqual(citrino.preco, Decimal('64.90'))
+        self.assertGreater(citrino.atualizado_em, antes)
+        esmeralda = Produto.objects.select_related('categoria').get(slug='esmeralda')
+        self.assertEqual((esmeralda.categoria.slug, esmeralda.disponivel), ('berilos', False))
+        # Sem sinais, mas com índice de busca e autocompletar em dia
+        self.assertEqual(list(pagina_busca({'q': 'drusa'})), [Produto.objects.get(slug='ametista')])
+        self.assertEqual([slug for _, _, slug in autocompletar.sugerir('ame')], ['ametista'])
+
+    def test_arquivo_de_estoque_altera_so_o_que_mudou(self):
+        self.importar('slug,nome,preco,categoria\nametista,Ametista,80,Quartzos\n')
+        ametista = Produto.objects.get(slug='ametista')
+        self.assertEqual(snapshot_produto('citrino')['produto'].estoque, 3)
+
+        resultado = self.importar('slug,estoque\ncitrino,7\nametista,4\n')
+        self.assertEqual((resultado['atualizados'], resultado['inalterados']), (2, 0))
+        self.assertEqual(Produto.objects.get(slug='citrino').preco, 60)
+        # O snapshot da página foi invalidado
+        self.assertEqual(snapshot_produto('citrino')['produto'].estoque, 7)
+
+        antes = Produto.objects.get(pk=ametista.pk).atualizado_em
+        resultado = self.importar('{"slug": "citrino", "estoque": 7}\n{"slug": "ametista", "estoque": 4}\n', 'jsonl')
+        self.assertEqual((resultado['atualizados'], resultado['inalterados']), (0, 2))
+        self.assertEqual(Produto.objects.get(pk=ametista.pk).atualizado_em, antes)
+
+    def test_erros_sao_relatados_e_o_resto_aplicado(self):
+        resultado = self.importar(
+            '{"slug": "citrino", "preco": "caro"}\n'
+            '{"slug": "Slug Ruim", "nome": "x"}\n'
+            '{"slug": "sem-preco", "nome": "Sem preço", "categoria": "Quartzos"}\n'
+            'isto não é json\n'
+            '{"slug": "topazio", "nome": "Topázio", "preco": 120, "categoria": "Topázios", "disponivel": true}\n',
+            'jsonl',
+        )
+        self.assertEqual((resultado['inseridos'], resultado['erros']), (1, 4))
+        self.assertIn('linha 1: preço inválido: "caro"', resultado['mensagens'])
+        self.assertTrue(Produto.objects.filter(slug='topazio', categoria__slug='topazios').exists())
+
+    def test_valores_fora_dos_limites_do_modelo_sao_erros_da_linha(self):
+        resultado = self.importar(
+            'slug,nome,preco,estoque,categoria\n'
+            'citrino,,NaN,,\n'
+            'citrino,,-Infinity,,\n'
+            'citrino,,100000000.00,,\n'
+            f'citrino,{"x" * 201},,,\n'
+            f'{"a" * 201},Longo,10,1,Quartzos\n'
+            'citrino,,,99999999999,\n'
+            f'quartzo-azul,Quartzo Azul,10,1,{"c" * 101}\n'
+            'ametista,Ametista,99999999.99,1,Quartzos\n'
+        )
+        self.assertEqual((resultado['inseridos'], resultado['erros']), (1, 7))
+        self.assertIn('linha 2: preço inválido: "NaN"', resultado['mensagens'])
+        self.assertIn('linha 4: preço acima do limite: "100000000.00"', resultado['mensagens'])
+        self.assertIn('linha 5: nome com mais de 200 caracteres', resultado['mensagens'])
+        self.assertEqual(Produto.objects.get(slug='ametista').preco, Decimal('99999999.99'))
+        self.assertEqual(Produto.objects.get(slug='citrino').preco, Decimal('60'))
+
+    def test_categoria_com_nome_em_conflito_e_slug_diferente(self):
+        bulk_create = Categoria.objects.bulk_create
+
+        def outro_processo_cria(objetos, **kwargs):
+            # Criada depois da leitura inicial, com o mesmo nome e o slug editado à mão
+            Categoria.objects.create(nome='Berilos', slug='berilos-raros')
+            return bulk_create(objetos, **kwargs)
+
+        with mock.patch.object(Categoria.objects, 'bulk_create', side_effect=outro_processo_cria):
+            resultado = self.importar('slug,nome,preco,categoria\nesmeralda,Esmeralda,300,Berilos\n')
+        self.assertEqual((resultado['inseridos'], resultado['erros'], resultado['categorias_criadas']), (1, 0, 0))
+        self.assertEqual(Produto.objects.get(slug='esmeralda').categoria.slug, 'berilos-raros')
+
+    def test_categoria_que_nao_pode_ser_criada_e_erro_da_linha(self):
+        with mock.patch.object(Categoria.objects, 'bulk_create'):
+            resultado = self.importar(
+                'slug,nome,preco,categoria\nesmeralda,Esmeralda,300,Berilos\nametista,Ametista,80,Quartzos\n'
+            )
+        self.assertEqual((resultado['inseridos'], resultado['erros'], resultado['categorias_criadas']), (1, 1, 0))
+        self.assertEqual(resultado['mensagens'], ['esmeralda: não foi possível criar a categoria "Berilos"'])
+
+    def test_consultas_por_lote_nao_dependem_do_tamanho(self):
+        def arquivo(inicio, quantidade):
+            return 'slug,nome,preco,estoque,categoria\n' + ''.join(
+                f'mineral-{i},Mineral {i},10,{i},Quartzos\n' for i in range(inicio, inicio + quantidade)
+            )
+
+        with CaptureQueriesContext(connection) as pequeno:
+            self.importar(arquivo(0, 5), lote=5)
+        with CaptureQueriesContext(connection) as grande:
+            self.importar(arquivo(100, 50), lote=50)
+        self.assertEqual(len(pequeno), len(grande))
+
+
+class RoteadorReplicasTest(SimpleTestCase):
+
+    @override_settings(LOJA_REPLICAS=['replica_1'])
+    def test_so_le_da_replica_quando_pedido(self):
+        roteador = RoteadorReplicas()
+        self.assertIsNone(roteador.db_for_read(Produto))
+        with ler_da_replica():
+            self.assertEqual(roteador.db_for_read(Produto), 'replica_1')
+            # Sessão e usuário ficam na primária
+            self.assertIsNone(roteador.db_for_read(User))
+            with ler_da_primaria():
+                self.assertIsNone(roteador.db_for_read(Produto))
+            # Depois de uma escrita, o resto da requisição lê da primária
+            self.assertEqual(roteador.db_for_write(Produto), 'default')
+            self.assertIsNone(roteador.db_for_read(Produto))
+        self.assertFalse(roteador.allow_migrate('replica_1', 'loja'))
+        self.assertIsNone(roteador.allow_migrate('default', 'loja'))
+
+
+REPLICA = 'replica_teste'
+
+
+@override_settings(LOJA_CARRINHO_ARMAZENAMENTO='loja.carrinho.ArmazenamentoCookie')
+class ReplicasTest(TransactionTestCase):
+    # Duas bases SQLite: a de teste (primária) e um arquivo temporário como
+    # réplica, com os mesmos ids mas nomes diferentes, para saber de onde
+    # cada página leu. O alias da réplica é criado aqui (e não em DATABASES)
+    # para os outros testes não o enxergarem.
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.pasta = tempfile.mkdtemp()
+        connections.settings[REPLICA] = connections.configure_settings({
+            'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(cls.pasta, 'replica.sqlite3')},
+        })['default']
+        cls.databases = cls.databases | {REPLICA}
+        call_command('migrate', database=REPLICA, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[REPLICA].close()
+        del connections.settings[REPLICA]
+        delattr(connections._connections, REPLICA)
+        shutil.rmtree(cls.pasta)
+
+    def setUp(self):
+        configuracao = override_settings(LOJA_REPLICAS=[REPLICA])
+        configuracao.enable()
+        self.addCleanup(configuracao.disable)
+        self.addCleanup(call_command, 'flush', database=REPLICA, interactive=False, verbosity=0)
+        cache.clear()
+
+        self.admin = User.objects.create_superuser('admin', 'admin@fluorita.com', 'senha-de-teste-123')
+        for banco, sufixo in (('default', ''), (REPLICA, ' (réplica)')):
+            Categoria.objects.using(banco).bulk_create([Categoria(id=1, nome='Quartzos', slug='quartzos')])
+            Produto.objects.using(banco).bulk_create([
+                Produto(id=1, nome=f'Ametista{sufixo}', slug='ametista', descricao='d', preco=80, categoria_id=1, estoque=5),
+            ])
+
+    def test_catalogo_e_admin_leem_da_replica(self):
+        self.assertContains(self.client.get(reverse('loja:lista_produtos')), 'Ametista (réplica)')
+
+        self.client.force_login(self.admin)
+        self.assertContains(self.client.get(reverse('admin:loja_produto_changelist')), 'Ametista (réplica)')
+
+    def test_snapshot_do_produto_vem_da_primaria(self):
+        resposta = self.client.get(reverse('loja:detalhe_produto', args=['ametista']))
+        self.assertContains(resposta, 'Ametista')
+        self.assertNotContains(resposta, '(réplica)')
+
+    def test_depois_de_escrever_le_da_primaria(self):
+        resposta = self.client.post(reverse('loja:adicionar_ao_carrinho', args=[1]), {'quantidade': 1})
+        self.assertIn('loja_primaria', resposta.cookies)
+        resposta = self.client.get(reverse('loja:lista_produtos'))
+        self.assertContains(resposta, 'Ametista')
+        self.assertNotContains(resposta, '(réplica)')
+
+        # O checkout nunca lê da réplica
+        self.client.cookies.pop('loja_primaria')
+        self.client.force_login(self.admin)
+        endereco = Endereco.objects.create(
+            usuario=self.admin, logradouro='Rua', numero='1', bairro='B', cidade='C', estado='MG', cep='00000-000',
+        )
+        self.client.post(reverse('loja:finalizar_pedido'), {'endereco_id': endereco.pk})
+        self.assertEqual(Pedido.objects.count(), 1)
+        self.assertEqual(Pedido.objects.using(REPLICA).count(), 0)
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend', LOJA_SMTP_VERIFICAR_APOS=30)
+class ConexoesTest(TestCase):
+
+    def setUp(self):
+        zerar_metricas()
+        fechar_conexao_email()
+        self.addCleanup(fechar_conexao_email)
+        smtp = mock.patch('smtplib.SMTP')
+        self.SMTP = smtp.start()
+        self.addCleanup(smtp.stop)
+        self.SMTP.return_value.noop.return_value = (250, b'OK')
+        self.SMTP.return_value.sendmail.return_value = {}
+
+    def mensagem(self):
+        return EmailMultiAlternatives('Assunto', 'Corpo', 'loja@fluorita.com', ['cliente@fluorita.com'])
+
+    def test_conexao_smtp_e_reutilizada(self):
+        self.assertEqual(enviar_emails([self.mensagem()]), 1)
+        self.assertEqual(enviar_emails([self.mensagem()]), 1)
+        self.assertEqual(self.SMTP.call_count, 1)
+        self.SMTP.return_value.quit.assert_not_called()
+        self.assertEqual(metricas()['smtp'], {
+            'abertas': 1, 'reutilizadas': 1, 'reconexoes': 0, 'enviados': 2, 'taxa_reutilizacao': 0.5,
+        })
+
+    def test_conexao_derrubada_pelo_servidor_e_reaberta(self):
+        enviar_emails([self.mensagem()])
+        # Parada por muito tempo e o servidor já fechou: o NOOP falha e ela é reaberta
+        self.SMTP.return_value.noop.side_effect = smtplib.SMTPServerDisconnected
+        with mock.patch('loja.conexoes.time.monotonic', return_value=time.monotonic() + 60):
+            conexao_email()
+        self.assertEqual(self.SMTP.call_count, 2)
+
+        # Caiu entre o NOOP e o envio: reabre e tenta mais uma vez
+        self.SMTP.return_value.sendmail.side_effect = [smtplib.SMTPServerDisconnected, {}]
+        self.assertEqual(enviar_emails([self.mensagem()]), 1)
+        self.assertEqual(metricas()['smtp']['reconexoes'], 1)
+
+    def test_metricas_do_banco(self):
+        gerente = User.objects.create_user('gerente', 'gerente@fluorita.com', 'senha-de-teste-123', is_staff=True)
+        self.client.force_login(gerente)
+        # Nos testes a conexão já está aberta: cada requisição a reaproveita
+        self.client.get(reverse('loja:sobre'))
+        connection_created.send(sender=connection.__class__, connection=connection)
+        dados = self.client.get(reverse('loja:painel_conexoes')).json()
+        self.assertEqual(dados['banco']['default'], {'abertas': 1, 'reutilizadas': 2, 'taxa_reutilizacao': 0.6667})
+
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('loja:painel_conexoes')).status_code, 302)
+
+
+@override_settings(LOJA_CARRINHO_ARMAZENAMENTO='loja.carrinho.ArmazenamentoCookie')
+class ViewsAssincronasTest(TestCase):
+    # As views de loja/views_assincronas.py (URLs de fluorita/urls_asgi.py)
+    # precisam mostrar a mesma página que as síncronas
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.massa = Massa()
+        cls.massa.semear(100)
+
+    def setUp(self):
+        cache.clear()
+
+    def paginas(self, url, preparar=None, metodo='get', dados=None):
+        respostas = []
+        for urls, client in (('fluorita.urls', Client()), ('fluorita.urls_asgi', AsyncClient())):
+            client.force_login(self.massa.cliente)
+            if preparar:
+                preparar(client)
+            cache.clear()
+            requisicao = getattr(client, metodo)
+            if isinstance(client, AsyncClient):
+                requisicao = async_to_sync(requisicao)
+            with override_settings(ROOT_URLCONF=urls), CaptureQueriesContext(connection) as consultas:
+                resposta = requisicao(url, dados)
+            respostas.append((resposta, len(consultas)))
+        return respostas
+
+    def test_mesma_pagina_e_mesmas_consultas(self):
+        massa = self.massa
+        carrinho = lambda client: preencher_carrinho(client, massa.carrinho)
+        casos = [
+            (reverse('loja:lista_produtos'), None),
+            (reverse('loja:lista_produtos') + '?categoria=categoria-1&disponivel=true', None),
+            (reverse('loja:detalhe_produto', args=[massa.destaque.slug]), None),
+            (reverse('loja:detalhe_produto', args=[massa.pedido.itens.first().produto.slug]), None),
+            (reverse('loja:detalhe_carrinho'), carrinho),
+            (reverse('loja:meus_pedidos'), None),
+        ]
+        for url, preparar in casos:
+            with self.subTest(url=url):
+                (sincrona, consultas_sincrona), (assincrona, consultas_assincrona) = self.paginas(url, preparar)
+                self.assertEqual(sincrona.status_code, 200)
+                self.assertEqual(assincrona.status_code, 200)
+                self.assertEqual(
+                    self.sem_csrf(sincrona.content.decode()), self.sem_csrf(assincrona.content.decode())
+                )
+                self.assertEqual(consultas_sincrona, consultas_assincrona)
+                self.assertEqual(sincrona.get('ETag'), assincrona.get('ETag'))
+
+    def sem_csrf(self, html):
+        return re.sub(r'name="csrfmiddlewaretoken" value="[^"]+"', '', html)
+
+    def test_get_condicional_e_404(self):
+        url = reverse('loja:detalhe_produto', args=[self.massa.destaque.slug])
+        with override_settings(ROOT_URLCONF='fluorita.urls_asgi'):
+            client = AsyncClient()
+            # A primeira visita cria o cookie do CSRF, que faz parte do ETag
+            async_to_sync(client.get)(url)
+            primeira = async_to_sync(client.get)(url)
+            renders = []
+            with medir_renderizacao(renders), self.assertNumQueries(0):
+                segunda = async_to_sync(client.get)(url, headers={'if-none-match': primeira['ETag']})
+            self.assertEqual(segunda.status_code, 304)
+            self.assertEqual(renders, [])
+            self.assertEqual(async_to_sync(client.get)(reverse('loja:detalhe_produto', args=['nao-existe'])).status_code, 404)
+
+    def test_carrinho(self):
+        produto = self.massa.destaque
+        with override_settings(ROOT_URLCONF='fluorita.urls_asgi'):
+            client = AsyncClient()
+            resposta = async_to_sync(client.post)(reverse('loja:adicionar_ao_carrinho', args=[produto.pk]), {'quantidade': 2})
+            self.assertRedirects(resposta, reverse('loja:lista_produtos'), fetch_redirect_response=False)
+            client.cookies.update(resposta.cookies)
+            pagina = async_to_sync(client.get)(reverse('loja:detalhe_carrinho'))
+            self.assertContains(pagina, produto.nome)
+
+            resposta = async_to_sync(client.get)(reverse('loja:remover_do_carrinho', args=[produto.pk]))
+            client.cookies.update(resposta.cookies)
+            self.assertNotContains(async_to_sync(client.get)(reverse('loja:detalhe_carrinho')), produto.nome)
+
+            resposta = async_to_sync(client.post)(reverse('loja:adicionar_ao_carrinho', args=[10 ** 9]))
+            self.assertEqual(resposta.status_code, 404)
+
+    def test_meus_pedidos_exige_login(self):
+        with override_settings(ROOT_URLCONF='fluorita.urls_asgi'):
+            resposta = async_to_sync(AsyncClient().get)(reverse('loja:meus_pedidos'))
+        self.assertEqual(resposta.status_code, 302)
+
+
+class MedirVazaoTest(TransactionTestCase):
+
+    def test_compara_wsgi_e_asgi(self):
+        categoria = Categoria.objects.create(nome='Quartzos', slug='quartzos')
+        Produto.objects.create(nome='Ametista', slug='ametista', descricao='d', preco=80, categoria=categoria, estoque=5)
+        User.objects.create_user('cliente', 'cliente@fluorita.com', 'senha-de-teste-123')
+        saida = os.path.join(tempfile.mkdtemp(), 'vazao.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(saida))
+
+        call_command(
+            'medir_vazao', requisicoes=4, concorrencia=2, usuario='cliente', host='testserver', saida=saida,
+            stdout=StringIO(),
+        )
+        with open(saida, encoding='utf-8') as arquivo:
+            relatorio = json.load(arquivo)
+        self.assertEqual(set(relatorio['modos']), {'wsgi', 'asgi_sincronas', 'asgi'})
+        for modo, paginas in relatorio['modos'].items():
+            self.assertEqual(set(paginas), {'lista_produtos', 'detalhe_produto', 'detalhe_carrinho', 'meus_pedidos'})
+            for nome, medida in paginas.items():
+                with self.subTest(modo=modo, pagina=nome):
+                    self.assertEqual(medida['requisicoes'], 4)
+                    self.assertEqual(medida['erros'], 0)
+
+
+class AquecimentoTemplatesTest(SimpleTestCase):
+
+    def cache_templates(self):
+        loader, = engines['django'].engine.template_loaders
+        return loader
+
+    def test_templates_da_loja(self):
+        nomes = templates_da_loja()
+        self.assertIn('base.html', nomes)
+        self.assertIn('loja/lista_produtos.html', nomes)
+        self.assertIn('loja/email/confirmacao_pedido.txt', nomes)
+        self.assertIn('loja/parciais/produto_info.html', nomes)
+        self.assertFalse(any(nome.startswith('admin/') for nome in nomes))
+
+    def test_aquecer_deixa_os_templates_no_cache(self):
+        loader = self.cache_templates()
+        loader.reset()
+        self.assertEqual(aquecer_templates(), {})
+        for nome in templates_da_loja():
+            self.assertIn(nome, loader.get_template_cache)
+
+    def test_erro_de_compilacao(self):
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pasta)
+        Path(pasta, 'loja').mkdir()
+        Path(pasta, 'loja', 'quebrado.html').write_text('{% if %}')
+        engines = [dict(settings.TEMPLATES[0], DIRS=[*settings.TEMPLATES[0]['DIRS'], pasta])]
+        with override_settings(TEMPLATES=engines), self.assertLogs('loja.aquecimento', 'ERROR'):
+            self.assertEqual(list(aquecer_templates()), ['loja/quebrado.html'])
+            with self.assertRaisesMessage(CommandError, '1 template(s) com erro.'):
+                call_command('aquecer_templates', stdout=StringIO(), stderr=StringIO())
+
+    def test_comando_mede_frio_e_quente(self):
+        saida = os.path.join(tempfile.mkdtemp(), 'templates.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(saida))
+        call_command('aquecer_templates', medir=True, repeticoes=2, saida=saida, stdout=StringIO())
+        with open(saida, encoding='utf-8') as arquivo:
+            medidas = json.load(arquivo)['templates']
+        self.assertEqual(sorted(medidas), templates_da_loja())
+        self.assertTrue(medidas['loja/lista_produtos.html']['renderiza'])
+        # O e-mail precisa do pedido: só a compilação é medida
+        self.assertFalse(medidas['loja/email/confirmacao_pedido.txt']['renderiza'])
+        for nome, medida in medidas.items():
+            with self.subTest(template=nome):
+                self.assertGreater(medida['frio_ms'], 0)
+                self.assertGreater(medida['quente_ms'], 0)
+        # Termina com tudo no cache
+        self.assertIn('loja/lista_produtos.html', self.cache_templates().get_template_cache)
+
+
+@override_settings(
+    SESSION_ENGINE='django.contrib.sessions.backends.cached_db',
+    LOJA_CARRINHO_ARMAZENAMENTO='loja.carrinho.ArmazenamentoSessao',
+)
+class SessoesTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        categoria = Categoria.objects.create(nome='Quartzos', slug='quartzos')
+        self.produto = Produto.objects.create(
+            nome='Ametista', slug='ametista', descricao='d', preco=80, categoria=categoria, estoque=5,
+        )
+        self.client.force_login(User.objects.create_user('cliente', 'cliente@fluorita.com', 'senha-de-teste-123'))
+
+    def consultas_sessao(self, *requisicoes):
+        with CaptureQueriesContext(connection) as consultas:
+            for metodo, url in requisicoes:
+                getattr(self.client, metodo)(url)
+        return [c['sql'] for c in consultas if 'django_session' in c['sql']]
+
+    def test_paginas_nao_consultam_a_tabela_de_sessoes(self):
+        adicionar = reverse('loja:adicionar_ao_carrinho', args=[self.produto.pk])
+        # Só a requisição que muda o carrinho grava a sessão
+        self.assertEqual(len(self.consultas_sessao(('post', adicionar))), 1)
+        self.assertEqual(self.client.session['carrinho'], f'{self.produto.pk}-1')
+
+        self.assertEqual(self.consultas_sessao(
+            ('get', reverse('loja:lista_produtos')),
+            ('get', reverse('loja:detalhe_produto', args=[self.produto.slug])),
+            ('get', reverse('loja:detalhe_carrinho')),
+            ('get', reverse('loja:meus_pedidos')),
+            # Produto que não está no carrinho: nada muda
+            ('get', reverse('loja:remover_do_carrinho', args=[self.produto.pk + 1])),
+        ), [])
+
+    def test_carrinho_que_volta_ao_que_era_nao_grava(self):
+        request = RequestFactory().get('/')
+        request.session = SessionStore()
+        request.session['carrinho'] = {str(self.produto.pk): 2}  # formato antigo
+        request.session.modified = False
+
+        carrinho = Carrinho(request, ArmazenamentoSessao(request))
+        self.assertEqual(carrinho.quantidades(), {self.produto.pk: 2})
+        carrinho.adicionar(self.produto.pk)
+        carrinho.remover(self.produto.pk)
+        carrinho.adicionar(self.produto.pk, 2)
+        carrinho.persistir(HttpResponse())
+        self.assertFalse(request.session.modified)
+
+        carrinho.adicionar(self.produto.pk)
+        carrinho.persistir(HttpResponse())
+        self.assertTrue(request.session.modified)
+        self.assertEqual(request.session['carrinho'], f'{self.produto.pk}-3')
+
+    def test_limpar_sessoes_expiradas_em_lotes(self):
+        agora = timezone.now()
+        Session.objects.all().delete()
+        Session.objects.bulk_create(
+            [Session(session_key=f'expirada{i}', session_data='', expire_date=agora - timedelta(days=1)) for i in range(5)]
+            + [Session(session_key=f'valida{i}', session_data='', expire_date=agora + timedelta(days=1)) for i in range(2)]
+        )
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(limpar_sessoes_expiradas(lote=2, agora=agora), 5)
+        self.assertEqual(sum(c['sql'].startswith('DELETE') for c in consultas), 3)
+        self.assertEqual(sorted(Session.objects.values_list('session_key', flat=True)), ['valida0', 'valida1'])
+
+        saida = StringIO()
+        call_command('limpar_sessoes', stdout=saida)
+        self.assertIn('0 sessões expiradas apagadas.', saida.getvalue())
+        with override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache'):
+            call_command('limpar_sessoes', stdout=saida)
+        self.assertIn('nada a apagar', saida.getvalue())
+
+
+class CatalogoTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.quartzos = Categoria.objects.create(nome='Quartzos', slug='quartzos')
+        cls.outros = Categoria.objects.create(nome='Outros', slug='outros')
+        Produto.objects.bulk_create([
+            Produto(nome=f'Pedra {i % 3}', slug=f'pedra-{i}', descricao='d', preco=10 + i,
+                    categoria=cls.quartzos if i % 2 else cls.outros, estoque=1, disponivel=i % 5 != 0)
+            for i in range(25)
+        ])
+
+    def percorrer(self, filtros, tamanho):
+        itens, cursor = [], None
+        while True:
+            pagina = pagina_catalogo({**filtros, 'cursor': cursor, 'tamanho': tamanho})
+            itens += [p.pk for p in pagina]
+            if not pagina.tem_proximo:
+                return itens, pagina
+            cursor = pagina.cursor_proximo
+
+    def test_paginas_seguem_a_ordenacao_sem_repetir_nem_pular(self):
+        esperado = list(Produto.objects.order_by('nome', 'id').values_list('pk', flat=True))
+        itens, ultima = self.percorrer({}, 4)
+        self.assertEqual(itens, esperado)
+
+        # Voltando a partir da última página
+        anterior = pagina_catalogo({'cursor': ultima.cursor_anterior, 'tamanho': 4})
+        self.assertEqual([p.pk for p in anterior], esperado[-5:-1])
+        self.assertTrue(anterior.tem_anterior)
+
+    def test_filtros(self):
+        filtros = {'categoria': 'quartzos', 'disponivel': True, 'preco_min': Decimal('15'), 'preco_max': Decimal('30')}
+        itens, _ = self.percorrer(filtros, 3)
+        esperado = Produto.objects.filter(
+            categoria=self.quartzos, disponivel=True, preco__gte=15, preco__lte=30,
+        ).order_by('nome', 'id')
+        self.assertEqual(itens, [p.pk for p in esperado])
+
+    def test_cursor_adulterado_volta_para_a_primeira_pagina(self):
+        primeira = [p.pk for p in pagina_catalogo({'tamanho': 5})]
+        for cursor in ('lixo', codificar_cursor('p', ['Pedra 0']), codificar_cursor('p', ['Pedra 0', 'x'])):
+            with self.subTest(cursor=cursor):
+                self.assertEqual([p.pk for p in pagina_catalogo({'cursor': cursor, 'tamanho': 5})], primeira)
+
+    def test_view_com_filtro_invalido_ignora_os_filtros(self):
+        resposta = self.client.get(reverse('loja:lista_produtos'), {'preco_min': 'abc', 'tamanho': 500})
+        self.assertEqual(resposta.status_code, 200)
+        # Primeira página, no tamanho padrão
+        self.assertEqual(len(resposta.context['produtos']), TAMANHO_PAGINA_PADRAO)
+        self.assertTrue(resposta.context['pagina'].tem_proximo)
+
+
+class AgregadosAvaliacoesTest(TestCase):
+
+    def setUp(self):
+        categoria = Categoria.objects.create(nome='Quartzos', slug='quartzos')
+        self.ametista, self.citrino = [
+            Produto.objects.create(nome=nome, slug=nome.lower(), descricao='d', preco=80, categoria=categoria, estoque=5)
+            for nome in ('Ametista', 'Citrino')
+        ]
+        self.usuarios = [User.objects.create_user(f'avaliador{i}') for i in range(3)]
+
+    def agregados(self, produto):
+        return Produto.objects.values(*Produto.CAMPOS_AGREGADOS).get(pk=produto.pk)
+
+    def esperado(self, *notas):
+        return {
+            'avaliacoes_contagem': len(notas), 'avaliacoes_soma': sum(notas),
+            **{f'avaliacoes_nota_{n}': notas.count(n) for n in range(1, 6)},
+        }
+
+    def test_criar_editar_mover_e_excluir(self):
+        a = Avaliacao.objects.create(produto=self.ametista, usuario=self.usuarios[0], nota=5, comentario='')
+        b = Avaliacao.objects.create(produto=self.ametista, usuario=self.usuarios[1], nota=3, comentario='')
+        self.assertEqual(self.agregados(self.ametista), self.esperado(5, 3))
+
+        b.nota = 1
+        b.save()
+        self.assertEqual(self.agregados(self.ametista), self.esperado(5, 1))
+
+        # Avaliação movida para outro produto
+        a.produto = self.citrino
+        a.save()
+        self.assertEqual(self.agregados(self.ametista), self.esperado(1))
+        self.assertEqual(self.agregados(self.citrino), self.esperado(5))
+
+        # Só o comentário: os agregados não mudam
+        a.comentario = 'Lindo'
+        a.save()
+        self.assertEqual(self.agregados(self.citrino), self.esperado(5))
+
+        b.delete()
+        self.assertEqual(self.agregados(self.ametista), self.esperado())
+        produto = Produto.objects.get(pk=self.citrino.pk)
+        self.assertEqual(produto.media_avaliacoes(), 5)
+        self.assertEqual(produto.histograma_avaliacoes()[0], {'nota': 5, 'quantidade': 1, 'percentual': 100})
+
+    def test_exclusao_em_massa_e_recalculo(self):
+        for usuario, nota in zip(self.usuarios, (2, 4, 4)):
+            Avaliacao.objects.create(produto=self.ametista, usuario=usuario, nota=nota, comentario='')
+        Avaliacao.objects.filter(nota=4).delete()
+        self.assertEqual(self.agregados(self.ametista), self.esperado(2))
+
+        # Agregados corrompidos são reconstruídos pelo comando
+        Produto.objects.filter(pk=self.ametista.pk).update(avaliacoes_contagem=99, avaliacoes_nota_5=7)
+        call_command('recalcular_avaliacoes', stdout=StringIO())
+        self.assertEqual(self.agregados(self.ametista), self.esperado(2))
+        self.assertEqual(self.agregados(self.citrino), self.esperado())
+
+
+class CriarPedidoTest(TestCase):
+
+    def setUp(self):
+        categoria = Categoria.objects.create(nome='Quartzos', slug='quartzos')
+        self.ametista, self.citrino = [
+            Produto.objects.create(nome=nome, slug=nome.lower(), descricao='d', preco=preco, categoria=categoria, estoque=3)
+            for nome, preco in (('Ametista', 80), ('Citrino', 25))
+        ]
+        self.cliente = User.objects.create_user('cliente', 'cliente@fluorita.com', 'senha-de-teste-123')
+        self.endereco = Endereco.objects.create(
+            usuario=self.cliente, logradouro='Rua das Pedras', numero='1', bairro='Centro',
+            cidade='Ouro Preto', estado='MG', cep='35400-000',
+        )
+
+    def estoques(self):
+        return dict(Produto.objects.order_by('id').values_list('slug', 'estoque'))
+
+    def assertNadaGravado(self):
+        self.assertFalse(Pedido.objects.exists())
+        self.assertFalse(ItemPedido.objects.exists())
+        self.assertFalse(EmailPendente.objects.exists())
+        self.assertEqual(self.estoques(), {'ametista': 3, 'citrino': 3})
+
+    def test_varias_linhas(self):
+        pedido = criar_pedido(self.cliente, self.endereco, {str(self.ametista.pk): 2, self.citrino.pk: 3, 999: 0})
+        self.assertEqual(pedido.total, Decimal('235.00'))
+        self.assertEqual(
+            sorted(pedido.itens.values_list('produto__slug', 'quantidade', 'preco')),
+            [('ametista', 2, Decimal('80.00')), ('citrino', 3, Decimal('25.00'))],
+        )
+        self.assertEqual(self.estoques(), {'ametista': 1, 'citrino': 0})
+        self.assertEqual(EmailPendente.objects.get().pedido, pedido)
+
+    def test_estoque_insuficiente_nao_grava_nada(self):
+        with self.assertRaisesMessage(EstoqueInsuficiente, "'Citrino'. Disponível: 3.") as contexto:
+            criar_pedido(self.cliente, self.endereco, {self.ametista.pk: 1, self.citrino.pk: 4})
+        self.assertEqual(contexto.exception.produto, self.citrino)
+        self.assertNadaGravado()
+
+        for quantidades in ({}, {self.ametista.pk: 0}, {999: 1}):
+            with self.subTest(quantidades=quantidades), self.assertRaises(EstoqueInsuficiente):
+                criar_pedido(self.cliente, self.endereco, quantidades)
+        self.assertNadaGravado()
+
+    def test_estoque_levado_depois_da_verificacao_desfaz_o_pedido(self):
+        # Simula outro checkout baixando o estoque entre a verificação (SELECT)
+        # e o UPDATE condicional: a proteção estoque >= quantidade barra a linha
+        bulk_create = ItemPedido.objects.bulk_create
+
+        def concorrente(*args, **kwargs):
+            itens = bulk_create(*args, **kwargs)
+            self.assertTrue(ItemPedido.objects.exists())
+            Produto.objects.filter(pk=self.citrino.pk).update(estoque=1)
+            return itens
+
+        with mock.patch.object(ItemPedido.objects, 'bulk_create', concorrente):
+            with self.assertRaisesMessage(EstoqueInsuficiente, 'acabou de mudar'):
+                criar_pedido(self.cliente, self.endereco, {self.ametista.pk: 1, self.citrino.pk: 2})
+        self.assertNadaGravado()
+
+    def test_view_volta_para_o_carrinho(self):
+        self.client.force_login(self.cliente)
+        preencher_carrinho(self.client, {self.citrino.pk: 5})
+        resposta = self.client.post(reverse('loja:finalizar_pedido'), {'endereco_id': self.endereco.pk}, follow=True)
+        self.assertRedirects(resposta, reverse('loja:detalhe_carrinho'))
+        self.assertIn("Disponível: 3", [str(m) for m in resposta.context['messages']][0])
+        self.assertNadaGravado()
+        # O carrinho continua lá
+        self.assertEqual(resposta.context['carrinho_detalhado'][0]['quantidade'], 5)
+
+
+@skipIf(connection.vendor == 'sqlite', 'O SQLite não trava linhas (SELECT ... FOR UPDATE) nem grava em paralelo')
+class CriarPedidoConcorrenteTest(TransactionTestCase):
+
+    def test_checkouts_simultaneos_nao_vendem_alem_do_estoque(self):
+        categoria = Categoria.objects.create(nome='Quartzos', slug='quartzos')
+        produtos = [
+            Produto.objects.create(nome=nome, slug=nome.lower(), descricao='d', preco=10, categoria=categoria, estoque=5)
+            for nome in ('Ametista', 'Citrino')
+        ]
+        clientes = [User.objects.create_user(f'cliente{i}') for i in range(12)]
+        enderecos = [
+            Endereco.objects.create(usuario=c, logradouro='Rua', numero='1', bairro='B', cidade='C', estado='MG', cep='1')
+            for c in clientes
+        ]
+        barreira = threading.Barrier(len(clientes))
+        resultados = []
+
+        def comprar(cliente, endereco, ordem):
+            try:
+                barreira.wait()
+                # Metade dos clientes coloca os produtos no carrinho na ordem inversa
+                criar_pedido(cliente, endereco, {p.pk: 1 for p in (produtos if ordem else produtos[::-1])})
+                resultados.append(True)
+            except EstoqueInsuficiente:
+                resultados.append(False)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=comprar, args=(c, e, i % 2)) for i, (c, e) in enumerate(zip(clientes, enderecos))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(resultados), len(clientes))
+        self.assertEqual(resultados.count(True), 5)
+        self.assertEqual(list(Produto.objects.order_by('id').values_list('estoque', flat=True)), [0, 0])
+        self.assertEqual(Pedido.objects.count(), 5)
+        self.assertEqual(ItemPedido.objects.count(), 10)
+
+
+class FilaEmailsTest(TestCase):
+
+    def setUp(self):
+        self.cliente = User.objects.create_user('cliente', 'cliente@fluorita.com', 'senha-de-teste-123')
+        endereco = Endereco.objects.create(
+            usuario=self.cliente, logradouro='Rua das Pedras', numero='1', bairro='Centro',
+            cidade='Ouro Preto', estado='MG', cep='35400-000',
+        )
+        categoria = Categoria.objects.create(nome='Quartzos', slug='quartzos')
+        produto = Produto.objects.create(nome='Ametista', slug='ametista', descricao='d', preco=80, categoria=categoria, estoque=10)
+        self.pedidos = [criar_pedido(self.cliente, endereco, {produto.pk: 1}) for _ in range(3)]
+        fechar_conexao_email()
+        self.addCleanup(fechar_conexao_email)
+
+    def test_envia_o_lote_e_marca_como_enviado(self):
+        self.assertEqual(EmailPendente.objects.filter(status='pendente').count(), 3)
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(processar_fila(lote=2), (2, 0))
+        # Fila, pedidos (com usuário e endereço), itens, produtos e um UPDATE em lote
+        self.assertEqual(len([c for c in consultas if 'SAVEPOINT' not in c['sql']]), 5)
+        self.assertEqual(processar_fila(lote=2), (1, 0))
+        self.assertEqual(processar_fila(), (0, 0))
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].to, ['cliente@fluorita.com'])
+        self.assertIn(f'#{self.pedidos[0].pk}', mail.outbox[0].subject)
+        self.assertFalse(EmailPendente.objects.exclude(status='enviado').exists())
+        self.assertFalse(EmailPendente.objects.filter(enviado_em=None).exists())
+
+    def test_backoff_e_limite_de_tentativas(self):
+        EmailPendente.objects.exclude(pedido=self.pedidos[0]).delete()
+        pendente = EmailPendente.objects.get()
+        esperas = []
+        with mock.patch('loja.emails.enviar_emails', side_effect=smtplib.SMTPException('servidor fora')):
+            for _ in range(MAX_TENTATIVAS):
+                antes = timezone.now()
+                self.assertEqual(processar_fila(), (0, 1))
+                pendente.refresh_from_db()
+                esperas.append(round((pendente.proxima_tentativa - antes).total_seconds() / 60))
+                # Ainda não é hora: nada é tentado
+                self.assertEqual(processar_fila(), (0, 0))
+                EmailPendente.objects.update(proxima_tentativa=timezone.now())
+
+        self.assertEqual(esperas[:-1], [1, 2, 4, 8])
+        self.assertEqual(pendente.status, 'falhou')
+        self.assertEqual(pendente.tentativas, MAX_TENTATIVAS)
+        self.assertEqual(pendente.ultimo_erro, 'servidor fora')
+        self.assertEqual(processar_fila(), (0, 0))
+        self.assertEqual(mail.outbox, [])
+
+        # A espera dobra até o máximo de uma hora
+        self.assertEqual([_proxima_espera(t) for t in (1, 6, 7, 20)], [
+            timedelta(minutes=1), timedelta(minutes=32), timedelta(hours=1), timedelta(hours=1),
+        ])
+
+    def test_falha_de_um_email_nao_impede_os_outros(self):
+        enviar = enviar_emails
+
+        def falha_no_segundo(mensagens):
+            if f'#{self.pedidos[1].pk}' in mensagens[0].subject:
+                raise smtplib.SMTPRecipientsRefused({})
+            return enviar(mensagens)
+
+        with mock.patch('loja.emails.enviar_emails', falha_no_segundo):
+            self.assertEqual(processar_fila(), (2, 1))
+        self.assertEqual(
+            dict(EmailPendente.objects.values_list('pedido_id', 'status')),
+            {self.pedidos[0].pk: 'enviado', self.pedidos[1].pk: 'pendente', self.pedidos[2].pk: 'enviado'},
+        )
+
+    def test_acao_do_admin_recoloca_na_fila_e_comando_envia(self):
+        EmailPendente.objects.update(status='falhou', tentativas=MAX_TENTATIVAS)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@fluorita.com', 'senha-de-teste-123'))
+        self.client.post(reverse('admin:loja_emailpendente_changelist'), {
+            'action': 'reenfileirar', '_selected_action': [e.pk for e in EmailPendente.objects.all()[:2]],
+        })
+        self.assertEqual(
+            sorted(EmailPendente.objects.values_list('status', 'tentativas')),
+            [('falhou', MAX_TENTATIVAS), ('pendente', 0), ('pendente', 0)],
+        )
+
+        saida = StringIO()
+        call_command('enviar_emails', stdout=saida)
+        self.assertIn('2 e-mail(s) enviado(s), 0 falha(s)', saida.getvalue())
+        self.assertEqual(len(mail.outbox), 2)
+
+
+@skipIf(connection.vendor == 'sqlite', 'O SQLite não trava linhas (SELECT ... FOR UPDATE SKIP LOCKED)')
+class FilaEmailsConcorrenteTest(TransactionTestCase):
+
+    def test_worker_pula_emails_travados_por_outro(self):
+        cliente = User.objects.create_user('cliente', 'cliente@fluorita.com', 'senha-de-teste-123')
+        pedidos = [Pedido.objects.create(usuario=cliente, total=10) for _ in range(4)]
+        for pedido in pedidos:
+            EmailPendente.objects.create(pedido=pedido)
+        resultado = []
+
+        def outro_worker():
+            try:
+                resultado.append(processar_fila())
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            # Este "worker" trava os dois primeiros; o outro envia só os demais
+            self.assertEqual(len(EmailPendente.objects.select_for_update().order_by('id')[:2]), 2)
+            thread = threading.Thread(target=outro_worker)
+            thread.start()
+            thread.join()
+
+        self.assertEqual(resultado, [(2, 0)])
+        self.assertEqual(
+            list(EmailPendente.objects.order_by('id').values_list('status', flat=True)),
+            ['pendente', 'pendente', 'enviado', 'enviado'],
+        )
+
+
+class CacheProdutoTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.categoria = Categoria.objects.create(nome='Quartzos', slug='quartzos')
+        self.produto = Produto.objects.create(
+            nome='Ametista', slug='ametista', descricao='d', preco=80, categoria=self.categoria, estoque=5,
+        )
+        self.cliente = User.objects.create_user('cliente')
+
+    def test_acerto_sem_consultas_e_invalidacao_pelos_sinais(self):
+        self.assertEqual(snapshot_produto('ametista')['produto'].nome, 'Ametista')
+        with self.assertNumQueries(0):
+            self.assertIn('Ametista', snapshot_produto('ametista')['html_info'])
+        self.assertIsNone(snapshot_produto('nao-existe'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.produto.nome = 'Ametista Roxa'
+            self.produto.save()
+        self.assertIn('Ametista Roxa', snapshot_produto('ametista')['html_info'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Avaliacao.objects.create(produto=self.produto, usuario=self.cliente, nota=4, comentario='Brilha muito')
+        self.assertIn('Brilha muito', snapshot_produto('ametista')['html_avaliacoes'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.categoria.nome = 'Quartzos Raros'
+            self.categoria.save()
+        self.assertEqual(snapshot_produto('ametista')['produto'].categoria.nome, 'Quartzos Raros')
+
+        # Slug trocado: o antigo deixa de existir
+        with self.captureOnCommitCallbacks(execute=True):
+            self.produto.slug = 'ametista-roxa'
+            self.produto.save()
+        self.assertIsNone(snapshot_produto('ametista'))
+
+    @contextmanager
+    def invalidacao_concorrente(self):
+        # Logo depois de a requisição não achar a versão, uma alteração é
+        # confirmada e troca a versão (como invalidar_slugs): ela não pode ser
+        # sobrescrita, e o snapshot vale para ela
+        nova_versao = _nova_versao
+
+        def versao_da_requisicao():
+            cache.set('loja:produto:ametista:versao', 'alteracao')
+            return nova_versao()
+
+        with mock.patch('loja.cache._nova_versao', versao_da_requisicao):
+            yield
+        self.assertEqual(cache.get('loja:produto:ametista:versao'), 'alteracao')
+        self.assertIsNotNone(cache.get('loja:produto:ametista:alteracao'))
+
+    def test_invalidacao_durante_uma_falha_de_cache_vence(self):
+        with self.invalidacao_concorrente():
+            snapshot_produto('ametista')
+
+    def test_versao_assincrona_respeita_a_invalidacao(self):
+        with self.invalidacao_concorrente():
+            async_to_sync(asnapshot_produto)('ametista')
+        with self.assertNumQueries(0):
+            self.assertEqual(snapshot_produto('ametista')['produto'].pk, self.produto.pk)
+
+
+class AvaliacoesPaginadasTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        categoria = Categoria.objects.create(nome='Quartzos', slug='quartzos')
+        cls.produto = Produto.objects.create(nome='Ametista', slug='ametista', descricao='d', preco=80, categoria=categoria)
+        usuarios = User.objects.bulk_create([User(username=f'avaliador{i:02d}') for i in range(25)])
+        Avaliacao.objects.bulk_create([
+            Avaliacao(produto=cls.produto, usuario=u, nota=1 + i % 5, comentario=f'Comentário {i}')
+            for i, u in enumerate(usuarios)
+        ])
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pagina_do_produto_mostra_a_primeira_pagina(self):
+        resposta = self.client.get(reverse('loja:detalhe_produto', args=['ametista']))
+        self.assertContains(resposta, 'Comentário 24')
+        self.assertContains(resposta, 'Comentário 15')
+        self.assertNotContains(resposta, 'Comentário 14')
+        self.assertIsNotNone(resposta.context['cursor_avaliacoes'])
+
+    def test_endpoint_percorre_todas_sem_repetir(self):
+        url = reverse('loja:avaliacoes_produto', args=['ametista'])
+        snapshot_produto('ametista')
+        comentarios, cursor = [], None
+        while True:
+            with self.assertNumQueries(1):
+                dados = self.client.get(url, {'cursor': cursor, 'tamanho': 7} if cursor else {'tamanho': 7}).json()
+            comentarios += [a['comentario'] for a in dados['avaliacoes']]
+            cursor = dados['proximo']
+            if cursor is None:
+                break
+        self.assertEqual(comentarios, [f'Comentário {i}' for i in range(24, -1, -1)])
+        self.assertEqual(set(dados['avaliacoes'][0]), {'nota', 'nota_display', 'comentario', 'usuario', 'criado_em'})
+
+    def test_tamanho_limitado_e_produto_inexistente(self):
+        dados = self.client.get(reverse('loja:avaliacoes_produto', args=['ametista']), {'tamanho': 1000}).json()
+        self.assertEqual(len(dados['avaliacoes']), 25)
+        dados = self.client.get(reverse('loja:avaliacoes_produto', args=['ametista']), {'tamanho': 'x'}).json()
+        self.assertEqual(len(dados['avaliacoes']), 10)
+        self.assertEqual(self.client.get(reverse('loja:avaliacoes_produto', args=['nao-existe'])).status_code, 404)
+
+
+@override_settings(LOJA_CARRINHO_ARMAZENAMENTO='loja.carrinho.ArmazenamentoCookie')
+class CarrinhoTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        categoria = Categoria.objects.create(nome='Quartzos', slug='quartzos')
+        self.ametista, self.citrino = [
+            Produto.objects.create(nome=nome, slug=nome.lower(), descricao='d', preco=preco, categoria=categoria, estoque=5)
+            for nome, preco in (('Ametista', 80), ('Citrino', 25))
+        ]
+
+    def carrinho_da_resposta(self, resposta, armazenamento=ArmazenamentoCookie):
+        # Lê o carrinho gravado na resposta como a próxima requisição leria
+        request = RequestFactory().get('/')
+        request.COOKIES = {nome: cookie.value for nome, cookie in resposta.cookies.items()}
+        request.session = SessionStore()
+        return Carrinho(request, armazenamento(request)).quantidades()
+
+    def test_codificacao_compacta(self):
+        self.assertEqual(codificar({15: 1, 3: 12}), '3-12.15-1')
+        self.assertEqual(decodificar('3-12.15-1'), {'3': '12', '15': '1'})
+        self.assertEqual(decodificar(''), {})
+
+        request = RequestFactory().get('/')
+        resposta = HttpResponse()
+        carrinho = Carrinho(request, ArmazenamentoCookie(request))
+        carrinho.adicionar(self.ametista.pk, 2)
+        carrinho.adicionar(self.citrino.pk)
+        carrinho.adicionar(self.ametista.pk)
+        carrinho.persistir(resposta)
+        self.assertEqual(self.carrinho_da_resposta(resposta), {self.ametista.pk: 3, self.citrino.pk: 1})
+
+    def test_cookie_adulterado_ou_invalido_vira_carrinho_vazio(self):
+        request = RequestFactory().get('/')
+        request.COOKIES = {'carrinho': f'{self.ametista.pk}-99:assinatura-falsa'}
+        self.assertEqual(Carrinho(request, ArmazenamentoCookie(request)).quantidades(), {})
+
+        # Linhas inválidas (assinadas, mas com quantidade zero ou lixo) são descartadas
+        resposta = HttpResponse()
+        resposta.set_signed_cookie(
+            'carrinho', f'{self.ametista.pk}-2.{self.citrino.pk}-0.x-1.7-y', salt=ArmazenamentoCookie.salt,
+        )
+        self.assertEqual(self.carrinho_da_resposta(resposta), {self.ametista.pk: 2})
+
+    def test_limite_de_itens(self):
+        request = RequestFactory().get('/')
+        carrinho = Carrinho(request, ArmazenamentoCookie(request))
+        with mock.patch('loja.carrinho.MAX_ITENS', 1):
+            self.assertTrue(carrinho.adicionar(self.ametista.pk))
+            self.assertFalse(carrinho.adicionar(self.citrino.pk))
+            # Aumentar a quantidade de um produto que já está lá é permitido
+            self.assertTrue(carrinho.adicionar(self.ametista.pk, 4))
+        self.assertEqual(carrinho.quantidades(), {self.ametista.pk: 5})
+
+        resposta = HttpResponse()
+        for produto_id in range(1, MAX_ITENS + 1):
+            carrinho.adicionar(produto_id, 99)
+        carrinho.persistir(resposta)
+        # O cookie com o carrinho cheio ainda cabe no limite dos navegadores
+        self.assertLess(len(resposta.cookies['carrinho'].OutputString()), 4096)
+        self.assertEqual(len(self.carrinho_da_resposta(resposta)), MAX_ITENS)
+
+    @override_settings(LOJA_CARRINHO_ARMAZENAMENTO='loja.carrinho.ArmazenamentoCache')
+    def test_armazenamento_no_cache(self):
+        self.client.post(reverse('loja:adicionar_ao_carrinho', args=[self.citrino.pk]), {'quantidade': 2})
+        self.assertNotIn('carrinho', self.client.cookies)
+        resposta = self.client.get(reverse('loja:detalhe_carrinho'))
+        self.assertEqual(resposta.context['total_carrinho'], Decimal('50.00'))
+
+        # Esvaziado: os itens saem do cache
+        self.client.get(reverse('loja:remover_do_carrinho', args=[self.citrino.pk]))
+        self.assertEqual(self.client.get(reverse('loja:detalhe_carrinho')).context['carrinho_detalhado'], [])
+
+    def test_remover_id_invalido_nao_faz_nada(self):
+        preencher_carrinho(self.client, {self.ametista.pk: 1})
+        resposta = self.client.get(reverse('loja:remover_do_carrinho', args=['abc']))
+        self.assertRedirects(resposta, reverse('loja:detalhe_carrinho'))
+        self.assertEqual(len(self.client.get(reverse('loja:detalhe_carrinho')).context['carrinho_detalhado']), 1)
+
+    @override_settings(ROOT_URLCONF='fluorita.urls_asgi')
+    def test_remover_id_invalido_nao_faz_nada_nas_views_assincronas(self):
+        client = AsyncClient()
+        resposta = async_to_sync(client.get)(reverse('loja:remover_do_carrinho', args=['abc']))
+        self.assertEqual(resposta.status_code, 302)
+        self.assertEqual(resposta['Location'], reverse('loja:detalhe_carrinho'))
@@ -10,6 +10,8 @@ urlpatterns = [
     path('', views.home, name='home'),
     # Adicione esta nova linha para a página de produtos
     path('produtos/', views.lista_produtos, name='lista_produtos'),
+    path('busca/', views.busca, name='busca'),
+    path('busca/autocompletar/', views.autocompletar, name='autocompletar'),
     path('sobre/', views.sobre, name='sobre'),
 
     # Novas URLs de Autenticação
@@ -24,12 +26,18 @@ urlpatterns = [
     path('pedido/finalizar/', views.finalizar_pedido, name='finalizar_pedido'),
     path('meus-pedidos/', views.meus_pedidos, name='meus_pedidos'),
     path('meus-pedidos/<int:pedido_id>/', views.detalhe_pedido, name='detalhe_pedido'),
+    # Painel de vendas da equipe (somente staff)
+    path('painel/vendas/', views.painel_vendas, name='painel_vendas'),
+    # Abertura e reutilização de conexões do processo (JSON, somente staff)
+    path('painel/conexoes/', views.painel_conexoes, name='painel_conexoes'),
     path('meus-enderecos/', views.lista_enderecos, name='lista_enderecos'),
     path('meus-enderecos/adicionar/', views.adicionar_endereco, name='adicionar_endereco'),
     path('checkout/', views.checkout, name='checkout'),
     path('produto/<slug:produto_slug>/', views.detalhe_produto, name='detalhe_produto'),
     path('meu-perfil/', views.perfil, name='perfil'),
     path('produto/<slug:produto_slug>/avaliar/', views.adicionar_avaliacao, name='adicionar_avaliacao'),
+    # Páginas seguintes de avaliações, em JSON (carregadas sob demanda)
+    path('produto/<slug:produto_slug>/avaliacoes/', views.avaliacoes_produto, name='avaliacoes_produto'),
     path(
         'alterar-senha/',
         auth_views.PasswordChangeView.as_view(
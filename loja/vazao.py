@@ -0,0 +1,148 @@
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connections
+from django.test.utils import override_settings
+
+
+# Vazão das páginas de leitura no WSGI e no ASGI, usada pelo comando
+# "python manage.py medir_vazao".
+#
+# As requisições passam pelos handlers de verdade do Django (middlewares,
+# sessão, templates, banco configurado), sem servidor HTTP na frente:
+#   - wsgi: WSGIHandler com as views síncronas, `concorrencia` threads (como
+#     um servidor WSGI com threads, ex: gunicorn --threads);
+#   - asgi_sincronas: ASGIHandler com as mesmas views síncronas, que o Django
+#     roda em threads (o que acontece sem as views assíncronas);
+#   - asgi: ASGIHandler com as views de loja/views_assincronas.py (URLs de
+#     fluorita/urls_asgi.py), `concorrencia` requisições abertas no mesmo
+#     event loop (como um uvicorn com um worker).
+# No ASGI as conexões com o banco não são persistentes (CONN_MAX_AGE=0, como
+# no fluorita/asgi.py): cada requisição roda numa thread própria.
+
+MODOS = {
+    'wsgi': 'fluorita.urls',
+    'asgi_sincronas': 'fluorita.urls',
+    'asgi': 'fluorita.urls_asgi',
+}
+
+
+def _environ(url, cookies, host):
+    caminho, _, consulta = url.partition('?')
+    return {
+        'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': caminho, 'QUERY_STRING': consulta,
+        'SERVER_NAME': host, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': host,
+        'HTTP_COOKIE': cookies, 'REMOTE_ADDR': '127.0.0.1',
+        'wsgi.input': BytesIO(), 'wsgi.errors': BytesIO(), 'wsgi.url_scheme': 'http',
+        'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False, 'wsgi.version': (1, 0),
+    }
+
+
+def _escopo(url, cookies, host):
+    caminho, _, consulta = url.partition('?')
+    return {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': caminho, 'raw_path': caminho.encode(), 'query_string': consulta.encode(), 'root_path': '',
+        'headers': [(b'host', host.encode()), (b'cookie', cookies.encode())],
+        'client': ('127.0.0.1', 0), 'server': (host, 80),
+    }
+
+
+def _requisicao_wsgi(handler, url, cookies, host):
+    status = []
+    inicio = time.perf_counter()
+    resposta = handler(_environ(url, cookies, host), lambda s, cabecalhos: status.append(int(s.split()[0])))
+    b''.join(resposta)
+    # Dispara request_finished, como o servidor faria (fecha ou devolve a conexão com o banco)
+    resposta.close()
+    return time.perf_counter() - inicio, status[0]
+
+
+async def _requisicao_asgi(handler, url, cookies, host):
+    status = []
+    corpo_enviado = False
+
+    async def receive():
+        nonlocal corpo_enviado
+        if not corpo_enviado:
+            corpo_enviado = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # O cliente não desconecta: espera até o Django cancelar
+        await asyncio.Future()
+
+    async def send(mensagem):
+        if mensagem['type'] == 'http.response.start':
+            status.append(mensagem['status'])
+
+    inicio = time.perf_counter()
+    await handler(_escopo(url, cookies, host), receive, send)
+    return time.perf_counter() - inicio, status[0]
+
+
+def _resumo(duracao, resultados):
+    latencias = sorted(r[0] for r in resultados)
+    return {
+        'requisicoes': len(resultados),
+        'por_segundo': round(len(resultados) / duracao, 1),
+        'latencia_p50_ms': round(statistics.median(latencias) * 1000, 2),
+        'latencia_p95_ms': round(latencias[int(len(latencias) * 0.95) - 1] * 1000, 2),
+        'erros': sum(1 for _, status in resultados if status >= 400),
+    }
+
+
+def _medir_wsgi(url, cookies, host, requisicoes, concorrencia):
+    handler = WSGIHandler()
+    _requisicao_wsgi(handler, url, cookies, host)  # aquecimento (middlewares, caches)
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+        resultados = list(executor.map(lambda _: _requisicao_wsgi(handler, url, cookies, host), range(requisicoes)))
+    return _resumo(time.perf_counter() - inicio, resultados)
+
+
+def _medir_asgi(url, cookies, host, requisicoes, concorrencia):
+    handler = ASGIHandler()
+
+    async def executar():
+        await _requisicao_asgi(handler, url, cookies, host)  # aquecimento
+        restantes = iter(range(requisicoes))
+        resultados = []
+
+        async def cliente():
+            # Cada "cliente" faz uma requisição por vez, como uma conexão keep-alive
+            for _ in restantes:
+                resultados.append(await _requisicao_asgi(handler, url, cookies, host))
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(cliente() for _ in range(concorrencia)))
+        return _resumo(time.perf_counter() - inicio, resultados)
+
+    return asyncio.run(executar())
+
+
+def medir(cenarios, modos=tuple(MODOS), requisicoes=200, concorrencia=10, host='localhost'):
+    """
+    `cenarios`: {nome: (url, cookies)}. Retorna {modo: {nome: resumo}} com
+    requisições por segundo, latências (p50 e p95) e respostas com erro.
+    """
+    resultado = {}
+    for modo in modos:
+        medir_modo = _medir_wsgi if modo == 'wsgi' else _medir_asgi
+        max_age = {alias: connections.settings[alias].get('CONN_MAX_AGE', 0) for alias in connections}
+        try:
+            if modo != 'wsgi':
+                for alias in connections:
+                    connections.settings[alias]['CONN_MAX_AGE'] = 0
+            with override_settings(ROOT_URLCONF=MODOS[modo]):
+                resultado[modo] = {
+                    nome: medir_modo(url, cookies, host, requisicoes, concorrencia)
+                    for nome, (url, cookies) in cenarios.items()
+                }
+        finally:
+            for alias, valor in max_age.items():
+                connections.settings[alias]['CONN_MAX_AGE'] = valor
+    return resultado
@@ -0,0 +1,133 @@
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ItemPedido, MarcaProcessamento, Pedido, VendaDiaria
+
+
+# Agregação diária de vendas (VendaDiaria) para o painel de vendas.
+#
+# Cada linha soma os itens de pedido de um dia (data de criação do pedido, no
+# fuso do projeto), de um produto e de um status. O comando
+# "python manage.py atualizar_vendas" usa Pedido.atualizado_em como marca
+# d'água: só os dias que têm pedidos criados ou alterados desde a última
+# execução são recalculados, cada um inteiro e com um GROUP BY no banco. Por
+# isso reprocessar um dia é idempotente e a janela pode ter uma folga.
+#
+# Pedidos excluídos não deixam rastro em atualizado_em: o sinal post_delete
+# de Pedido recalcula o dia dele na hora (loja/signals.py).
+
+MARCA = 'vendas'
+# Transações que gravaram antes da marca, mas terminaram depois dela, entram na próxima execução
+FOLGA = timedelta(minutes=5)
+# Dias recalculados por transação
+DIAS_POR_LOTE = 31
+
+STATUS_SEM_RECEITA = ('cancelado',)
+
+
+def _intervalo(dia):
+    # [meia-noite do dia, meia-noite do dia seguinte) no fuso atual: filtro que usa o índice de criado_em
+    inicio = timezone.make_aware(datetime.combine(dia, time.min))
+    return inicio, timezone.make_aware(datetime.combine(dia + timedelta(days=1), time.min))
+
+
+def recalcular_dias(dias):
+    """
+    Refaz as linhas de VendaDiaria dos dias informados a partir dos itens de
+    pedido. Retorna quantas linhas foram gravadas.
+    """
+    dias = sorted(set(dias))
+    total = 0
+    for inicio in range(0, len(dias), DIAS_POR_LOTE):
+        lote = dias[inicio:inicio + DIAS_POR_LOTE]
+        periodo = Q()
+        for dia in lote:
+            de, ate = _intervalo(dia)
+            periodo |= Q(pedido__criado_em__gte=de, pedido__criado_em__lt=ate)
+        agregados = (
+            ItemPedido.objects.filter(periodo)
+            .annotate(dia=TruncDate('pedido__criado_em'))
+            .values('dia', 'produto_id', 'pedido__status')
+            .annotate(
+                unidades=Sum('quantidade'),
+                valor=Sum(F('preco') * F('quantidade'), output_field=DecimalField(max_digits=14, decimal_places=2)),
+                num_pedidos=Count('pedido_id', distinct=True),
+            )
+            .order_by()
+        )
+        with transaction.atomic():
+            VendaDiaria.objects.filter(dia__in=lote).delete()
+            linhas = VendaDiaria.objects.bulk_create([
+                VendaDiaria(
+                    dia=a['dia'], produto_id=a['produto_id'], status=a['pedido__status'],
+                    quantidade=a['unidades'], receita=a['valor'], pedidos=a['num_pedidos'],
+                )
+                for a in agregados.iterator()
+            ], batch_size=2000)
+        total += len(linhas)
+    return total
+
+
+def atualizar_vendas(completo=False):
+    """
+    Recalcula os dias com pedidos novos ou alterados desde a última execução
+    (ou todos, com completo=True ou na primeira vez) e avança a marca d'água.
+    Retorna a quantidade de dias recalculados.
+    """
+    limite = timezone.now()
+    marca = MarcaProcessamento.objects.filter(nome=MARCA).first()
+
+    pedidos = Pedido.objects.all()
+    if marca is not None and not completo:
+        pedidos = pedidos.filter(atualizado_em__gt=marca.processado_ate - FOLGA, atualizado_em__lte=limite)
+    dias = set(pedidos.annotate(dia=TruncDate('criado_em')).values_list('dia', flat=True).distinct().order_by())
+
+    if marca is None or completo:
+        # Dias que não têm mais pedidos também precisam sumir
+        VendaDiaria.objects.exclude(dia__in=dias).delete()
+    recalcular_dias(dias)
+
+    MarcaProcessamento.objects.update_or_create(nome=MARCA, defaults={'processado_ate': limite})
+    return len(dias)
+
+
+def dia_do_pedido(pedido):
+    return timezone.localdate(pedido.criado_em)
+
+
+# --- Consultas do painel (só leem VendaDiaria) ---
+
+def _somas():
+    return {'total_receita': Sum('receita'), 'total_unidades': Sum('quantidade')}
+
+
+def resumo_vendas(inicio, fim, limite_produtos=10):
+    """
+    Totais do período [inicio, fim] (datas inclusivas), sem pedidos cancelados:
+    por dia, por categoria e os produtos que mais faturaram.
+    """
+    vendas = VendaDiaria.objects.filter(dia__gte=inicio, dia__lte=fim).exclude(status__in=STATUS_SEM_RECEITA)
+    nomes_status = dict(Pedido.STATUS_CHOICES)
+    por_status = list(
+        VendaDiaria.objects.filter(dia__gte=inicio, dia__lte=fim).values('status').annotate(**_somas()).order_by('status')
+    )
+    for linha in por_status:
+        linha['status_display'] = nomes_status.get(linha['status'], linha['status'])
+    return {
+        'totais': vendas.aggregate(**_somas()),
+        'por_dia': list(vendas.values('dia').annotate(**_somas()).order_by('dia')),
+        'por_categoria': list(
+            vendas.values('produto__categoria__nome').annotate(**_somas()).order_by('-total_receita', 'produto__categoria__nome')
+        ),
+        'top_produtos': list(
+            vendas.values('produto_id', 'produto__nome', 'produto__slug')
+            .annotate(**_somas(), num_pedidos=Sum('pedidos'))
+            .order_by('-total_receita', 'produto_id')[:limite_produtos]
+        ),
+        'por_status': por_status,
+        'processado_ate': MarcaProcessamento.objects.filter(nome=MARCA).values_list('processado_ate', flat=True).first(),
+    }
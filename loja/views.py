@@ -1,38 +1,93 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from .models import Produto, Pedido, ItemPedido, Endereco, Avaliacao
-from .forms import EnderecoForm, UserUpdateForm, AvaliacaoForm
+from django.http import Http404, JsonResponse
+from django.urls import reverse
+from django.utils import timezone
+from datetime import timedelta
+from .models import Categoria, Produto, Pedido, Endereco, Avaliacao
+from .forms import EnderecoForm, UserUpdateForm, AvaliacaoForm, FiltroCatalogoForm, BuscaForm, PeriodoVendasForm
+from .autocompletar import LIMITE_MAXIMO, LIMITE_PADRAO, sugerir
+from .busca import facetas_busca, pagina_busca
+from .catalogo import pagina_avaliacoes, pagina_catalogo
+from .pedidos import criar_pedido, EstoqueInsuficiente, pagina_historico, pedidos_detalhados
+from .cache import fragmentos, snapshot_produto
+from .elegibilidade import pode_avaliar_produto
+from .conexoes import metricas as metricas_conexoes
+from .condicional import (
+    etag_catalogo, etag_produto, pode_avaliar, snapshot_da_requisicao,
+    ultima_modificacao_catalogo, ultima_modificacao_produto,
+)
+from .paginacao import limitar_tamanho
+from .replicas import leitura_na_replica
+from .vendas import resumo_vendas
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib import messages
-from decimal import Decimal
 from django.contrib.auth.decorators import login_required
-from django.db import transaction
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
-from django.utils.html import strip_tags
-from django.db.models import Avg, Count
+from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 
 
 # Esta é a função que a nossa URL chama
 def home(request):
     return render(request, 'loja/home.html')
 
+# GET condicional (loja/condicional.py): com a versão atual no navegador a
+# resposta é um 304, sem renderizar. "private, no-cache" porque a página
+# leva o token do CSRF do visitante.
+@leitura_na_replica
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=etag_catalogo, last_modified_func=ultima_modificacao_catalogo)
 def lista_produtos(request):
-    # 1. A consulta ao banco de dados: Pega TODOS os objetos do modelo Produto.
-    # produtos = Produto.objects.all() subistituo para pegar a media de avaliação e contagem
-    produtos = Produto.objects.annotate(
-        media_avaliacoes=Avg('avaliacoes__nota'),
-        contagem_avaliacoes=Count('avaliacoes')
-    ).all()
-
-    # 2. O contexto: Um dicionário que leva os dados para o template.
+    # 1. Valida os filtros da URL (categoria, disponibilidade, faixa de preço e cursor).
+    # Filtros inválidos são ignorados em vez de quebrar a página.
+    form = FiltroCatalogoForm(request.GET)
+    filtros = form.cleaned_data if form.is_valid() else {}
+
+    # 2. Busca apenas a página pedida, paginada por chave (keyset), com a
+    # categoria via JOIN. As notas já vêm agregadas no próprio produto.
+    pagina = pagina_catalogo(filtros)
+
+    # 3. O contexto: Um dicionário que leva os dados para o template.
     # A chave 'produtos' será o nome da variável no HTML.
     context = {
-        'produtos': produtos
+        'produtos': pagina.itens,
+        'pagina': pagina,
+        'categorias': Categoria.objects.order_by('nome'),
+        'filtro_form': form,
     }
 
-    # 3. Renderiza o template, passando o contexto com os nossos produtos.
+    # 4. Renderiza o template, passando o contexto com os nossos produtos.
     return render(request, 'loja/lista_produtos.html', context)
 
+def busca(request):
+    # Busca pelo índice de termos (loja/busca.py): uma consulta para os
+    # produtos, já ordenados por relevância, e outra para as facetas por categoria
+    form = BuscaForm(request.GET)
+    filtros = form.cleaned_data if form.is_valid() else {}
+
+    pagina = pagina_busca(filtros)
+
+    context = {
+        'produtos': pagina.itens,
+        'pagina': pagina,
+        'facetas': facetas_busca(filtros),
+        'busca_form': form,
+        'consulta': filtros.get('q', ''),
+    }
+    return render(request, 'loja/busca.html', context)
+
+def autocompletar(request):
+    # Sugestões para a caixa de busca, servidas do índice em memória
+    # (loja/autocompletar.py): nenhuma consulta ao banco no caminho comum
+    limite = limitar_tamanho(request.GET.get('limite'), padrao=LIMITE_PADRAO, maximo=LIMITE_MAXIMO)
+    sugestoes = sugerir(request.GET.get('q', '')[:100], limite)
+    return JsonResponse({
+        'resultados': [
+            {'nome': nome, 'slug': slug, 'url': reverse('loja:detalhe_produto', args=[slug])}
+            for _, nome, slug in sugestoes
+        ],
+    })
+
 def sobre(request):
     # Como a página é estática, apenas renderizamos o template.
     return render(request, 'loja/sobre.html')
@@ -57,50 +112,26 @@ def cadastro(request):
 
 def adicionar_ao_carrinho(request, produto_id):
     # Garante que o produto existe antes de tentar adicioná-lo
-    produto = get_object_or_404(Produto, id=produto_id)
-
-    # Pega o carrinho da sessão atual, ou cria um dicionário vazio se não houver carrinho
-    carrinho = request.session.get('carrinho', {})
-
-    # Pega a quantidade do formulário (request.POST)
-    quantidade = int(request.POST.get('quantidade', 1))
+    if not Produto.objects.filter(id=produto_id).exists():
+        raise Http404('Produto não encontrado')
 
-    produto_id_str = str(produto_id)
-
-    # Lógica para adicionar ou atualizar a quantidade do produto no carrinho
-    if produto_id_str in carrinho:
-        carrinho[produto_id_str]['quantidade'] += quantidade
-    else:
-        carrinho[produto_id_str] = {
-            'produto_id': produto_id,
-            'nome': produto.nome,
-            'preco': str(produto.preco), # Armazenamos como string para evitar problemas de serialização
-            'quantidade': quantidade,
-        }
+    # Pega a quantidade do formulário (request.POST); valores inválidos viram 1
+    try:
+        quantidade = max(1, int(request.POST.get('quantidade', 1)))
+    except ValueError:
+        quantidade = 1
 
-    # Salva o carrinho de volta na sessão
-    request.session['carrinho'] = carrinho
+    # O carrinho (request.carrinho) guarda só {produto_id: quantidade} e é gravado
+    # pelo CarrinhoMiddleware na resposta, conforme LOJA_CARRINHO_ARMAZENAMENTO
+    if not request.carrinho.adicionar(produto_id, quantidade):
+        messages.error(request, 'Seu carrinho atingiu o limite de itens diferentes.')
 
     # Redireciona o usuário de volta para a lista de produtos
     return redirect('loja:lista_produtos')
 
 def detalhe_carrinho(request):
-    carrinho = request.session.get('carrinho', {})
-    carrinho_detalhado = []
-    total_carrinho = Decimal('0.00')
-
-    # Itera sobre os itens no carrinho da sessão para processá-los
-    for produto_id, item_data in carrinho.items():
-        subtotal = Decimal(item_data['preco']) * int(item_data['quantidade'])
-        total_carrinho += subtotal
-
-        carrinho_detalhado.append({
-            'produto_id': produto_id,
-            'nome': item_data['nome'],
-            'preco': Decimal(item_data['preco']),
-            'quantidade': item_data['quantidade'],
-            'subtotal': subtotal,
-        })
+    # Nome e preço atuais de todos os itens vêm de uma única consulta (in_bulk)
+    carrinho_detalhado, total_carrinho = request.carrinho.itens_detalhados()
 
     context = {
         'carrinho_detalhado': carrinho_detalhado,
@@ -109,30 +140,29 @@ def detalhe_carrinho(request):
     return render(request, 'loja/detalhe_carrinho.html', context)
 
 def remover_do_carrinho(request, produto_id):
-    carrinho = request.session.get('carrinho', {})
-    produto_id_str = str(produto_id) # Garante que a chave é uma string
-
-    if produto_id_str in carrinho:
-        del carrinho[produto_id_str]
-        request.session['carrinho'] = carrinho # Salva as alterações na sessão
-
+    request.carrinho.remover(produto_id)
     return redirect('loja:detalhe_carrinho')
 
+@leitura_na_replica
 @login_required
 def meus_pedidos(request):
-    # Filtra os pedidos para pegar apenas os do usuário logado
-    # e ordena pelos mais recentes primeiro.
-    pedidos = Pedido.objects.filter(usuario=request.user).order_by('-criado_em')
+    # Apenas os pedidos do usuário logado, dos mais recentes para os mais antigos,
+    # uma página por vez (paginação por cursor) e já com a quantidade de itens
+    pagina = pagina_historico(request.user, request.GET.get('cursor'), request.GET.get('tamanho'))
     context = {
-        'pedidos': pedidos
+        'pedidos': pagina.itens,
+        'pagina': pagina,
     }
     return render(request, 'loja/meus_pedidos.html', context)
 
+@leitura_na_replica
 @login_required
 def detalhe_pedido(request, pedido_id):
     # A adição de 'usuario=request.user' aqui é uma medida de segurança CRUCIAL.
     # Garante que um usuário não possa ver o pedido de outro apenas adivinhando a URL.
-    pedido = get_object_or_404(Pedido, id=pedido_id, usuario=request.user)
+    # Endereço e itens (com os produtos) vêm junto: o número de consultas não
+    # depende da quantidade de itens do pedido.
+    pedido = get_object_or_404(pedidos_detalhados(), id=pedido_id, usuario=request.user)
     context = {
         'pedido': pedido
     }
@@ -162,16 +192,17 @@ def adicionar_endereco(request):
 def checkout(request):
     # Pega os endereços do usuário logado
     enderecos = Endereco.objects.filter(usuario=request.user)
-    # Pega o carrinho da sessão para exibir um resumo
-    carrinho = request.session.get('carrinho', {})
-
-    if not carrinho:
+    if not request.carrinho:
         messages.error(request, "Seu carrinho está vazio.")
         return redirect('loja:lista_produtos')
 
+    # Resumo do carrinho com nomes e preços atuais
+    carrinho_detalhado, total_carrinho = request.carrinho.itens_detalhados()
+
     context = {
         'enderecos': enderecos,
-        'carrinho': carrinho.values() # Passa os valores do carrinho para o template
+        'carrinho': carrinho_detalhado,
+        'total_carrinho': total_carrinho,
     }
     return render(request, 'loja/checkout.html', context)
 
@@ -181,11 +212,10 @@ def finalizar_pedido(request):
     if request.method != 'POST':
         return redirect('loja:checkout') # Se não for POST, volta para a seleção de endereço
 
-    carrinho = request.session.get('carrinho', {})
     endereco_id = request.POST.get('endereco_id')
 
     # Validações
-    if not carrinho:
+    if not request.carrinho:
         messages.error(request, "Seu carrinho está vazio.")
         return redirect('loja:lista_produtos')
     if not endereco_id:
@@ -196,72 +226,28 @@ def finalizar_pedido(request):
         endereco_selecionado = Endereco.objects.get(id=endereco_id, usuario=request.user)
     except Endereco.DoesNotExist:
         messages.error(request, "Endereço inválido.")
-        return redirect('checkout')
+        return redirect('loja:checkout')
 
 
     try:
-        # A transação garante que todas as operações de banco de dados abaixo
-        # ou funcionam todas juntas, ou nenhuma delas funciona.
-        # Isso evita inconsistências (ex: criar pedido mas não atualizar o estoque).
-        with transaction.atomic():
-            # PASSO 1: Verificação de estoque ANTES de criar o pedido
-            for produto_id, item_data in carrinho.items():
-                produto = get_object_or_404(Produto, id=produto_id)
-                quantidade_pedida = int(item_data['quantidade'])
-
-                if produto.estoque < quantidade_pedida:
-                    # Se um item não tiver estoque, interrompe tudo
-                    messages.error(request,
-                                   f"Desculpe, não temos estoque suficiente para '{produto.nome}'. Disponível: {produto.estoque}.")
-                    return redirect('loja:detalhe_carrinho')  # Redireciona de volta para o carrinho
-
-            # Se o loop acima terminar sem problemas, significa que há estoque para tudo.
-            # Agora podemos continuar com a criação do pedido.
-
-            # ... (a lógica de cálculo do total continua a mesma) ...
-            total_carrinho = Decimal('0.00')
-            for produto_id, item_data in carrinho.items():
-                total_carrinho += Decimal(item_data['preco']) * int(item_data['quantidade'])
-
-            # Cria o objeto Pedido
-            pedido = Pedido.objects.create(
-                usuario=request.user,
-                total=total_carrinho,
-                endereco_entrega=endereco_selecionado
-            )
-
-            # Cria os objetos ItemPedido E ATUALIZA o estoque
-            for produto_id, item_data in carrinho.items():
-                produto = get_object_or_404(Produto, id=produto_id)
-                quantidade_pedida = int(item_data['quantidade'])
-
-                ItemPedido.objects.create(
-                    pedido=pedido,
-                    produto=produto,
-                    preco=Decimal(item_data['preco']),
-                    quantidade=quantidade_pedida
-                )
-
-                # PASSO 2: Dedução do estoque
-                produto.estoque -= quantidade_pedida
-                produto.save()  # Salva a nova quantidade no banco
-
+        # criar_pedido trava os produtos do carrinho (SELECT ... FOR UPDATE, em
+        # ordem de id), cria o pedido e os itens em lote e baixa o estoque com um
+        # único UPDATE condicional. Ou funciona tudo junto, ou nada é gravado.
+        pedido = criar_pedido(request.user, endereco_selecionado, request.carrinho.quantidades())
+    except EstoqueInsuficiente as e:
+        # Se um item não tiver estoque, nada foi gravado: volta para o carrinho
+        messages.error(request, str(e))
+        return redirect('loja:detalhe_carrinho')
     except Exception as e:
         # Em caso de qualquer outro erro inesperado, avisa o usuário.
         messages.error(request, f"Ocorreu um erro ao processar seu pedido: {e}")
         return redirect('loja:checkout')
 
-        # --- FIM DA NOVA LÓGICA ---
+    # Esvazia o carrinho
+    request.carrinho.limpar()
 
-        # Limpa o carrinho da sessão
-    del request.session['carrinho']
-
-    # Envia o e-mail de confirmação
-    try:
-        enviar_email_confirmacao_pedido(pedido)
-    except Exception as e:
-        # Se o envio de e-mail falhar, não quebra o site, apenas avisa no console.
-        print(f"Erro ao enviar e-mail de confirmação: {e}")
+    # O e-mail de confirmação já foi colocado na fila por criar_pedido e será
+    # enviado pelo worker ("python manage.py enviar_emails"), fora desta requisição.
 
     messages.success(request, f'Pedido #{pedido.id} realizado com sucesso!')
     return redirect('loja:meus_pedidos')
@@ -284,54 +270,55 @@ def perfil(request):
     }
     return render(request, 'loja/perfil.html', context)
 
+@leitura_na_replica
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=etag_produto, last_modified_func=ultima_modificacao_produto)
 def detalhe_produto(request, produto_slug):
-    # Busca o produto pelo slug ou retorna um erro 404 (Página não encontrada)
-    produto = get_object_or_404(Produto, slug=produto_slug)
-    # adiciono campos para avaliação
-    avaliacoes = produto.avaliacoes.all()
+    # A parte da página que não depende do usuário (produto, categoria, notas e
+    # avaliações) vem de um snapshot em cache, invalidado pelos sinais.
+    # Num acerto de cache, nenhuma consulta é feita para montá-la. O mesmo
+    # snapshot já foi usado para calcular o ETag (loja/condicional.py).
+    snapshot = snapshot_da_requisicao(request, produto_slug)
+    if snapshot is None:
+        raise Http404('Produto não encontrado')
+    produto = snapshot['produto']
+    html_info, html_avaliacoes = fragmentos(snapshot)
     avaliacao_form = AvaliacaoForm()
 
-
-    pode_avaliar = False
-    if request.user.is_authenticated:
-        # Verifica se o usuário comprou o produto e o pedido foi entregue
-        comprou_produto = Pedido.objects.filter(
-            usuario=request.user,
-            itens__produto=produto,
-            status='entregue'
-        ).exists()
-
-        # Verifica se o usuário ainda não avaliou o produto
-        ja_avaliou = Avaliacao.objects.filter(produto=produto, usuario=request.user).exists()
-
-        if comprou_produto and not ja_avaliou:
-            pode_avaliar = True
-
+    # Daqui para baixo, apenas o que depende do usuário é calculado por requisição:
+    # se ele comprou o produto, o pedido foi entregue e ainda não o avaliou
     context = {
         'produto': produto,
-        'avaliacoes': avaliacoes,
-        'pode_avaliar': pode_avaliar,
+        'html_info': html_info,
+        'html_avaliacoes': html_avaliacoes,
+        'cursor_avaliacoes': snapshot.get('cursor_avaliacoes'),
+        'pode_avaliar': pode_avaliar(request, produto),
         'avaliacao_form': avaliacao_form,
     }
     return render(request, 'loja/detalhe_produto.html', context)
 
-def enviar_email_confirmacao_pedido(pedido):
-    subject = f'Confirmação do Pedido #{pedido.id} - Loja Fluorita'
-
-    # O e-mail do destinatário é o e-mail do usuário que fez o pedido
-    recipient_list = [pedido.usuario.email]
-
-    # Renderiza o template HTML para uma string
-    html_message = render_to_string('loja/email/confirmacao_pedido.html', {'pedido': pedido})
-
-    # Cria a versão em texto puro removendo as tags HTML
-    plain_message = strip_tags(html_message)
-
-    # E-mail do remetente (pode ser qualquer coisa nesta fase)
-    from_email = 'nao-responda@fluorita.com'
-
-    send_mail(subject, plain_message, from_email, recipient_list, html_message=html_message)
-
+def avaliacoes_produto(request, produto_slug):
+    # Endpoint JSON usado pelo botão "Carregar mais avaliações" da página de produto.
+    # O id do produto vem do snapshot em cache, então cada página custa uma consulta.
+    snapshot = snapshot_produto(produto_slug)
+    if snapshot is None:
+        raise Http404('Produto não encontrado')
+
+    pagina = pagina_avaliacoes(snapshot['produto'].id, request.GET.get('cursor'), request.GET.get('tamanho'))
+    dados = {
+        'avaliacoes': [
+            {
+                'nota': avaliacao.nota,
+                'nota_display': avaliacao.get_nota_display(),
+                'comentario': avaliacao.comentario,
+                'usuario': avaliacao.usuario.username,
+                'criado_em': avaliacao.criado_em.isoformat(),
+            }
+            for avaliacao in pagina
+        ],
+        'proximo': pagina.cursor_proximo,
+    }
+    return JsonResponse(dados)
 
 @login_required
 def adicionar_avaliacao(request, produto_slug):
@@ -339,9 +326,10 @@ def adicionar_avaliacao(request, produto_slug):
     if request.method == 'POST':
         form = AvaliacaoForm(request.POST)
         if form.is_valid():
-            # Verifica se o usuário já avaliou este produto
-            if Avaliacao.objects.filter(produto=produto, usuario=request.user).exists():
-                messages.error(request, 'Você já avaliou este produto.')
+            # Só quem recebeu o produto e ainda não o avaliou (uma consulta pelo
+            # índice de CompraEntregue, veja loja/elegibilidade.py)
+            if not pode_avaliar_produto(request.user, produto):
+                messages.error(request, 'Você precisa ter recebido este produto e ainda não tê-lo avaliado.')
             else:
                 avaliacao = form.save(commit=False)
                 avaliacao.produto = produto
@@ -349,4 +337,31 @@ def adicionar_avaliacao(request, produto_slug):
                 avaliacao.save()
                 messages.success(request, 'Obrigado pela sua avaliação!')
     # Redireciona de volta para a página do produto, seja sucesso ou falha
-    return redirect('loja:detalhe_produto', produto_slug=produto.slug)
\ No newline at end of file
+    return redirect('loja:detalhe_produto', produto_slug=produto.slug)
+
+# Dias mostrados no painel de vendas quando o período não é informado
+DIAS_PAINEL_VENDAS = 30
+
+@staff_member_required
+def painel_vendas(request):
+    # Lê só as vendas já agregadas (VendaDiaria, loja/vendas.py), nunca os itens
+    # de pedido: o custo não cresce com o número de pedidos
+    form = PeriodoVendasForm(request.GET)
+    periodo = form.cleaned_data if form.is_valid() else {}
+    fim = periodo.get('fim') or timezone.localdate()
+    inicio = periodo.get('inicio') or fim - timedelta(days=DIAS_PAINEL_VENDAS - 1)
+
+    context = {
+        'form': form,
+        'inicio': inicio,
+        'fim': fim,
+        **resumo_vendas(inicio, fim),
+    }
+    return render(request, 'loja/painel_vendas.html', context)
+
+
+@staff_member_required
+def painel_conexoes(request):
+    # Métricas de conexões (banco e SMTP) do processo que atendeu a requisição,
+    # em JSON para o monitoramento coletar de cada worker
+    return JsonResponse(metricas_conexoes())
@@ -0,0 +1,133 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.http import Http404
+from django.shortcuts import redirect, render
+from django.views.decorators.cache import cache_control
+
+from .carrinho import acarregar_carrinho
+from .catalogo import apagina_catalogo
+from .cache import fragmentos
+from .condicional import (
+    condicao_assincrona, etag_catalogo, etag_produto, pode_avaliar, preparar_catalogo, preparar_produto,
+    snapshot_da_requisicao, ultima_modificacao_catalogo, ultima_modificacao_produto,
+)
+from .forms import AvaliacaoForm, FiltroCatalogoForm
+from .models import Categoria, Produto
+from .pedidos import apagina_historico
+from .replicas import leitura_na_replica
+
+
+# Versões assíncronas das views de leitura mais acessadas, usadas no ASGI
+# (fluorita/asgi.py liga LOJA_VIEWS_ASSINCRONAS e as URLs vêm de
+# fluorita/urls_asgi.py). No WSGI continuam as views de loja/views.py, que
+# fazem o mesmo: as duas versões precisam mostrar exatamente a mesma página.
+#
+# As consultas usam o ORM assíncrono e as que não dependem uma da outra são
+# disparadas juntas com asyncio.gather. O ORM assíncrono do Django ainda roda
+# as consultas de uma requisição numa thread só, uma depois da outra; o ganho
+# está em não prender o event loop: enquanto uma requisição espera o banco ou
+# o cache, o processo atende outras.
+#
+# A renderização fica numa thread (sync_to_async): os templates usam o
+# usuário e as mensagens, que podem ler a sessão no banco.
+
+
+async def _render(request, template, context):
+    return await sync_to_async(render)(request, template, context)
+
+
+async def _lista(queryset):
+    return [objeto async for objeto in queryset]
+
+
+@leitura_na_replica
+@cache_control(private=True, no_cache=True)
+@condicao_assincrona(preparar_catalogo, etag_func=etag_catalogo, last_modified_func=ultima_modificacao_catalogo)
+async def lista_produtos(request):
+    form = FiltroCatalogoForm(request.GET)
+    filtros = form.cleaned_data if form.is_valid() else {}
+
+    # A página de produtos e as categorias do filtro ao mesmo tempo
+    pagina, categorias = await asyncio.gather(
+        apagina_catalogo(filtros), _lista(Categoria.objects.order_by('nome')),
+    )
+    context = {
+        'produtos': pagina.itens,
+        'pagina': pagina,
+        'categorias': categorias,
+        'filtro_form': form,
+    }
+    return await _render(request, 'loja/lista_produtos.html', context)
+
+
+@leitura_na_replica
+@cache_control(private=True, no_cache=True)
+@condicao_assincrona(preparar_produto, etag_func=etag_produto, last_modified_func=ultima_modificacao_produto)
+async def detalhe_produto(request, produto_slug):
+    # preparar_produto já buscou, juntos, o snapshot (produto e avaliações,
+    # também juntos numa falha de cache) e os produtos que o usuário pode avaliar
+    snapshot = snapshot_da_requisicao(request, produto_slug)
+    if snapshot is None:
+        raise Http404('Produto não encontrado')
+    produto = snapshot['produto']
+    html_info, html_avaliacoes = fragmentos(snapshot)
+
+    context = {
+        'produto': produto,
+        'html_info': html_info,
+        'html_avaliacoes': html_avaliacoes,
+        'cursor_avaliacoes': snapshot.get('cursor_avaliacoes'),
+        'pode_avaliar': pode_avaliar(request, produto),
+        'avaliacao_form': AvaliacaoForm(),
+    }
+    return await _render(request, 'loja/detalhe_produto.html', context)
+
+
+async def adicionar_ao_carrinho(request, produto_id):
+    if not await Produto.objects.filter(id=produto_id).aexists():
+        raise Http404('Produto não encontrado')
+
+    try:
+        quantidade = max(1, int(request.POST.get('quantidade', 1)))
+    except ValueError:
+        quantidade = 1
+
+    carrinho = await acarregar_carrinho(request)
+    if not carrinho.adicionar(produto_id, quantidade):
+        messages.error(request, 'Seu carrinho atingiu o limite de itens diferentes.')
+    return redirect('loja:lista_produtos')
+
+
+async def detalhe_carrinho(request):
+    carrinho = await acarregar_carrinho(request)
+    carrinho_detalhado, total_carrinho = await carrinho.aitens_detalhados()
+
+    context = {
+        'carrinho_detalhado': carrinho_detalhado,
+        'total_carrinho': total_carrinho,
+    }
+    return await _render(request, 'loja/detalhe_carrinho.html', context)
+
+
+async def remover_do_carrinho(request, produto_id):
+    carrinho = await acarregar_carrinho(request)
+    carrinho.remover(produto_id)
+    return redirect('loja:detalhe_carrinho')
+
+
+@leitura_na_replica
+@login_required
+async def meus_pedidos(request):
+    # request.auser() e request.user guardam o usuário cada um por si: o que
+    # o login_required já carregou vai para request.user, senão o template
+    # consultaria o usuário de novo
+    request.user = await request.auser()
+    pagina = await apagina_historico(request.user, request.GET.get('cursor'), request.GET.get('tamanho'))
+    context = {
+        'pedidos': pagina.itens,
+        'pagina': pagina,
+    }
+    return await _render(request, 'loja/meus_pedidos.html', context)